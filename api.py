@@ -0,0 +1,364 @@
+"""
+JSON API for scripts and apps, version 1 under /api/v1. It uses the same
+notes.py and users.py functions as the pages. Requests are authenticated
+with a token from POST /api/v1/tokens in an "Authorization: Bearer" header,
+so there are no cookies and no CSRF tokens.
+GET responses have ETags and answer If-None-Match with 304, PUT and DELETE
+of a note check If-Match so a client can't overwrite changes it hasn't seen.
+"""
+import hashlib
+import json
+
+from flask import Blueprint, abort, current_app, g, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+import changes
+import config
+import db
+import hashing
+import limiter
+import notes
+import users
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+@api.errorhandler(HTTPException)
+def error(exception):
+    """Errors as JSON instead of HTML pages."""
+    return jsonify({"error": exception.description}), exception.code
+
+@api.before_request
+def authenticate():
+    """Every endpoint except creating a token needs one."""
+    if request.endpoint == "api.create_token":
+        return
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    token = token.strip()
+    user_id = users.get_token_user(token) if scheme.lower() == "bearer" and token else None
+    if not user_id:
+        abort(401, "A valid token is needed in the Authorization header")
+    g.api_user = user_id
+    g.api_token = token
+
+def make_etag(parts):
+    """ETag for what parts identify, as seen by the current user."""
+    return hashlib.sha1(repr((parts, g.api_user)).encode()).hexdigest()
+
+def conditional(parts, build):
+    """JSON from build() with an ETag, or a 304 without calling build if the client has it already."""
+    etag = make_etag(parts)
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def check_if_match(note_id, access):
+    """412 if the client sent If-Match with an older version of the note. Run it in the
+    write's db.transaction() with access read there, or two clients could both pass it."""
+    if request.if_match and make_etag(("note", note_id, access["version"])) not in request.if_match:
+        abort(412, "The note has changed since it was fetched")
+
+def json_body():
+    """The request's JSON, 400 if there isn't any."""
+    data = request.get_json(silent=True)
+    if data is None:
+        abort(400, "The body must be JSON")
+    return data
+
+def note_fields(data):
+    """Title, content and classes of a note from JSON, 400 if they aren't valid.
+    Classes are "title:value" strings like in the note form."""
+    if not isinstance(data, dict):
+        abort(400, "A note must be an object")
+    title = data.get("title")
+    if not isinstance(title, str) or not title or len(title) > 100:
+        abort(400, "title must be 1-100 characters")
+    content = data.get("content")
+    if not isinstance(content, str) or not content or len(content) > 5000:
+        abort(400, "content must be 1-5000 characters")
+    entries = data.get("classes", [])
+    if not isinstance(entries, list) or not all(isinstance(entry, str) for entry in entries):
+        abort(400, "classes must be a list of \"title:value\" strings")
+    classes = notes.parse_classes(entries)
+    if classes is None:
+        abort(400, "Unknown class in classes")
+    return title, content, classes
+
+def note_json(row):
+    """A row of notes.get_notes_by_ids as JSON."""
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "content": row["content"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+        "version": row["version"],
+        "owner": {"id": row["user_id"], "username": row["username"]},
+        "classes": json.loads(row["classes"]),
+    }
+
+def page_json(page, key):
+    """A keyset page of listing rows as JSON."""
+    return {key: [dict(row) for row in page["rows"]], "next": page["next"], "prev": page["prev"]}
+
+def page_limit():
+    """Page size from ?limit=, kept within the configured bounds."""
+    limit = request.args.get("limit", config.page_size, type=int)
+    return max(1, min(limit, config.max_page_size))
+
+def note_access(note_id, owner=False):
+    """The user's access to the note, 404 or 403 if there's none."""
+    access = notes.get_access(note_id, g.api_user)
+    if not access:
+        abort(404, "No such note")
+    if not access["owner"] and (owner or not access["shared"]):
+        abort(403, "Not your note" if owner else "The note isn't shared with you")
+    return access
+
+@api.route("/tokens", methods=["POST"])
+def create_token():
+    """New token for {"username", "password"}, limited like logins."""
+    data = json_body()
+    username = data.get("username") if isinstance(data, dict) else None
+    password = data.get("password") if isinstance(data, dict) else None
+    if not isinstance(username, str) or not isinstance(password, str):
+        abort(400, "username and password are needed")
+    if (not limiter.allow("user:" + username.lower(), config.login_burst, config.login_rate) or
+            not limiter.allow("address:" + str(request.remote_addr),
+                              config.address_burst, config.address_rate)):
+        abort(429, "Too many login attempts, try again in a minute")
+    try:
+        user_id = users.check_login(username, password)
+    except hashing.Busy:
+        abort(503, "The server is busy, try again in a moment")
+    if not user_id:
+        abort(401, "Invalid username or password")
+    return jsonify({"token": users.create_token(user_id), "user_id": user_id}), 201
+
+@api.route("/tokens", methods=["DELETE"])
+def remove_token():
+    """Revoke the token used for this request."""
+    users.remove_token(g.api_token)
+    return "", 204
+
+@api.route("/classes")
+def list_classes():
+    """The class catalogue, titles with their possible values."""
+    catalogue = notes.get_catalogue()
+    return conditional(("classes", catalogue["version"]), lambda: catalogue["classes"])
+
+@api.route("/notes")
+def list_notes():
+    """A page of the user's notes, newest first. ?before= and ?after= take the next and prev cursors."""
+    me = g.api_user
+    return conditional(("notes", users.get_notes_version(me), request.full_path),
+                       lambda: page_json(notes.get_user_notes(me, request.args.get("before"),
+                                                             request.args.get("after"), page_limit()),
+                                         "notes"))
+
+@api.route("/shared")
+def list_shared():
+    """A page of the notes shared with the user."""
+    me = g.api_user
+    return conditional(("shared", users.get_notes_version(me), request.full_path),
+                       lambda: page_json(notes.get_shared_with_user(me, request.args.get("before"),
+                                                                   request.args.get("after"), page_limit()),
+                                         "notes"))
+
+@api.route("/notes/batch")
+def get_notes_batch():
+    """Many notes in one call, ?ids=1,2,3. Ids of notes that don't exist or that
+    the user can't see are listed in missing."""
+    try:
+        note_ids = sorted({int(note_id) for note_id in request.args.get("ids", "").split(",") if note_id})
+    except ValueError:
+        abort(400, "ids must be numbers separated by commas")
+    if not note_ids or len(note_ids) > config.api_batch_size:
+        abort(400, "Give 1-" + str(config.api_batch_size) + " ids")
+    rows = notes.get_notes_by_ids(note_ids, g.api_user)
+    found = {row["id"] for row in rows}
+    parts = ("batch", tuple((row["id"], row["version"]) for row in rows), tuple(note_ids))
+    return conditional(parts, lambda: {"notes": [note_json(row) for row in rows],
+                                       "missing": [note_id for note_id in note_ids if note_id not in found]})
+
+@api.route("/notes/<int:note_id>")
+def get_note(note_id):
+    """One note with its classes. The ETag also works for If-Match when changing it."""
+    access = note_access(note_id)
+
+    def build():
+        rows = notes.get_notes_by_ids([note_id], g.api_user)
+        if not rows:
+            abort(404, "No such note")
+        return note_json(rows[0])
+
+    return conditional(("note", note_id, access["version"]), build)
+
+@api.route("/notes", methods=["POST"])
+def create_notes():
+    """Create a note from an object, or many notes from a list of them in one transaction.
+    A single note is returned, for a list only the new ids."""
+    data = json_body()
+    me = g.api_user
+    if isinstance(data, list):
+        if not data or len(data) > config.api_batch_size:
+            abort(400, "Give 1-" + str(config.api_batch_size) + " notes")
+        fields = [note_fields(note) for note in data]
+        with db.transaction():
+            note_ids = [notes.add_note(title, content, me, classes) for title, content, classes in fields]
+        return jsonify({"ids": note_ids}), 201
+
+    title, content, classes = note_fields(data)
+    note_id = notes.add_note(title, content, me, classes)
+    response = get_note(note_id)
+    response.status_code = 201
+    response.headers["Location"] = "/api/v1/notes/" + str(note_id)
+    return response
+
+@api.route("/notes/<int:note_id>", methods=["PUT"])
+def update_note(note_id):
+    """Replace the title, content and classes of a note."""
+    note_access(note_id, owner=True)
+    title, content, classes = note_fields(json_body())
+    with db.transaction():
+        # checked again with the write, of two clients with the same ETag only one gets through
+        check_if_match(note_id, note_access(note_id, owner=True))
+        notes.update_note(note_id, title, content, classes)
+    return get_note(note_id)
+
+@api.route("/notes/<int:note_id>", methods=["DELETE"])
+def remove_note(note_id):
+    """Remove a note with its shares and comments."""
+    with db.transaction():
+        check_if_match(note_id, note_access(note_id, owner=True))
+        notes.remove_note(note_id)
+    return "", 204
+
+@api.route("/notes/bulk", methods=["POST"])
+def bulk_notes():
+    """Change many of the user's notes at once, all or nothing:
+    {"action": "delete", "ids": [...]},
+    {"action": "classify", "ids": [...], "classes": ["Status:Done", "Priority:"]} where "title:" removes a class,
+    {"action": "share" or "unshare", "ids": [...], "username": "..."}.
+    Returns how many notes changed."""
+    data = json_body()
+    if not isinstance(data, dict):
+        abort(400, "The body must be an object")
+    note_ids = data.get("ids")
+    if (not isinstance(note_ids, list) or not note_ids or len(note_ids) > config.bulk_size or
+            not all(type(note_id) is int for note_id in note_ids)):
+        abort(400, "ids must be a list of 1-" + str(config.bulk_size) + " note ids")
+    if not notes.owns_notes(note_ids, g.api_user):
+        abort(403, "You don't own all of the notes")
+
+    action = data.get("action")
+    if action == "delete":
+        count = notes.remove_notes(note_ids)
+    elif action == "classify":
+        entries = data.get("classes", [])
+        if not isinstance(entries, list) or not all(isinstance(entry, str) for entry in entries):
+            abort(400, "classes must be a list of \"title:value\" strings")
+        class_changes = notes.parse_class_changes(entries)
+        if class_changes is None:
+            abort(400, "Unknown class in classes")
+        count = notes.reclassify_notes(note_ids, *class_changes)
+    elif action in ("share", "unshare"):
+        target = users.get_user_by_username(str(data.get("username", "")))
+        if not target:
+            abort(404, "No such user")
+        if target["id"] == g.api_user:
+            abort(400, "You already own these notes")
+        if action == "share":
+            count = notes.share_notes(note_ids, target["id"])
+        else:
+            count = notes.unshare_notes(note_ids, target["id"])
+    else:
+        abort(400, "action must be delete, classify, share or unshare")
+    return jsonify({"count": count})
+
+@api.route("/notes/<int:note_id>/shares/<username>", methods=["PUT"])
+def share_note(note_id, username):
+    """Share the note with a user, sharing twice is fine."""
+    note_access(note_id, owner=True)
+    target = users.get_user_by_username(username)
+    if not target:
+        abort(404, "No such user")
+    if target["id"] == g.api_user:
+        abort(400, "You already own this note")
+    notes.add_share(note_id, target["id"])
+    return "", 204
+
+@api.route("/notes/<int:note_id>/shares/<username>", methods=["DELETE"])
+def unshare_note(note_id, username):
+    """Stop sharing the note with a user."""
+    note_access(note_id, owner=True)
+    target = users.get_user_by_username(username)
+    if not target:
+        abort(404, "No such user")
+    notes.remove_share(note_id, target["id"])
+    return "", 204
+
+@api.route("/notes/<int:note_id>/comments")
+def list_comments(note_id):
+    """A page of the note's comments, newest first. ?before= takes the next cursor."""
+    access = note_access(note_id)
+    before = request.args.get("before", type=int)
+
+    def build():
+        limit = config.comments_page_size
+        comments = notes.get_comments(note_id, before, limit + 1)
+        next_cursor = comments[limit - 1]["id"] if len(comments) > limit else None
+        return {"comments": [{"id": comment["id"], "content": comment["content"],
+                              "created_at": comment["created_at"],
+                              "user": {"id": comment["user_id"], "username": comment["username"]}}
+                             for comment in comments[:limit]],
+                "next": next_cursor}
+
+    return conditional(("comments", note_id, access["version"], before), build)
+
+@api.route("/notes/<int:note_id>/comments", methods=["POST"])
+def add_comment(note_id):
+    """Comment on a note, {"content"}."""
+    note_access(note_id)
+    data = json_body()
+    content = data.get("content") if isinstance(data, dict) else None
+    if not isinstance(content, str) or not content.strip() or len(content.strip()) > 2000:
+        abort(400, "content must be 1-2000 characters")
+    comment_id = notes.add_comment(note_id, g.api_user, content.strip())
+    return jsonify({"id": comment_id}), 201
+
+@api.route("/changes")
+def get_changes():
+    """Changes to your own and shared notes after ?since=, ?wait= seconds waits for one.
+    Without since, or with reset true, reload what you have and go on from cursor."""
+    since = changes.parse_cursor(request.args.get("since"))
+    if since is None and request.args.get("since"):
+        abort(400, "since must be a cursor from an earlier response")
+    response = jsonify(changes.poll(g.api_user, since, request.args.get("wait", 0, type=float)))
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@api.route("/search")
+def search():
+    """Search own and shared notes, ?q= with the same syntax as the search page, a page at a time."""
+    query = request.args.get("q", "")
+    page = request.args.get("page", 1, type=int)
+    if page < 1:
+        abort(400, "page must be at least 1")
+    me = g.api_user
+
+    def build():
+        results = notes.search_notes(me, query, page) if query else []
+        limit = config.search_page_size
+        return {"results": [{"id": row["id"], "title": row["title"], "updated_at": row["updated_at"],
+                             "owner": row["owner_username"],
+                             "snippet": row["snippet"].replace("\x02", "").replace("\x03", "")}
+                            for row in results[:limit]],
+                "next_page": page + 1 if len(results) > limit else None}
+
+    # notes_version misses comments, which search also matches, the change cursor has them
+    version = (users.get_notes_version(me), changes.user_cursor(me))
+    return conditional(("search", version, request.full_path), build)
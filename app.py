@@ -2,19 +2,52 @@
 This is the main file, mostly resembling the example app's app.py.
 Note sharing added bothersome complexity.
 """
+import hashlib
+import json
+import os
 import secrets
 import sqlite3
-
-from flask import Flask
-from flask import abort, flash, redirect, render_template, request, session
+import time
+from urllib.parse import urlencode
+
+import click
+from flask import Flask, Response
+from flask import abort, flash, make_response, redirect, render_template, request, session
+from flask import stream_template, stream_with_context
+from jinja2 import FileSystemBytecodeCache
 import markupsafe
 
+from api import api
+import changes
 import config
+import db
+import fragments
+import hashing
+import limiter
+import maintenance
+import metrics
+import migrate
 import notes
+import revisions
+import sessions
 import users
 
 app = Flask(__name__)
 app.secret_key = config.secret_key
+if config.template_cache:
+    # compiled templates are kept on disk so new workers don't compile them again
+    os.makedirs(config.template_cache, exist_ok=True)
+    app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(config.template_cache))
+if config.session_backend == "sqlite":
+    app.session_interface = sessions.SqliteSessionInterface()
+app.teardown_appcontext(db.close_connection)
+app.register_blueprint(api)
+app.before_request(metrics.start_request)
+app.before_request(changes.sweep_changes)
+app.before_request(maintenance.start)
+app.after_request(metrics.finish_request)
+
+_static_hashes = {}
 
 def require_login():
     """Login check used by routes below."""
@@ -28,23 +61,135 @@ def check_csrf():
     if request.form["csrf_token"] != session["csrf_token"]:
         abort(403)
 
+@app.template_global()
+def static_url(filename):
+    """Static file url with a hash of its content, so it can be cached for good."""
+    path = os.path.join(app.static_folder, filename)
+    mtime = os.path.getmtime(path)
+    cached = _static_hashes.get(filename)
+    if not cached or cached[0] != mtime:
+        with open(path, "rb") as f:
+            cached = (mtime, hashlib.sha1(f.read()).hexdigest()[:12])
+        _static_hashes[filename] = cached
+    return "/static/" + filename + "?v=" + cached[1]
+
+@app.after_request
+def cache_static(response):
+    """Hashed static urls never change, so browsers can keep them for a year."""
+    if request.path.startswith("/static/") and "v" in request.args and response.status_code == 200:
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+@app.template_global()
+def note_row(template, note):
+    """A note list row rendered with template, from the fragment cache when the note hasn't changed."""
+    key = (template, note["id"], note["updated_at"], note["version"])
+    html = fragments.get(key)
+    if html is None:
+        html = app.jinja_env.get_template(template).render(note=note)
+        fragments.put(key, html)
+    return markupsafe.Markup(html)
+
 @app.template_filter()
-def show_lines(content):
-    """Newlines to br."""
-    content = str(markupsafe.escape(content))
-    content = content.replace("\n", "<br />")
-    return markupsafe.Markup(content)
+def show_match(text):
+    """Search index marks matches with control characters, those become <mark> tags."""
+    text = str(markupsafe.escape(text))
+    text = text.replace("\x02", "<mark>").replace("\x03", "</mark>")
+    return markupsafe.Markup(text)
+
+# cursors of the index page's two lists, paging one way drops the other way's cursor
+OTHER_CURSOR = {"before": "after", "after": "before",
+                "shared_before": "shared_after", "shared_after": "shared_before"}
+
+@app.template_global()
+def page_url(**cursors):
+    """The current page's url with the given list cursors, the other list's cursor
+    and ?limit= are kept so paging one list doesn't reset the other."""
+    args = request.args.to_dict()
+    for name, value in cursors.items():
+        args.pop(OTHER_CURSOR[name], None)
+        args[name] = value
+    return request.path + "?" + urlencode(args)
+
+def page_limit():
+    """Listing page size from ?limit=, kept within the configured bounds."""
+    limit = request.args.get("limit", config.page_size, type=int)
+    return max(1, min(limit, config.max_page_size))
+
+def cached_page(version, render):
+    """Conditional GET for pages of a logged in user. version identifies what the page shows,
+    together with the url and the session it becomes the ETag. A matching If-None-Match
+    gets a 304 without calling render."""
+    if "_flashes" in session:
+        # flash messages are shown only once so the page can't be reused
+        return render()
+    parts = (version, request.full_path, session.get("user_id"), session.get("csrf_token"))
+    etag = hashlib.sha1(repr(parts).encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def buffered(chunks, size):
+    """Join small pieces of a streamed page to about size characters, so a page isn't
+    sent in hundreds of tiny writes."""
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield "".join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield "".join(buffer)
+
+def render_page(template_name, **context):
+    """render_template for the note list pages, but sent while it renders so the whole
+    page is never in memory at once. Flash messages are taken from the session while
+    rendering and a streamed page is too late to save that, so those pages aren't streamed."""
+    if "_flashes" in session:
+        return render_template(template_name, **context)
+    return buffered(stream_template(template_name, **context), config.stream_buffer_size)
 
 @app.route("/")
 def index():
-    """Homepage index.html."""
+    """Homepage index.html. Both note lists are paged with their own cursors."""
     if "user_id" in session:
         me = session["user_id"]
-        your_notes = notes.get_user_notes(me)
-        shared_notes = notes.get_shared_with_user(me)
-        return render_template("index.html", notes=your_notes, shared_notes=shared_notes)
+
+        def render():
+            limit = page_limit()
+            your_notes = notes.get_user_notes(me, request.args.get("before"),
+                                              request.args.get("after"), limit)
+            shared_notes = notes.get_shared_with_user(me, request.args.get("shared_before"),
+                                                      request.args.get("shared_after"), limit)
+            return render_page("index.html", notes=your_notes["rows"], notes_page=your_notes,
+                                   shared_notes=shared_notes["rows"], shared_page=shared_notes,
+                                   classes=notes.get_all_classes())
+
+        version = (users.get_notes_version(me), notes.get_catalogue()["version"])
+        return cached_page(("index", version), render)
     return render_template("index.html", notes=[], shared_notes=[])
 
+@app.route("/metrics")
+def show_metrics():
+    """Request and SQL metrics of this worker process for Prometheus."""
+    if not config.metrics_enabled or request.remote_addr not in config.metrics_hosts:
+        abort(404)
+    text = metrics.render({
+        "noteapp_db_events_total": db.stats,
+        "noteapp_stats_cache_total": users.stats_cache_stats,
+        "noteapp_username_cache_total": users.prefix_cache_stats,
+        "noteapp_fragment_cache_total": fragments.stats,
+        "noteapp_maintenance_total": maintenance.stats,
+    }, {"noteapp_write_queue_depth": db.queue_depth()})
+    return text, 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
 @app.route("/register")
 def register():
     """Registration with register.html."""
@@ -69,11 +214,19 @@ def create_user():
         flash("ERROR: Password must be at least 3 characters")
         return redirect("/register")
 
+    if not limiter.allow("address:" + str(request.remote_addr),
+                         config.address_burst, config.address_rate):
+        flash("ERROR: Too many attempts, try again in a minute")
+        return redirect("/register")
+
     try:
         users.create_user(username, password1)
     except sqlite3.IntegrityError:
         flash("ERROR: Username is already taken")
         return redirect("/register")
+    except hashing.Busy:
+        flash("ERROR: The server is busy, try again in a moment")
+        return redirect("/register")
 
     flash("Account created successfully! Please log in.")
     return redirect("/login")
@@ -88,8 +241,21 @@ def login():
         username = request.form["username"]
         password = request.form["password"]
 
-        user_id = users.check_login(username, password)
+        # turned away before hashing anything so a flood of attempts stays cheap
+        if (not limiter.allow("user:" + username.lower(), config.login_burst, config.login_rate) or
+                not limiter.allow("address:" + str(request.remote_addr),
+                                  config.address_burst, config.address_rate)):
+            flash("ERROR: Too many login attempts, try again in a minute")
+            return redirect("/login")
+
+        try:
+            user_id = users.check_login(username, password)
+        except hashing.Busy:
+            flash("ERROR: The server is busy, try again in a moment")
+            return redirect("/login")
         if user_id:
+            if isinstance(session, sessions.ServerSession):
+                session.regenerate()
             session["user_id"] = user_id
             session["username"] = username
             session["csrf_token"] = secrets.token_hex(16)
@@ -109,15 +275,20 @@ def logout():
 
 @app.route("/search")
 def search():
-    """Search notes, own or shared with, with a query."""
+    """Search notes, own or shared with, with a query. Results come a page at a time."""
     require_login()
     query = request.args.get("query")
+    page = request.args.get("page", 1, type=int)
+    if page < 1:
+        abort(404)
     if query:
-        results = notes.search_notes(session["user_id"], query)
+        results = notes.search_notes(session["user_id"], query, page)
     else:
         query = ""
         results = []
-    return render_template("search.html", query=query, results=results)
+    has_next = len(results) > config.search_page_size
+    return render_template("search.html", query=query, results=results[:config.search_page_size],
+                           page=page, has_next=has_next)
 
 @app.route("/new_note")
 def new_note():
@@ -141,17 +312,9 @@ def create_note():
 
     user_id = session["user_id"]
 
-    all_classes = notes.get_all_classes()
-
-    classes = []
-    for entry in request.form.getlist("classes"):
-        if entry:
-            class_title, class_value = entry.split(":")
-            if class_title not in all_classes:
-                abort(403)
-            if class_value not in all_classes[class_title]:
-                abort(403)
-            classes.append((class_title, class_value))
+    classes = notes.parse_classes(request.form.getlist("classes"))
+    if classes is None:
+        abort(403)
 
     note_id = notes.add_note(title, content, user_id, classes)
     return redirect("/note/" + str(note_id))
@@ -160,20 +323,26 @@ def create_note():
 def show_note(note_id):
     """Unique page for each note based on its id. Also shows users shared with and comments."""
     require_login()
-    note = notes.get_note(note_id)
-    if not note:
-        abort(404)
     me = session["user_id"]
-    if note["user_id"] != me and not notes.is_shared_with(note_id, me):
+    access = notes.get_access(note_id, me)
+    if not access:
+        abort(404)
+    if not access["owner"] and not access["shared"]:
         abort(403)
-    classes = notes.get_classes(note_id)
-    shared_users = notes.get_shares(note_id) if note["user_id"] == me else []
-    comments = notes.get_comments(note_id)
-    return render_template("show_note.html",
-                           note=note,
-                           classes=classes,
-                           shared_users=shared_users,
-                           comments=comments)
+
+    def render():
+        comments_before = request.args.get("comments_before", type=int)
+        view = notes.get_note_view(note_id, me, comments_before)
+        if not view:
+            abort(404)
+        return render_template("show_note.html",
+                               note=view["note"],
+                               classes=view["classes"],
+                               shared_users=view["shared_users"],
+                               comments=view["comments"],
+                               comments_next=view["comments_next"])
+
+    return cached_page(("note", note_id, access["version"]), render)
 
 @app.route("/edit_note/<int:note_id>")
 def edit_note(note_id):
@@ -200,11 +369,11 @@ def update_note():
     require_login()
     check_csrf()
 
-    note_id = request.form["note_id"]
-    note = notes.get_note(note_id)
-    if not note:
+    note_id = int(request.form["note_id"])
+    access = notes.get_access(note_id, session["user_id"])
+    if not access:
         abort(404)
-    if note["user_id"] != session["user_id"]:
+    if not access["owner"]:
         abort(403)
 
     title = request.form["title"]
@@ -214,34 +383,85 @@ def update_note():
     if not content or len(content) > 5000:
         abort(403)
 
-    all_classes = notes.get_all_classes()
-
-    classes = []
-    for entry in request.form.getlist("classes"):
-        if entry:
-            class_title, class_value = entry.split(":")
-            if class_title not in all_classes:
-                abort(403)
-            if class_value not in all_classes[class_title]:
-                abort(403)
-            classes.append((class_title, class_value))
+    classes = notes.parse_classes(request.form.getlist("classes"))
+    if classes is None:
+        abort(403)
 
     notes.update_note(note_id, title, content, classes)
 
     return redirect("/note/" + str(note_id))
 
+@app.route("/note/<int:note_id>/history")
+def note_history(note_id):
+    """Revisions of a note, newest first, on note_history.html."""
+    require_login()
+    access = notes.get_access(note_id, session["user_id"])
+    if not access:
+        abort(404)
+    if not access["owner"] and not access["shared"]:
+        abort(403)
+
+    before = request.args.get("before", type=int)
+    limit = config.revisions_page_size
+    rows = revisions.get_revisions(note_id, before, limit + 1)
+    revisions_next = rows[limit - 1]["number"] if len(rows) > limit else None
+    return render_template("note_history.html", note=notes.get_note(note_id),
+                           revisions=rows[:limit], revisions_next=revisions_next,
+                           latest=not before)
+
+@app.route("/note/<int:note_id>/history/<int:number>")
+def show_revision(note_id, number):
+    """One earlier version of a note, on show_revision.html."""
+    require_login()
+    access = notes.get_access(note_id, session["user_id"])
+    if not access:
+        abort(404)
+    if not access["owner"] and not access["shared"]:
+        abort(403)
+
+    revision = revisions.get_revision(note_id, number)
+    if not revision:
+        abort(404)
+    return render_template("show_revision.html", note=notes.get_note(note_id), revision=revision,
+                           content_html=notes.render_content(revision["content"]))
+
+@app.route("/note/<int:note_id>/restore", methods=["POST"])
+def restore_revision(note_id):
+    """Make an earlier version the note's content again. It's an edit like any other,
+    so it becomes the newest revision and nothing is lost."""
+    require_login()
+    check_csrf()
+    access = notes.get_access(note_id, session["user_id"])
+    if not access:
+        abort(404)
+    if not access["owner"]:
+        abort(403)
+
+    number = request.form.get("number", type=int)
+    revision = revisions.get_revision(note_id, number) if number else None
+    if not revision:
+        abort(404)
+    # classes taken out of the catalogue since are left out
+    all_classes = notes.get_all_classes()
+    classes = [(title, value) for title, value in revision["classes"]
+               if value in all_classes.get(title, ())]
+    notes.update_note(note_id, revision["title"], revision["content"], classes, restored_from=number)
+    flash("Restored revision " + str(number))
+    return redirect("/note/" + str(note_id))
+
 @app.route("/remove_note/<int:note_id>", methods=["GET", "POST"])
 def remove_note(note_id):
     """Note removal with remove_note.html."""
     require_login()
 
-    note = notes.get_note(note_id)
-    if not note:
+    access = notes.get_access(note_id, session["user_id"])
+    if not access:
         abort(404)
-    if note["user_id"] != session["user_id"]:
+    if not access["owner"]:
         abort(403)
 
     if request.method == "GET":
+        note = notes.get_note(note_id)
         return render_template("remove_note.html", note=note)
 
     if request.method == "POST":
@@ -252,6 +472,51 @@ def remove_note(note_id):
         else:
             return redirect("/note/" + str(note_id))
 
+@app.route("/bulk_notes", methods=["POST"])
+def bulk_notes():
+    """Delete, reclassify, share or unshare the notes selected on the index page, all at once."""
+    require_login()
+    check_csrf()
+    me = session["user_id"]
+
+    try:
+        note_ids = [int(note_id) for note_id in request.form.getlist("note_ids")]
+    except ValueError:
+        abort(403)
+    if not note_ids:
+        flash("ERROR: No notes selected")
+        return redirect("/")
+    if len(note_ids) > config.bulk_size or not notes.owns_notes(note_ids, me):
+        abort(403)
+
+    action = request.form["action"]
+    if action == "delete":
+        count = notes.remove_notes(note_ids)
+        flash("Removed " + str(count) + " notes")
+    elif action == "classify":
+        class_changes = notes.parse_class_changes(request.form.getlist("classes"))
+        if class_changes is None:
+            abort(403)
+        notes.reclassify_notes(note_ids, *class_changes)
+        flash("Updated classes of " + str(len(set(note_ids))) + " notes")
+    elif action in ("share", "unshare"):
+        target = users.get_user_by_username(request.form.get("username", "").strip())
+        if not target:
+            flash("ERROR: User not found")
+            return redirect("/")
+        if target["id"] == me:
+            flash("ERROR: You already own these notes")
+            return redirect("/")
+        if action == "share":
+            count = notes.share_notes(note_ids, target["id"])
+            flash("Shared " + str(count) + " notes with " + target["username"])
+        else:
+            count = notes.unshare_notes(note_ids, target["id"])
+            flash("Stopped sharing " + str(count) + " notes with " + target["username"])
+    else:
+        abort(403)
+    return redirect("/")
+
 @app.route("/share_note", methods=["POST"])
 def share_note():
     """Processing note sharing with other users."""
@@ -261,8 +526,8 @@ def share_note():
     note_id = int(request.form["note_id"])
     username = request.form["username"].strip()
 
-    note = notes.get_note(note_id)
-    if not note or note["user_id"] != session["user_id"]:
+    access = notes.get_access(note_id, session["user_id"])
+    if not access or not access["owner"]:
         abort(403)
 
     target = users.get_user_by_username(username)
@@ -273,14 +538,23 @@ def share_note():
         flash("ERROR: You already own this note")
         return redirect("/note/" + str(note_id))
 
-    if not notes.is_shared_with(note_id, target["id"]):
-        notes.add_share(note_id, target["id"])
+    if notes.add_share(note_id, target["id"]):
         flash("Shared with " + target["username"])
     else:
         flash("Already shared with " + target["username"])
 
     return redirect("/note/" + str(note_id))
 
+@app.route("/complete_username")
+def complete_username():
+    """Suggestions of users shared with before for the share forms as JSON,
+    fetched by static/share.js as you type."""
+    require_login()
+    prefix = request.args.get("prefix", "")[:20]
+    response = make_response({"users": users.complete_username(session["user_id"], prefix)})
+    response.headers["Cache-Control"] = "private, max-age=" + str(config.username_cache_seconds)
+    return response
+
 @app.route("/unshare_note", methods=["POST"])
 def unshare_note():
     """Removal of a share with another user."""
@@ -290,8 +564,8 @@ def unshare_note():
     note_id = int(request.form["note_id"])
     user_id = int(request.form["user_id"])
 
-    note = notes.get_note(note_id)
-    if not note or note["user_id"] != session["user_id"]:
+    access = notes.get_access(note_id, session["user_id"])
+    if not access or not access["owner"]:
         abort(403)
 
     notes.remove_share(note_id, user_id)
@@ -308,11 +582,11 @@ def add_comment():
     if not content or len(content) > 2000:
         flash("ERROR: Comment can be at most 2000 characters")
         return redirect("/note/" + str(note_id))
-    note = notes.get_note(note_id)
-    if not note:
-        abort(404)
     me = session["user_id"]
-    if note["user_id"] != me and not notes.is_shared_with(note_id, me):
+    access = notes.get_access(note_id, me)
+    if not access:
+        abort(404)
+    if not access["owner"] and not access["shared"]:
         abort(403)
     notes.add_comment(note_id, me, content)
     return redirect("/note/" + str(note_id))
@@ -324,14 +598,11 @@ def edit_comment(comment_id):
     comment = notes.get_comment(comment_id)
     if not comment:
         abort(404)
-    note = notes.get_note(comment["note_id"])
-    if not note:
-        abort(404)
     me = session["user_id"]
     if comment["user_id"] != me:
         abort(403)
     if request.method == "GET":
-        return render_template("edit_comment.html", comment=comment, note=note)
+        return render_template("edit_comment.html", comment=comment)
     check_csrf()
     content = request.form["content"].strip()
     if not content or len(content) > 2000:
@@ -348,9 +619,6 @@ def remove_comment(comment_id):
     comment = notes.get_comment(comment_id)
     if not comment:
         abort(404)
-    note = notes.get_note(comment["note_id"])
-    if not note:
-        abort(404)
     me = session["user_id"]
     if comment["user_id"] != me:
         abort(403)
@@ -366,15 +634,159 @@ def show_user(user_id):
 
     # only own notes for now
     if "user_id" in session and session["user_id"] == user_id:
-        user_notes = users.get_notes(user_id)
-        note_stats = users.get_note_stats(user_id)
-    else:
-        user_notes = []
-        note_stats = None
+        def render():
+            notes_page = users.get_notes(user_id, request.args.get("before"),
+                                         request.args.get("after"), page_limit())
+            note_stats = users.get_note_stats(user_id)
+            return render_page("show_user.html", user=user, notes=notes_page["rows"],
+                                   notes_page=notes_page, stats=note_stats)
+
+        return cached_page(("user", users.get_notes_version(user_id)), render)
 
-    return render_template("show_user.html", user=user, notes=user_notes, stats=note_stats)
+    return render_template("show_user.html", user=user, notes=[], notes_page=None, stats=None)
+
+@app.route("/export")
+def export():
+    """Download all of your notes as NDJSON, streamed so it works for any number of notes."""
+    require_login()
+    me = session["user_id"]
+
+    def lines():
+        for note in notes.export_notes(me):
+            yield json.dumps(note, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(lines()), mimetype="application/x-ndjson",
+                    headers={"Content-Disposition": "attachment; filename=notes.ndjson"})
+
+@app.route("/changes")
+def show_changes():
+    """Changes to notes you can see after ?since=, as JSON for scripts on an open page.
+    ?wait= seconds waits for one to happen, asking for text/event-stream streams them."""
+    require_login()
+    me = session["user_id"]
+    since = changes.parse_cursor(request.headers.get("Last-Event-ID", request.args.get("since")))
+    if since is None and request.args.get("since"):
+        abort(400)
+    if request.accept_mimetypes.best_match(["application/json", "text/event-stream"]) == "text/event-stream":
+        return stream_changes(me, since)
+    response = make_response(changes.poll(me, since, request.args.get("wait", 0, type=float)))
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+def stream_changes(me, since):
+    """Server-sent events of the changes until changes_stream_seconds, then the browser
+    reconnects with the id of the last event it got."""
+    if not changes.claim_waiter():
+        return "Too many open change streams", 503, {"Retry-After": "5"}
+
+    def events():
+        cursor = since
+        end = time.monotonic() + config.changes_stream_seconds
+        while time.monotonic() < end:
+            result = changes.poll(me, cursor)
+            if result["reset"] or cursor is None:
+                yield "id: " + str(result["cursor"]) + "\nevent: reset\ndata: {}\n\n"
+            for change in result["changes"]:
+                yield "id: " + str(change["id"]) + "\ndata: " + json.dumps(change) + "\n\n"
+            cursor = result["cursor"]
+            if not result["changes"] and not changes.wait_for_changes(me, cursor, config.changes_heartbeat):
+                yield ": keep-alive\n\n"
+
+    response = Response(stream_with_context(events()), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+    response.call_on_close(changes.release_waiter)
+    return response
+
+def create_app():
+    """App factory for WSGI servers, see wsgi.py and serve.py.
+    Puts the database in WAL mode so readers aren't blocked by writers."""
+    db.setup_database()
+    return app
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Upgrade database.db to the newest schema."""
+    done = migrate.migrate()
+    for filename in done:
+        print("Applied " + filename)
+    if not done:
+        print("Database is up to date")
+
+@app.cli.command("export-notes")
+@click.argument("username")
+@click.argument("output", type=click.File("w"), default="-")
+def export_notes_command(username, output):
+    """Write a user's notes as NDJSON to OUTPUT (stdout by default)."""
+    user = users.get_user_by_username(username)
+    if not user:
+        raise click.ClickException("No user " + username)
+    for note in notes.export_notes(user["id"]):
+        output.write(json.dumps(note, ensure_ascii=False) + "\n")
+
+@app.cli.command("import-notes")
+@click.argument("username")
+@click.argument("input", type=click.File("r"), default="-")
+def import_notes_command(username, input):
+    """Add notes exported as NDJSON to a user. Nothing is added if a line is invalid."""
+    user = users.get_user_by_username(username)
+    if not user:
+        raise click.ClickException("No user " + username)
+    try:
+        counts = notes.import_notes(user["id"], input)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    print("Imported {notes} notes, {shares} shares and {comments} comments. Skipped "
+          "{skipped_shares} shares and {skipped_comments} comments that didn't match "
+          "another user here".format(**counts))
+
+@app.cli.command("verify-classes")
+def verify_classes_command():
+    """Check that the notes class columns match note_classes."""
+    note_ids = notes.check_class_columns()
+    if note_ids:
+        print("Class columns out of sync for notes " + ", ".join(map(str, note_ids)))
+        raise SystemExit(1)
+    print("Class columns are in sync")
+
+@app.cli.command("backfill-classes")
+def backfill_classes_command():
+    """Copy note_classes into the notes class columns where they differ."""
+    note_ids = notes.sync_class_columns()
+    print("Backfilled " + str(len(note_ids)) + " notes")
+
+@app.cli.command("rebuild-search")
+def rebuild_search_command():
+    """Rebuild the full-text search index from notes and comments."""
+    notes.rebuild_search()
+    print("Search index rebuilt")
+
+@app.cli.command("maintain")
+@click.option("--task", "tasks", multiple=True, type=click.Choice(maintenance.TASKS),
+              help="Only this task, can be given many times.")
+@click.option("--force", is_flag=True, help="Run the tasks even if they aren't due.")
+@click.option("--full", is_flag=True, help="integrity_check instead of the quicker quick_check.")
+@click.option("--enable-vacuum", is_flag=True,
+              help="Switch the database to incremental vacuum, rewrites the whole file.")
+@click.option("--status", is_flag=True, help="Show the last report of each task.")
+def maintain_command(tasks, force, full, enable_vacuum, status):
+    """Run the database maintenance tasks that are due, for example from cron."""
+    if status:
+        for task, report in maintenance.last_reports().items():
+            print(task + ": " + json.dumps(report))
+        return
+    if enable_vacuum:
+        print("Incremental vacuum enabled: " + json.dumps(maintenance.enable_vacuum()))
+        return
+    reports = maintenance.run_due(tasks or maintenance.TASKS, force, full)
+    for report in reports:
+        print(report["task"] + ": " + json.dumps(report))
+    if not reports:
+        print("No tasks due")
+    if any(report.get("ok") is False for report in reports):
+        raise SystemExit(1)
 
 # "localhost" url wasn't working with the example app execution, only ip was
 # so instead of "flask run" it's "python3 app.py"
+# this is the development server, serve.py is for real use
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", debug=True)
+    create_app().run(host="0.0.0.0", debug=True)
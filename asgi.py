@@ -0,0 +1,127 @@
+"""
+ASGI entry point for asyncio servers. Flask and sqlite3 block, so every
+request runs in a bounded thread pool while the event loop only holds the
+connections: an idle keep-alive client costs a coroutine, not a thread.
+Works with any ASGI server (uvicorn asgi:application), or with
+serve.py --asyncio that needs only the standard library.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import io
+import sys
+
+from app import create_app
+import config
+
+class ThreadPoolASGIApp:
+    """Runs a WSGI app for ASGI http requests in a thread pool. The response is
+    streamed back to the event loop chunk by chunk so streamed exports still work."""
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.pool = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            raise ValueError("Only http is supported, not " + scope["type"])
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.threads)
+
+        body = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+
+        loop = asyncio.get_running_loop()
+        environ = self.environ(scope, b"".join(body))
+        await loop.run_in_executor(self.pool, self.run, environ, loop, send)
+
+    async def lifespan(self, receive, send):
+        """Startup and shutdown messages of servers that send them."""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.pool is not None:
+                    self.pool.shutdown()
+                    self.pool = None
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def environ(self, scope, body):
+        """WSGI environ of an ASGI http scope."""
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+            "PATH_INFO": scope["path"].encode().decode("latin-1"),
+            "QUERY_STRING": scope["query_string"].decode("latin-1"),
+            "SERVER_NAME": str(server[0]),
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope["headers"]:
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                name = "HTTP_" + name
+            environ[name] = environ[name] + "," + value if name in environ else value
+        return environ
+
+    def run(self, environ, loop, send):
+        """Call the WSGI app in a pool thread, handing the response to send on the event loop."""
+        started = []
+        sent = []
+
+        def call(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def send_start():
+            if not sent:
+                status, headers = started
+                call({"type": "http.response.start", "status": int(status.split(" ", 1)[0]),
+                      "headers": [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                  for name, value in headers]})
+                sent.append(True)
+
+        def write(data):
+            send_start()
+            call({"type": "http.response.body", "body": data, "more_body": True})
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and sent:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started[:] = [status, headers]
+            return write
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for data in result:
+                if data:
+                    write(data)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        send_start()
+        call({"type": "http.response.body", "body": b"", "more_body": False})
+
+application = ThreadPoolASGIApp(create_app(), config.asgi_threads)
@@ -0,0 +1,32 @@
+"""
+Benchmarks for the app. Run them from the app folder, for example:
+python3 -m benchmark.writes
+They use a throwaway database so database.db isn't touched.
+"""
+import os
+import sqlite3
+import tempfile
+
+import config
+import db
+import migrate
+
+def create_database(path, migrated=True):
+    """Create a database with the schema and classes at path and point config.database to it."""
+    db.close_connection()
+    db.close_pool()
+    con = sqlite3.connect(path)
+    with open("schema.sql") as f:
+        con.executescript(f.read())
+    with open("init.sql") as f:
+        con.executescript(f.read())
+    con.close()
+    config.database = path
+    if migrated:
+        migrate.migrate()
+    return path
+
+def fresh_database(migrated=False):
+    """Point config.database to a new temporary database."""
+    path = os.path.join(tempfile.mkdtemp(prefix="noteapp-bench-"), "database.db")
+    return create_database(path, migrated)
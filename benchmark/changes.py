@@ -0,0 +1,57 @@
+"""
+Cost of polling /changes as the database grows. A poll with nothing new and
+a poll with a few new changes are timed with 10x and 100x more notes and
+comments in the database, the times and statement counts should stay the same.
+python3 -m benchmark.changes [--rounds N]
+"""
+import argparse
+import time
+
+import benchmark
+from benchmark.generate import generate
+from benchmark.routes import percentile
+import changes
+import db
+import notes
+
+def time_polls(user_id, since, rounds):
+    """Median and p99 seconds of changes.poll, and statements per poll."""
+    statements = db.stats["statements"]
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        changes.poll(user_id, since)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return percentile(latencies, 0.5), percentile(latencies, 0.99), (db.stats["statements"] - statements) / rounds
+
+def run(notes_per_user, rounds):
+    """Poll timings for one database size."""
+    benchmark.fresh_database(migrated=True)
+    user_ids = generate(users=20, notes_per_user=notes_per_user)
+    reader, writer = user_ids[0], user_ids[1]
+    note_count = db.query("SELECT COUNT(*) AS count FROM notes")[0]["count"]
+    comment_count = db.query("SELECT COUNT(*) AS count FROM comments")[0]["count"]
+    change_count = db.query("SELECT COUNT(*) AS count FROM changes")[0]["count"]
+
+    since = changes.latest_cursor()
+    empty = time_polls(reader, since, rounds)
+    note_id = notes.add_note("Shared", "Watched by the reader", writer, [])
+    notes.add_share(note_id, reader)
+    for i in range(9):
+        notes.add_comment(note_id, writer, "Comment " + str(i))
+    ten = time_polls(reader, since, rounds)
+    db.close_connection()
+    print(f"{note_count:7} notes {comment_count:7} comments {change_count:7} changes  "
+          f"nothing new p50 {empty[0] * 1e6:6.0f} us p99 {empty[1] * 1e6:6.0f} us {empty[2]:.0f} queries  "
+          f"10 new p50 {ten[0] * 1e6:6.0f} us p99 {ten[1] * 1e6:6.0f} us {ten[2]:.0f} queries")
+
+def main():
+    parser = argparse.ArgumentParser(description="Cost of polling /changes as the database grows.")
+    parser.add_argument("--rounds", type=int, default=2000, help="polls timed per database size")
+    rounds = parser.parse_args().rounds
+    for notes_per_user in (10, 100, 1000):
+        run(notes_per_user, rounds)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Throughput of exporting a big user's notes as NDJSON and importing them
+back to another user, with the peak memory of each.
+python3 -m benchmark.export_import [--notes N]
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import benchmark
+from benchmark import generate
+import db
+import notes
+import users
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and memory of exporting and importing notes.")
+    parser.add_argument("--notes", type=int, default=20000)
+    count = parser.parse_args().notes
+    benchmark.fresh_database(migrated=True)
+    print(f"Generating {count} notes...")
+    user_ids = generate.generate(users=3, notes_per_user=count // 3, share_fanout=1,
+                                 comments_per_note=1)
+    users.create_user("importer", "importer")
+    importer = users.get_user_by_username("importer")["id"]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    lines = []
+    size = 0
+    for user_id in user_ids:
+        for note in notes.export_notes(user_id):
+            line = json.dumps(note, ensure_ascii=False) + "\n"
+            size += len(line)
+            lines.append(line)
+    elapsed = time.perf_counter() - start
+    # the lines list is kept for the import, so the streaming part is measured without it
+    peak = tracemalloc.get_traced_memory()[1] - sum(sys.getsizeof(line) for line in lines)
+    print(f"export  {len(lines)} notes  {size / 1e6:6.1f} MB  {elapsed:6.2f} s  "
+          f"{len(lines) / elapsed:8.0f} notes/s  peak {max(peak, 0) / 1e6:5.1f} MB besides output")
+
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    counts = notes.import_notes(importer, iter(lines))
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    print(f"import  {counts['notes']} notes  {counts['comments']} comments  {elapsed:6.2f} s  "
+          f"{counts['notes'] / elapsed:8.0f} notes/s  peak {peak / 1e6:5.1f} MB, "
+          f"{db.stats['commits']} commits in total")
+
+if __name__ == "__main__":
+    main()
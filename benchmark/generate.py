@@ -0,0 +1,91 @@
+"""
+Fills a database with synthetic users, notes, shares and comments.
+The same seed always gives the same data so runs can be compared.
+Notes, shares and comments go through the notes.py functions, one
+transaction per user so they're written in bulk.
+
+python3 -m benchmark.generate --database bench.db --users 50 --notes 200
+"""
+import argparse
+import os
+import random
+
+from werkzeug.security import generate_password_hash
+
+import benchmark
+import config
+import db
+import notes
+
+WORDS = ("meeting project budget idea plan list call report travel draft review "
+         "design garden recipe book movie music health workout lunch family "
+         "friday monday deadline release server bug feature client invoice").split()
+
+PASSWORD = "benchmark"
+
+def sentence(rng, words):
+    """Some random words."""
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def pick_classes(rng, catalogue, probability):
+    """Each class title gets a random value with the given probability."""
+    classes = []
+    for title, values in catalogue.items():
+        if rng.random() < probability:
+            classes.append((title, rng.choice(values)))
+    return classes
+
+def generate(users=20, notes_per_user=100, share_fanout=2, comments_per_note=3,
+             class_probability=0.7, seed=1):
+    """Fill config.database, returns the created user ids."""
+    rng = random.Random(seed)
+    catalogue = notes.get_all_classes()
+
+    # users are inserted directly with one shared hash, hashing each password
+    # would take longer than everything else together
+    password_hash = generate_password_hash(PASSWORD)
+    first = db.query("SELECT COALESCE(MAX(id), 0) + 1 AS id FROM users")[0]["id"]
+    user_ids = list(range(first, first + users))
+    db.executemany("INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)",
+                   [(user_id, "user" + str(user_id), password_hash) for user_id in user_ids])
+
+    for user_id in user_ids:
+        others = [other for other in user_ids if other != user_id]
+        with db.transaction():
+            for _ in range(notes_per_user):
+                title = sentence(rng, rng.randint(2, 6)).capitalize()
+                content = "\n".join(sentence(rng, rng.randint(5, 20))
+                                    for _ in range(rng.randint(1, 8)))
+                classes = pick_classes(rng, catalogue, class_probability)
+                note_id = notes.add_note(title, content, user_id, classes)
+
+                shared_with = rng.sample(others, min(len(others), rng.randint(0, share_fanout)))
+                for other in shared_with:
+                    notes.add_share(note_id, other)
+                commenters = [user_id] + shared_with
+                for _ in range(rng.randint(0, comments_per_note * 2)):
+                    notes.add_comment(note_id, rng.choice(commenters), sentence(rng, rng.randint(3, 15)))
+    return user_ids
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic data for benchmarks.")
+    parser.add_argument("--database", default=config.database)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--notes", type=int, default=100, help="notes per user")
+    parser.add_argument("--shares", type=int, default=2, help="max users a note is shared with")
+    parser.add_argument("--comments", type=int, default=3, help="average comments per note")
+    parser.add_argument("--classes", type=float, default=0.7,
+                        help="probability that a note has a value for each class")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        config.database = args.database
+    else:
+        benchmark.create_database(args.database)
+    user_ids = generate(args.users, args.notes, args.shares, args.comments, args.classes, args.seed)
+    print(f"Created {len(user_ids)} users with {args.notes} notes each in {args.database}, "
+          f"password is {PASSWORD}")
+
+if __name__ == "__main__":
+    main()
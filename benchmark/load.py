@@ -0,0 +1,103 @@
+"""
+Load test against serve.py. Starts the server with 1 worker and then with
+one worker per core on a seeded temporary database, and hammers the note
+list and note pages from several client processes.
+python3 -m benchmark.load [--seconds S] [--clients N]
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import benchmark
+import config
+import db
+import notes
+import users
+
+PORT = 8765
+
+def seed(note_count=200):
+    """A user with some notes, returns the note ids."""
+    benchmark.fresh_database(migrated=True)
+    db.setup_database()
+    users.create_user("loadtest", "loadtest")
+    user_id = users.get_user_by_username("loadtest")["id"]
+    return [notes.add_note("Note " + str(i), "Content of note " + str(i) * 50,
+                           user_id, [("Status", "Active"), ("Priority", "High")])
+            for i in range(note_count)]
+
+def login():
+    """Log in and return the session cookie."""
+    con = http.client.HTTPConnection("127.0.0.1", PORT)
+    con.request("POST", "/login", "username=loadtest&password=loadtest",
+                {"Content-Type": "application/x-www-form-urlencoded"})
+    response = con.getresponse()
+    response.read()
+    con.close()
+    return response.getheader("Set-Cookie").split(";")[0]
+
+def client(args):
+    """One client process, requests pages until the time is up. Returns the request count."""
+    seconds, note_ids = args
+    cookie = login()
+    count = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        path = "/" if count % 2 == 0 else "/note/" + str(note_ids[count % len(note_ids)])
+        con = http.client.HTTPConnection("127.0.0.1", PORT)
+        con.request("GET", path, headers={"Cookie": cookie})
+        response = con.getresponse()
+        response.read()
+        con.close()
+        if response.status != 200:
+            raise RuntimeError(path + " returned " + str(response.status))
+        count += 1
+    return count
+
+def wait_for_server():
+    """Wait until the server accepts connections."""
+    for _ in range(100):
+        try:
+            http.client.HTTPConnection("127.0.0.1", PORT).connect()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server didn't start")
+
+def run(workers, seconds, clients, note_ids):
+    """Requests per second with the given number of server workers."""
+    env = dict(os.environ, NOTEAPP_DATABASE=config.database)
+    server = subprocess.Popen([sys.executable, "serve.py", "--port", str(PORT),
+                               "--workers", str(workers)], env=env, stdout=subprocess.DEVNULL)
+    try:
+        wait_for_server()
+        with multiprocessing.Pool(clients) as pool:
+            start = time.monotonic()
+            counts = pool.map(client, [(seconds, note_ids)] * clients)
+            elapsed = time.monotonic() - start
+    finally:
+        server.terminate()
+        server.wait()
+    total = sum(counts)
+    print(f"{workers:3} workers  {total:7} requests  {total / elapsed:8.1f} req/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test against serve.py.")
+    parser.add_argument("--seconds", type=float, default=10, help="seconds per run")
+    parser.add_argument("--clients", type=int, default=2 * (os.cpu_count() or 1), help="client processes")
+    args = parser.parse_args()
+    seconds = args.seconds
+    clients = args.clients
+    note_ids = seed()
+    db.close_connection()
+    db.close_pool()
+    print(f"{clients} clients for {seconds} s each run, {os.cpu_count()} cores")
+    for workers in sorted({1, os.cpu_count() or 1}):
+        run(workers, seconds, clients, note_ids)
+
+if __name__ == "__main__":
+    main()
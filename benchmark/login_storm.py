@@ -0,0 +1,100 @@
+"""
+Latency of the note list while other threads keep posting wrong passwords
+to /login. Runs with hashing in the request thread and in the process pool,
+with and without the login limiter, all in one process through
+app.test_client() so the storm competes with the page requests like it
+would in one server worker.
+
+python3 -m benchmark.login_storm [--seconds S] [--threads N]
+"""
+import argparse
+import threading
+import time
+
+from app import create_app
+import benchmark
+from benchmark.routes import percentile
+import config
+import db
+import hashing
+import limiter
+import notes
+import users
+
+def seed(note_count=100):
+    """A user with some notes and a few users to attack."""
+    benchmark.fresh_database(migrated=True)
+    db.setup_database()
+    for name in ("reader", "victim1", "victim2", "victim3"):
+        users.create_user(name, "benchmark")
+    user_id = users.get_user_by_username("reader")["id"]
+    for i in range(note_count):
+        notes.add_note("Note " + str(i), "Content of note " + str(i) * 20, user_id, [])
+    db.close_connection()
+
+def storm(app, stop, thread, counts):
+    """Wrong passwords for the victims from a few addresses until stopped."""
+    client = app.test_client()
+    sent = 0
+    while not stop.is_set():
+        address = "10.0." + str(thread) + "." + str(sent % 4)
+        client.post("/login", data={"username": "victim" + str(sent % 3 + 1), "password": "wrong"},
+                    environ_base={"REMOTE_ADDR": address})
+        sent += 1
+    counts[thread] = sent
+
+def run(app, seconds, threads):
+    """Note list latency in ms during a storm, and the login attempts made."""
+    client = app.test_client()
+    client.post("/login", data={"username": "reader", "password": "benchmark"},
+                environ_base={"REMOTE_ADDR": "10.1.0.1"})
+    for _ in range(10):
+        client.get("/")
+
+    stop = threading.Event()
+    counts = [0] * threads
+    storm_threads = [threading.Thread(target=storm, args=(app, stop, i, counts))
+                     for i in range(threads)]
+    for t in storm_threads:
+        t.start()
+    latencies = []
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        before = time.perf_counter()
+        response = client.get("/")
+        latencies.append(time.perf_counter() - before)
+        if response.status_code != 200:
+            raise RuntimeError("/ returned " + str(response.status_code))
+    stop.set()
+    for t in storm_threads:
+        t.join()
+    latencies.sort()
+    return latencies, sum(counts)
+
+def main():
+    parser = argparse.ArgumentParser(description="Page latency during a storm of logins.")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--threads", type=int, default=8, help="threads logging in")
+    args = parser.parse_args()
+    seconds = args.seconds
+    threads = args.threads
+    seed()
+    app = create_app()
+    workers = config.hash_workers or 2
+    print(f"{threads} storm threads for {seconds} s each run")
+    for name, hash_workers, limited in (("inline", 0, False), ("pool", workers, False),
+                                        ("inline+limit", 0, True), ("pool+limit", workers, True)):
+        config.hash_workers = hash_workers
+        config.login_burst = config.address_burst = 10 if limited else 10 ** 9
+        limiter._buckets.clear()
+        if hash_workers:
+            # start the worker processes before measuring
+            hashing.hash_password("warmup")
+        latencies, attempts = run(app, seconds, threads)
+        print(f"{name:13} p50 {percentile(latencies, 0.5) * 1000:7.2f} ms  "
+              f"p99 {percentile(latencies, 0.99) * 1000:7.2f} ms  "
+              f"{len(latencies) / seconds:7.1f} pages/s  {attempts / seconds:7.1f} logins/s")
+    hashing.shutdown()
+
+if __name__ == "__main__":
+    main()
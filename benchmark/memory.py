@@ -0,0 +1,109 @@
+"""
+Memory of reading and rendering the note lists of one user with a lot of
+notes. Compares fetchall() into sqlite3.Row, like every query used to do,
+against the compact NoteRow records and against streaming rows one at a
+time with db.iter_query, and render_template against the streamed list
+pages. Peaks are measured with tracemalloc so only Python objects count.
+
+python3 -m benchmark.memory [--notes N]
+"""
+import argparse
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from flask import render_template, session
+
+from app import app, render_page
+import benchmark
+import config
+import db
+import notes
+
+LISTING = """SELECT n.id, n.title, n.updated_at, n.version,
+                    n.status, n.priority, n.context,
+                    EXISTS(SELECT 1 FROM shares s WHERE s.note_id = n.id) AS shared
+             FROM notes n
+             WHERE n.user_id = ?
+             ORDER BY n.updated_at DESC, n.id DESC"""
+
+FULL = """SELECT id, title, content, content_html, created_at, updated_at
+          FROM notes WHERE user_id = ? ORDER BY id"""
+
+def seed(count):
+    """One user with count notes of about a kilobyte each, written straight to the table."""
+    benchmark.fresh_database(migrated=True)
+    db.execute("INSERT INTO users (username, password_hash) VALUES ('big', '')")
+    user_id = db.last_insert_id()
+    start = datetime(2024, 1, 1)
+    content = "Some words that make up the content of a note. " * 20
+    rows = []
+    for i in range(count):
+        now = (start + timedelta(minutes=i)).isoformat()
+        rows.append(("Note number " + str(i), content, notes.render_content(content),
+                     user_id, now, now, "Active", "High" if i % 3 else None, "Work"))
+    with db.transaction():
+        for i in range(0, count, config.import_batch_size):
+            db.executemany("""INSERT INTO notes (title, content, content_html, user_id, created_at,
+                                                 updated_at, status, priority, context)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                           rows[i:i + config.import_batch_size])
+    db.close_connection()
+    return user_id
+
+def measure(work):
+    """Peak traced bytes and seconds of work(). Timed separately, tracing slows it down."""
+    work()
+    start = time.perf_counter()
+    work()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    work()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    db.close_connection()
+    return peak, elapsed
+
+def report(name, peak, elapsed, rows):
+    print(f"{name:34} peak {peak / 1024:9.1f} KiB  {peak / max(rows, 1):7.1f} B/row  "
+          f"{elapsed * 1000:8.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory of reading and rendering one user's note lists.")
+    parser.add_argument("--notes", type=int, default=20000)
+    count = parser.parse_args().notes
+    user_id = seed(count)
+    print(f"{count} notes of one user")
+
+    def consume(rows):
+        for _ in rows:
+            pass
+
+    cases = (
+        ("list, fetchall sqlite3.Row", lambda: db.query(LISTING, [user_id])),
+        ("list, fetchall NoteRow", lambda: db.query(LISTING, [user_id], notes.NoteRow)),
+        ("list, iter_query NoteRow", lambda: consume(db.iter_query(LISTING, [user_id], notes.NoteRow))),
+        ("content, fetchall sqlite3.Row", lambda: db.query(FULL, [user_id])),
+        ("content, iter_query", lambda: consume(db.iter_query(FULL, [user_id]))),
+    )
+    for name, work in cases:
+        report(name, *measure(work), count)
+
+    # one page of the front page at the biggest page size
+    limit = config.max_page_size
+
+    def page(render):
+        with app.test_request_context("/?limit=" + str(limit)):
+            session["user_id"] = user_id
+            session["csrf_token"] = "benchmark"
+            rows = notes.get_user_notes(user_id, limit=limit)
+            shared = notes.get_shared_with_user(user_id, limit=limit)
+            consume(render("index.html", notes=rows["rows"], notes_page=rows,
+                           shared_notes=shared["rows"], shared_page=shared,
+                           classes=notes.get_all_classes()))
+
+    report("index page, render_template", *measure(lambda: page(render_template)), limit)
+    report("index page, render_page streamed", *measure(lambda: page(render_page)), limit)
+
+if __name__ == "__main__":
+    main()
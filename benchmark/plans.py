@@ -0,0 +1,127 @@
+"""
+Prints EXPLAIN QUERY PLAN for the listing, search and stats queries, each
+as it was run on the plain schema.sql before the migrations and as notes.py
+and users.py run it now on the migrated schema, so every SCAN that became
+an index SEARCH shows. After the migrations none of them may scan notes,
+shares, comments or note_classes, the script exits with 1 if one does, so
+it works as a check.
+python3 -m benchmark.plans
+"""
+import re
+import sqlite3
+import sys
+
+import benchmark
+import config
+import migrate
+import notes
+import users
+
+FIRST_PAGE = {"keyset": "1", "order": "DESC"}
+NEXT_PAGE = {"keyset": "(n.updated_at, n.id) < (?, ?)", "order": "DESC"}
+CURSOR = ["2024-01-01T00:00:00", 1]
+
+QUERIES = {
+    "get_user_notes": (notes.USER_NOTES_SQL.format(**FIRST_PAGE), [1, 50]),
+    "get_user_notes, next page": (notes.USER_NOTES_SQL.format(**NEXT_PAGE), [1] + CURSOR + [50]),
+    "get_shared_with_user": (notes.SHARED_NOTES_SQL.format(**FIRST_PAGE), [1, 50]),
+    "get_shared_with_user, next page": (notes.SHARED_NOTES_SQL.format(**NEXT_PAGE), [1] + CURSOR + [50]),
+    "search_notes": (notes.SEARCH_SQL, [1, 1, '"plan"', 1, 1, 21, 0]),
+    "get_note_stats": (users.NOTE_STATS_SQL, [1]),
+}
+
+# the same queries before the migrations, when listings had no pages and the
+# classes were looked up from note_classes for every row
+CLASS = """(SELECT value FROM note_classes WHERE note_id = n.id AND title = '{}' LIMIT 1)"""
+CLASSES = ",\n".join(CLASS.format(title) + " AS " + title.lower()
+                      for title in ("Status", "Priority", "Context"))
+ORIGINAL_QUERIES = {
+    "get_user_notes": (f"""SELECT n.id, n.title, n.content, n.created_at, n.updated_at, {CLASSES},
+                                  EXISTS(SELECT 1 FROM shares s WHERE s.note_id = n.id) AS shared
+                           FROM notes n
+                           WHERE n.user_id = ?
+                           ORDER BY n.updated_at DESC, n.id DESC""", [1]),
+    "get_shared_with_user": (f"""SELECT n.id, n.title, n.updated_at, u.username AS owner_username,
+                                        {CLASSES}
+                                 FROM notes n
+                                 JOIN users u ON n.user_id = u.id
+                                 WHERE EXISTS(SELECT 1 FROM shares s WHERE s.user_id = ? AND s.note_id = n.id)
+                                 ORDER BY n.updated_at DESC, n.id DESC""", [1]),
+    "search_notes": (f"""SELECT n.id, n.title, n.updated_at, u.username AS owner_username, {CLASSES},
+                                EXISTS(SELECT 1 FROM shares s_me WHERE s_me.note_id = n.id
+                                                                   AND s_me.user_id = ?) AS shared_with_me,
+                                CASE WHEN n.user_id = ? AND EXISTS(SELECT 1 FROM shares s_any
+                                                                   WHERE s_any.note_id = n.id)
+                                     THEN 1 ELSE 0 END AS shared_by_me
+                         FROM notes n
+                         JOIN users u ON n.user_id = u.id
+                         WHERE (n.user_id = ? OR EXISTS(SELECT 1 FROM shares s_access
+                                                        WHERE s_access.note_id = n.id
+                                                          AND s_access.user_id = ?))
+                           AND (n.title LIKE ? OR n.content LIKE ?)
+                         ORDER BY n.updated_at DESC, n.id DESC""", [1, 1, 1, 1, "%plan%", "%plan%"]),
+    # the Status one of its three, the others only differ by the title
+    "get_note_stats": (f"""SELECT COALESCE({CLASS.format("Status")}, 'Unassigned') AS value,
+                                  COUNT(*) AS count
+                           FROM notes n
+                           WHERE n.user_id = ?
+                           GROUP BY value
+                           ORDER BY (value='Unassigned'), value""", [1]),
+}
+
+# tables that grow with the notes, a scan of them is a missing index
+CHECKED = ("notes", "shares", "comments", "note_classes")
+KEYWORDS = {"on", "where", "join", "left", "order", "group", "limit", "set", "values"}
+
+def checked_names(sql):
+    """The checked tables of a query and their aliases, as plans show aliases."""
+    names = set(CHECKED)
+    for table, alias in re.findall(r"\b(" + "|".join(CHECKED) + r")\s+(?:AS\s+)?(\w+)", sql, re.I):
+        if alias.lower() not in KEYWORDS:
+            names.add(alias)
+    return names
+
+def get_plans(queries):
+    """The plan lines of each query, or the error if it doesn't run on this schema."""
+    plans = {}
+    con = sqlite3.connect(config.database)
+    for name, (sql, params) in queries.items():
+        try:
+            plans[name] = [row[3] for row in con.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        except sqlite3.OperationalError as error:
+            plans[name] = error
+    con.close()
+    return plans
+
+def main():
+    benchmark.fresh_database()
+    before = get_plans(ORIGINAL_QUERIES)
+    migrate.migrate()
+    after = get_plans(QUERIES)
+
+    problems = []
+    for name, plan in after.items():
+        print(name)
+        print("  schema.sql, the query as it was:")
+        for line in before.get(name, ["(there were no pages)"]):
+            print("      " + line)
+        print("  migrated:")
+        if isinstance(plan, sqlite3.OperationalError):
+            print("      (doesn't run: " + str(plan) + ")")
+            problems.append(name + ": " + str(plan))
+            continue
+        names = checked_names(QUERIES[name][0])
+        for line in plan:
+            print("      " + line)
+            scanned = re.match(r"SCAN (\w+)", line)
+            if scanned and scanned.group(1) in names:
+                problems.append(name + ": " + line)
+    if problems:
+        print("FAILED")
+        for problem in problems:
+            print("    " + problem)
+        sys.exit(1)
+    print("OK, no scans of " + ", ".join(CHECKED))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Storage and speed of note revisions. One note of about 5000 characters is
+edited a few words or a sentence at a time. For each revision_snapshot_interval
+this prints the bytes stored per edit, in the data column and in the pages of
+note_revisions and its index, next to what a plain or compressed copy per edit
+would take, the time an edit takes and the time to rebuild the Nth revision.
+An interval of 1 is a full compressed copy every time.
+
+python3 -m benchmark.revisions [--edits N]
+"""
+import argparse
+import random
+import time
+import zlib
+
+import benchmark
+from benchmark.generate import sentence
+from benchmark.routes import percentile
+import config
+import db
+import notes
+import revisions
+
+def edit(rng, content):
+    """A small change like people make: a word fixed, a sentence added, replaced or removed."""
+    sentences = content.split(". ")
+    spot = rng.randrange(len(sentences))
+    choice = rng.random()
+    if choice < 0.4:
+        words = sentences[spot].split(" ")
+        words[rng.randrange(len(words))] = sentence(rng, 1)
+        sentences[spot] = " ".join(words)
+    elif choice < 0.7:
+        sentences.insert(spot, sentence(rng, rng.randint(5, 15)).capitalize())
+    elif choice < 0.9:
+        sentences[spot] = sentence(rng, rng.randint(5, 15)).capitalize()
+    elif len(sentences) > 1:
+        del sentences[spot]
+    content = ". ".join(sentences)
+    while len(content) > 5000:
+        content = content[:content.rindex(". ")]
+    return content
+
+def table_bytes():
+    """Bytes of the pages of note_revisions and its primary key index."""
+    sql = """SELECT SUM(pgsize) AS size FROM dbstat
+             WHERE name IN ('note_revisions', 'sqlite_autoindex_note_revisions_1')"""
+    return db.query(sql)[0]["size"]
+
+def run(interval, edits, seed=1):
+    """Edit one note edits times with the given snapshot interval and print the numbers."""
+    config.revision_snapshot_interval = interval
+    benchmark.fresh_database(migrated=True)
+    db.execute("INSERT INTO users (username, password_hash) VALUES ('writer', '')")
+    user_id = db.last_insert_id()
+    rng = random.Random(seed)
+    content = ". ".join(sentence(rng, 10).capitalize() for _ in range(70))[:5000]
+    note_id = notes.add_note("Edited", content, user_id, [])
+
+    before = table_bytes()
+    plain = compressed = 0
+    latencies = []
+    for i in range(edits):
+        content = edit(rng, content)
+        plain += len(content.encode())
+        compressed += len(zlib.compress(content.encode(), 9))
+        start = time.perf_counter()
+        notes.update_note(note_id, "Edited " + str(i), content, [])
+        latencies.append(time.perf_counter() - start)
+    stored = db.query("SELECT SUM(length(data)) AS size FROM note_revisions WHERE note_id = ?",
+                      [note_id])[0]["size"]
+    pages = table_bytes() - before
+    latencies.sort()
+
+    # every revision, the cost depends on how many deltas it is from a full copy
+    rebuilds = []
+    for number in range(1, edits + 2):
+        start = time.perf_counter()
+        for _ in range(5):
+            revisions.get_revision(note_id, number)
+        rebuilds.append((time.perf_counter() - start) / 5)
+    rebuilds.sort()
+    db.close_connection()
+    print(f"interval {interval:3}  per edit: data {stored / (edits + 1):6.0f} B  "
+          f"pages {pages / (edits + 1):6.0f} B  (copy {plain / edits:5.0f} B, "
+          f"compressed copy {compressed / edits:5.0f} B)  "
+          f"edit p50 {percentile(latencies, 0.5) * 1000:5.2f} ms  "
+          f"rebuild p50 {percentile(rebuilds, 0.5) * 1000:5.2f} ms max {rebuilds[-1] * 1000:5.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Storage and speed of note revisions.")
+    parser.add_argument("--edits", type=int, default=500, help="edits of the note per interval")
+    edits = parser.parse_args().edits
+    for interval in (1, 10, 20, 50, 100):
+        run(interval, edits)
+
+if __name__ == "__main__":
+    main()
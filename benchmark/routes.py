@@ -0,0 +1,150 @@
+"""
+Measures the main pages through app.test_client() on a generated database.
+Writes latency percentiles, throughput and queries per request to a JSON
+file, and can compare two such files to catch regressions.
+
+python3 -m benchmark.routes --output before.json
+python3 -m benchmark.routes --output after.json
+python3 -m benchmark.routes --compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from app import create_app
+import benchmark
+from benchmark import generate
+import config
+import db
+
+def percentile(values, fraction):
+    """Nearest rank percentile of sorted values."""
+    index = min(len(values) - 1, max(0, round(fraction * len(values)) - 1))
+    return values[index]
+
+def measure(client, paths, requests):
+    """Request the paths in turn, returns the stats of the run."""
+    latencies = []
+    statements = db.stats["statements"]
+    start = time.perf_counter()
+    for i in range(requests):
+        path = paths[i % len(paths)]
+        before = time.perf_counter()
+        response = client.get(path)
+        # streamed pages render while the body is read, and closing ends their request context
+        response.get_data()
+        response.close()
+        latencies.append(time.perf_counter() - before)
+        if response.status_code != 200:
+            raise RuntimeError(path + " returned " + str(response.status_code))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": requests,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p90_ms": percentile(latencies, 0.90) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": latencies[-1] * 1000,
+        "requests_per_s": requests / elapsed,
+        "queries_per_request": (db.stats["statements"] - statements) / requests,
+    }
+
+def run(requests, seed):
+    """Benchmark every route as one of the generated users."""
+    app = create_app()
+    rng = random.Random(seed)
+
+    user = db.query("""SELECT u.id, u.username FROM users u
+                       ORDER BY (SELECT COUNT(*) FROM notes WHERE user_id = u.id) DESC
+                       LIMIT 1""")[0]
+    note_ids = [row["id"] for row in db.query("SELECT id FROM notes WHERE user_id = ?", [user["id"]])]
+    note_ids += [row["note_id"] for row in db.query("SELECT note_id FROM shares WHERE user_id = ?",
+                                                    [user["id"]])]
+    db.close_connection()
+
+    client = app.test_client()
+    response = client.post("/login", data={"username": user["username"],
+                                           "password": generate.PASSWORD})
+    if response.status_code != 302 or not response.location.endswith("/"):
+        raise RuntimeError("login failed for " + user["username"])
+
+    routes = {
+        "index": ["/"],
+        "show_user": ["/user/" + str(user["id"])],
+        "show_note": ["/note/" + str(note_id) for note_id in rng.sample(note_ids, min(50, len(note_ids)))],
+        "search": ["/search?query=" + word for word in rng.sample(generate.WORDS, 10)],
+    }
+    results = {}
+    for name, paths in routes.items():
+        measure(client, paths, min(10, requests))
+        results[name] = measure(client, paths, requests)
+    return results
+
+def compare(old_file, new_file, threshold):
+    """Print the change of every number, returns True if some route got slower than threshold."""
+    with open(old_file) as f:
+        old = json.load(f)["routes"]
+    with open(new_file) as f:
+        new = json.load(f)["routes"]
+    regressed = False
+    print(f"{'route':10} {'p50 ms':>16} {'p99 ms':>16} {'req/s':>18} {'queries':>12}")
+    for name in new:
+        if name not in old:
+            continue
+        a, b = old[name], new[name]
+        change = b["p50_ms"] / a["p50_ms"] - 1
+        flag = ""
+        if change > threshold or b["queries_per_request"] > a["queries_per_request"]:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{name:10} {a['p50_ms']:7.2f} -> {b['p50_ms']:6.2f} {a['p99_ms']:7.2f} -> {b['p99_ms']:6.2f} "
+              f"{a['requests_per_s']:8.1f} -> {b['requests_per_s']:7.1f} "
+              f"{a['queries_per_request']:4.1f} -> {b['queries_per_request']:4.1f}{flag}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app's routes.")
+    parser.add_argument("--database", help="generated database, a new one is made if missing")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--notes", type=int, default=500, help="notes per user")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="p50 slowdown counted as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    if args.database and os.path.exists(args.database):
+        config.database = args.database
+    else:
+        if args.database:
+            benchmark.create_database(args.database)
+        else:
+            benchmark.fresh_database(migrated=True)
+        generate.generate(users=args.users, notes_per_user=args.notes, seed=args.seed)
+
+    results = {
+        "meta": {
+            "database": config.database,
+            "requests": args.requests,
+            "python": platform.python_version(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "routes": run(args.requests, args.seed),
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    for name, result in results["routes"].items():
+        print(f"{name:10} p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  "
+              f"{result['requests_per_s']:8.1f} req/s  {result['queries_per_request']:4.1f} queries")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Checks that sqlite sessions work across serve.py's worker processes and a
+restart. Logs in once, then requests the note list with that cookie over
+new connections until every worker has answered one, restarts the server
+and does it again. Also checks that logging in gives a new session id, so
+a session id planted before the login isn't logged in by it. Which worker
+answered is looked up from the connection's socket in /proc, so this needs
+Linux. Exits with 1 if a check fails.
+
+python3 -m benchmark.shared_sessions --workers 4
+"""
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import time
+
+import benchmark
+import config
+import db
+import users
+
+PORT = 8766
+# pids of the running server's workers
+workers = set()
+
+def seed():
+    """A user to log in with."""
+    benchmark.fresh_database(migrated=True)
+    db.setup_database()
+    users.create_user("sessions", "sessions")
+    db.close_connection()
+    db.close_pool()
+
+def start_server(count):
+    """Start serve.py with count workers and wait until they all run."""
+    env = dict(os.environ, NOTEAPP_DATABASE=config.database, NOTEAPP_SESSIONS="sqlite")
+    server = subprocess.Popen([sys.executable, "serve.py", "--port", str(PORT), "--asyncio",
+                               "--workers", str(count)], env=env, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        workers.clear()
+        workers.update(worker_pids(server.pid))
+        if len(workers) == count:
+            try:
+                http.client.HTTPConnection("127.0.0.1", PORT).connect()
+                return server
+            except OSError:
+                pass
+        time.sleep(0.1)
+    raise RuntimeError("server didn't start")
+
+def stop_server(server):
+    """Stop serve.py and its workers."""
+    server.terminate()
+    server.wait()
+
+def worker_pids(server_pid):
+    """Pids of the worker processes forked by the server."""
+    pids = set()
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open("/proc/" + name + "/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        if int(fields[1]) == server_pid:
+            pids.add(int(name))
+    return pids
+
+def serving_worker(client_port):
+    """The worker holding the server side of the connection from client_port."""
+    wanted = f"0100007F:{PORT:04X} 0100007F:{client_port:04X}"
+    inode = None
+    with open("/proc/net/tcp") as f:
+        for line in f:
+            fields = line.split()
+            if " ".join(fields[1:3]) == wanted:
+                inode = fields[9]
+    for pid in workers:
+        try:
+            for fd in os.listdir(f"/proc/{pid}/fd"):
+                if os.readlink(f"/proc/{pid}/fd/{fd}") == f"socket:[{inode}]":
+                    return pid
+        except FileNotFoundError:
+            continue
+    return None
+
+def request(method, path, cookie=None, body=None):
+    """Status, session cookie and body of one request on a new connection, and the
+    worker that answered it. The connection is kept open until the worker is found."""
+    con = http.client.HTTPConnection("127.0.0.1", PORT)
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    if cookie:
+        headers["Cookie"] = cookie
+    con.request(method, path, body, headers)
+    response = con.getresponse()
+    data = response.read()
+    worker = serving_worker(con.sock.getsockname()[1])
+    con.close()
+    set_cookie = response.getheader("Set-Cookie")
+    return response.status, set_cookie.split(";")[0] if set_cookie else None, data, worker
+
+def logged_in(cookie):
+    """Worker that answered if the note list shows the user as logged in with cookie, else None."""
+    status, _, data, worker = request("GET", "/", cookie)
+    return worker if status == 200 and b"sessions" in data else None
+
+def check_workers(cookie, problems, name):
+    """Request with cookie until every worker has answered it logged in."""
+    seen = set()
+    for _ in range(50 * len(workers)):
+        worker = logged_in(cookie)
+        if worker is None:
+            problems.append(name + ": a worker didn't know the session")
+            return
+        seen.add(worker)
+        if seen == workers:
+            break
+    print(f"{name}: session valid in {len(seen)} of {len(workers)} workers")
+    if seen != workers:
+        problems.append(f"{name}: only {len(seen)} workers answered")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check sqlite sessions across workers and a restart.")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    seed()
+    problems = []
+
+    server = start_server(args.workers)
+    try:
+        # a failed login flashes an error, which gives an anonymous session id
+        _, planted, _, _ = request("POST", "/login", body="username=sessions&password=wrong")
+        _, cookie, _, _ = request("POST", "/login", planted,
+                                  "username=sessions&password=sessions")
+        if not planted or not cookie or cookie == planted:
+            problems.append("login kept the session id from before it")
+        elif logged_in(planted):
+            problems.append("the session id from before the login is logged in")
+        else:
+            print("login: new session id, the one from before isn't logged in")
+        check_workers(cookie, problems, "before restart")
+    finally:
+        stop_server(server)
+
+    server = start_server(args.workers)
+    try:
+        check_workers(cookie, problems, "after restart")
+    finally:
+        stop_server(server)
+
+    if problems:
+        print("FAILED")
+        for problem in problems:
+            print("    " + problem)
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Latency of the share form's username autocomplete with a million users.
+Suggestions come from the users someone has shared with before, so the
+cost depends on how many of them there are, not on all users. Prefixes of
+0-3 characters taken from those names in mixed case are completed with an
+empty cache and again from the cache, for a user who has shared with 200
+users and for one who has shared with 20000.
+The targets are for one request thread, a request adds the Flask overhead.
+
+python3 -m benchmark.usernames [--users N]
+"""
+import argparse
+import random
+import string
+import time
+
+import benchmark
+from benchmark.routes import percentile
+import config
+import db
+import users
+
+# p99 seconds
+TARGET_UNCACHED = 0.0005
+TARGET_CACHED = 0.00025
+
+def seed(count, rng):
+    """count users with random names. User 1 has shared with 200 of them and user 2 with 20000."""
+    benchmark.fresh_database(migrated=True)
+    letters = string.ascii_letters
+    names = set()
+    while len(names) < count:
+        name = "".join(rng.choices(letters, k=rng.randint(3, 12)))
+        if rng.random() < 0.3:
+            name += str(rng.randint(0, 999))
+        names.add(name[:20])
+    names = sorted(names)
+    rng.shuffle(names)
+    targets = {}
+    with db.transaction():
+        for i in range(0, count, 10000):
+            db.executemany("INSERT INTO users (username, password_hash) VALUES (?, '')",
+                           [(name,) for name in names[i:i + 10000]])
+        for owner, shared in ((1, 200), (2, 20000)):
+            user_ids = rng.sample(range(3, count + 1), shared)
+            db.executemany("""INSERT INTO share_targets (owner_id, user_id, shares, username)
+                              VALUES (?, ?, ?, ?)""",
+                           [(owner, user_id, rng.randint(1, 20), names[user_id - 1])
+                            for user_id in user_ids])
+            targets[owner] = [names[user_id - 1] for user_id in user_ids]
+    db.close_connection()
+    return targets
+
+def mixed_case(rng, text):
+    """text with random letters in upper case."""
+    return "".join(c.upper() if rng.random() < 0.5 else c.lower() for c in text)
+
+def time_calls(owner, prefixes, cached):
+    """Sorted seconds of complete_username for each prefix, cached or with an empty cache."""
+    latencies = []
+    for prefix in prefixes:
+        if cached:
+            users.complete_username(owner, prefix)
+        else:
+            users._prefix_cache.clear()
+        start = time.perf_counter()
+        users.complete_username(owner, prefix)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies
+
+def report(name, latencies, target=None):
+    """Print percentiles, and whether the p99 is within target."""
+    p99 = percentile(latencies, 0.99)
+    line = (f"{name:36} p50 {percentile(latencies, 0.5) * 1e6:8.0f} us  "
+            f"p99 {p99 * 1e6:8.0f} us  max {latencies[-1] * 1e6:8.0f} us")
+    if target:
+        line += f"  target {target * 1e6:.0f} us " + ("ok" if p99 <= target else "MISSED")
+    print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of the username autocomplete.")
+    parser.add_argument("--users", type=int, default=1000000)
+    count = parser.parse_args().users
+    if count < 20002:
+        parser.error("--users must be at least 20002, user 2 has shared with 20000 others")
+    rng = random.Random(1)
+    start = time.perf_counter()
+    targets = seed(count, rng)
+    print(f"{count} users, seeded in {time.perf_counter() - start:.1f} s, "
+          f"{config.username_suggestions} suggestions per prefix")
+
+    for owner, names in targets.items():
+        for length in (0, 1, 2, 3):
+            prefixes = [mixed_case(rng, rng.choice(names)[:length]) for _ in range(1000)]
+            name = f"{len(names)} shared, prefix {length}"
+            report(name + ", uncached", time_calls(owner, prefixes, False), TARGET_UNCACHED)
+            report(name + ", cached", time_calls(owner, prefixes, True), TARGET_CACHED)
+    db.close_connection()
+
+if __name__ == "__main__":
+    main()
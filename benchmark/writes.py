@@ -0,0 +1,85 @@
+"""
+Compares writing notes with a commit per statement, like the app used to,
+against one transaction per note. Every commit is an fsync so the commit
+count is what matters. Then threads add comments at the same time, with
+every write committed alone and with the writer's group commit.
+python3 -m benchmark.writes [--notes N] [--threads N]
+"""
+import argparse
+import threading
+import time
+from datetime import datetime
+
+import benchmark
+import config
+import db
+import notes
+
+CLASSES = [("Status", "Active"), ("Priority", "High"), ("Context", "Work")]
+
+def add_note_per_statement(title, content, user_id, classes):
+    """The old add_note, every statement commits on its own."""
+    now = datetime.now().isoformat()
+    db.execute("""INSERT INTO notes (title, content, user_id, created_at, updated_at)
+                  VALUES (?, ?, ?, ?, ?)""", [title, content, user_id, now, now])
+    note_id = db.last_insert_id()
+    for class_title, class_value in classes:
+        db.execute("INSERT INTO note_classes (note_id, title, value) VALUES (?, ?, ?)",
+                   [note_id, class_title, class_value])
+
+def run(name, add, count):
+    """Time count note additions and count the commits they made."""
+    benchmark.fresh_database(migrated=True)
+    db.execute("INSERT INTO users (username, password_hash) VALUES ('bench', '')")
+    user_id = db.last_insert_id()
+    commits = db.stats["commits"]
+    start = time.perf_counter()
+    for i in range(count):
+        add("Note " + str(i), "Some content " * 20, user_id, CLASSES)
+    elapsed = time.perf_counter() - start
+    commits = db.stats["commits"] - commits
+    print(f"{name:15} {count} notes  {commits:6} commits  {elapsed:7.3f} s  "
+          f"{count / elapsed:8.1f} notes/s")
+
+def run_burst(name, batch_size, count, threads):
+    """count comments from each of threads threads at once, and the commits they took."""
+    benchmark.fresh_database(migrated=True)
+    config.write_batch_size = batch_size
+    db.execute("INSERT INTO users (username, password_hash) VALUES ('bench', '')")
+    user_id = db.last_insert_id()
+    note_id = notes.add_note("Note", "Some content", user_id, [])
+
+    def comment(thread):
+        for i in range(count):
+            notes.add_comment(note_id, user_id, "Comment " + str(thread) + " " + str(i))
+        db.close_connection()
+
+    commits = db.stats["commits"]
+    start = time.perf_counter()
+    workers = [threading.Thread(target=comment, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    commits = db.stats["commits"] - commits
+    total = count * threads
+    print(f"{name:15} {total} comments  {commits:6} commits  {elapsed:7.3f} s  "
+          f"{total / elapsed:8.1f} comments/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of note and comment writes.")
+    parser.add_argument("--notes", type=int, default=500, help="notes, and comments of the bursts, written per run")
+    parser.add_argument("--threads", type=int, default=8, help="threads writing comments")
+    args = parser.parse_args()
+    count = args.notes
+    threads = args.threads
+    run("per statement", add_note_per_statement, count)
+    run("transaction", notes.add_note, count)
+    batch_size = config.write_batch_size
+    run_burst("commit each", 1, count // threads, threads)
+    run_burst("group commit", batch_size, count // threads, threads)
+    config.write_batch_size = batch_size
+
+if __name__ == "__main__":
+    main()
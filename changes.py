@@ -0,0 +1,150 @@
+"""
+Change feed for users who keep a note open. Triggers (migration 012) add a
+row to the changes table for every user who can see a note when it, its
+comments or its shares change, so a poll is one index lookup of that user's
+newest rows no matter how many notes or comments there are. The cursor is
+the id of the last change seen. Old changes are pruned, a client whose
+cursor is older than that gets reset and loads the page again.
+"""
+import threading
+import time
+
+import config
+import db
+
+_last_sweep = 0
+_waiters_lock = threading.Lock()
+_waiters = 0
+
+def latest_cursor():
+    """Cursor of the newest change, where a client starts from."""
+    sql = """SELECT MAX(COALESCE((SELECT MAX(id) FROM changes), 0), up_to) AS id
+             FROM changes_pruned"""
+    return db.query(sql)[0]["id"]
+
+def user_cursor(user_id):
+    """Grows whenever something changes in the notes the user can see, comments included.
+    The newest of the user's changes, or the pruned cursor once those are pruned away."""
+    sql = """SELECT MAX(COALESCE((SELECT MAX(id) FROM changes WHERE user_id = ?), 0), up_to) AS id
+             FROM changes_pruned"""
+    return db.query(sql, [user_id])[0]["id"]
+
+def pruned_cursor():
+    """Changes up to this cursor have been pruned."""
+    return db.query("SELECT up_to FROM changes_pruned")[0]["up_to"]
+
+def has_changes(user_id, since):
+    """Whether the user has changes after since, cheap enough to check in a loop."""
+    sql = "SELECT 1 FROM changes WHERE user_id = ? AND id > ? LIMIT 1"
+    return bool(db.query(sql, [user_id, since]))
+
+def get_changes(user_id, since, limit=None):
+    """The user's changes after since, oldest first. Notes and comments that still exist
+    and are still visible to the user come along, so the client doesn't have to ask."""
+    sql = """SELECT c.id, c.note_id, c.kind, c.item_id, c.created_at,
+                    n.title, n.updated_at, n.version,
+                    m.content, m.content_html, m.created_at AS comment_created_at,
+                    m.user_id AS comment_user_id, u.username AS comment_username
+             FROM changes c
+             LEFT JOIN notes n ON n.id = c.note_id
+                  AND (n.user_id = c.user_id
+                       OR EXISTS (SELECT 1 FROM shares s WHERE s.note_id = n.id AND s.user_id = c.user_id))
+             LEFT JOIN comments m ON c.kind = 'comment' AND m.id = c.item_id AND n.id IS NOT NULL
+             LEFT JOIN users u ON u.id = m.user_id
+             WHERE c.user_id = ? AND c.id > ?
+             ORDER BY c.id
+             LIMIT ?"""
+    return db.query(sql, [user_id, since, limit or config.changes_page_size])
+
+def change_json(row):
+    """A row of get_changes as JSON."""
+    change = {
+        "id": row["id"],
+        "note_id": row["note_id"],
+        "kind": row["kind"],
+        "item_id": row["item_id"],
+        "created_at": row["created_at"],
+    }
+    if row["kind"] == "note" and row["title"] is not None:
+        change["note"] = {"title": row["title"], "updated_at": row["updated_at"],
+                          "version": row["version"]}
+    if row["kind"] == "comment" and row["content"] is not None:
+        change["comment"] = {"id": row["item_id"], "content": row["content"],
+                             "content_html": row["content_html"],
+                             "created_at": row["comment_created_at"],
+                             "user": {"id": row["comment_user_id"],
+                                      "username": row["comment_username"]}}
+    return change
+
+def parse_cursor(cursor):
+    """A change cursor from a request, None if it's broken."""
+    if cursor is None or not cursor.isdigit():
+        return None
+    return int(cursor)
+
+def claim_waiter():
+    """Long polls and streams hold a thread each, only changes_waiters of them at once."""
+    global _waiters
+    with _waiters_lock:
+        if _waiters >= config.changes_waiters:
+            return False
+        _waiters += 1
+        return True
+
+def release_waiter():
+    """A long poll or stream is done."""
+    global _waiters
+    with _waiters_lock:
+        _waiters -= 1
+
+def wait_for_changes(user_id, since, seconds):
+    """Sleep until the user has changes after since or seconds have passed.
+    The connection goes back to the pool while sleeping."""
+    deadline = time.monotonic() + seconds
+    while True:
+        db.close_connection()
+        if has_changes(user_id, since):
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(config.changes_poll_interval, remaining))
+
+def poll(user_id, since, wait=0):
+    """Changes after since as JSON with the cursor to ask with next time. Without since,
+    or when since has been pruned, there are no changes and reset tells the client
+    to load everything again. wait seconds are spent waiting for a change if there's none."""
+    if since is None or since < pruned_cursor():
+        return {"changes": [], "cursor": latest_cursor(), "reset": since is not None}
+    if wait > 0 and not has_changes(user_id, since) and claim_waiter():
+        try:
+            wait_for_changes(user_id, since, min(wait, config.changes_max_wait))
+        finally:
+            release_waiter()
+    rows = get_changes(user_id, since)
+    cursor = rows[-1]["id"] if rows else since
+    return {"changes": [change_json(row) for row in rows], "cursor": cursor, "reset": False}
+
+def prune_changes(now):
+    """Delete changes older than changes_retention seconds, keeping at most changes_kept.
+    Returns the number of deleted changes."""
+    sql = "SELECT id FROM changes WHERE created_at >= ? ORDER BY id LIMIT 1"
+    result = db.query(sql, [int(now) - config.changes_retention])
+    latest = latest_cursor()
+    keep_from = result[0]["id"] if result else latest + 1
+    keep_from = max(keep_from, latest - config.changes_kept + 1)
+    if keep_from <= pruned_cursor() + 1:
+        return 0
+    with db.transaction():
+        deleted = db.execute("DELETE FROM changes WHERE id < ?", [keep_from])
+        db.execute("UPDATE changes_pruned SET up_to = MAX(up_to, ?)", [keep_from - 1])
+    return deleted
+
+def sweep_changes():
+    """before_request hook, prunes at most once per changes_sweep_interval in each process."""
+    global _last_sweep
+    now = time.time()
+    if now - _last_sweep < config.changes_sweep_interval:
+        return
+    _last_sweep = now
+    prune_changes(now)
@@ -1,5 +1,173 @@
 """
 A secret key used by the app. I preferred a randomly generated one over specific.
+It's generated once and saved to a file so every worker process and restart
+uses the same key, NOTEAPP_SECRET_KEY overrides it.
+Database settings are here too so they're easy to find and change.
 """
+import os
 import secrets
-secret_key = secrets.token_hex(32)
+import time
+
+secret_key_file = os.environ.get("NOTEAPP_SECRET_KEY_FILE", "secret_key")
+
+def load_secret_key():
+    """Secret key from the environment or the key file, creating the file the first time."""
+    if os.environ.get("NOTEAPP_SECRET_KEY"):
+        return os.environ["NOTEAPP_SECRET_KEY"]
+    try:
+        fd = os.open(secret_key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # maybe another worker is writing it right now
+        for _ in range(50):
+            with open(secret_key_file) as f:
+                key = f.read().strip()
+            if key:
+                return key
+            time.sleep(0.1)
+        raise RuntimeError(secret_key_file + " is empty")
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, "w") as f:
+        f.write(key + "\n")
+    return key
+
+secret_key = load_secret_key()
+
+# sqlite database file used by db.py
+database = os.environ.get("NOTEAPP_DATABASE", "database.db")
+
+# WAL lets readers go on while a note is being written, NORMAL sync is safe with it
+journal_mode = "WAL"
+synchronous = "NORMAL"
+# milliseconds a connection waits for a lock held by another process before failing
+busy_timeout = 5000
+
+# max number of connections kept open by db.py, shared by all requests. A request keeps
+# its connection until it ends, so a pool smaller than the request threads makes them
+# wait for one under load. None gives one per request thread and pool_spare more, the
+# threads being serve.py's --threads or asgi_threads for asgi.py and other servers
+pool_size = None
+# connections above one per request thread, for slow query plans and background threads
+pool_spare = 2
+# seconds a request waits for a free connection before giving up
+pool_timeout = 10
+# seconds before a connection is replaced, so it picks up new planner statistics
+pool_recycle = 3600
+
+# writes that are queued for the writer at the same time are committed together, at
+# most write_batch_size of them (1 commits every write on its own)
+write_batch_size = 64
+# milliseconds the writer waits for more writes before committing, 0 commits right
+# after the ones already waiting
+group_commit_ms = 0
+# seconds a write waits in the queue before giving up
+write_timeout = 30
+
+# notes shown per page in listings, ?limit= can ask for up to max_page_size
+page_size = 50
+max_page_size = 200
+
+# comments shown per page on a note page
+comments_page_size = 50
+
+# revisions shown per page in a note's history
+revisions_page_size = 50
+# a full copy of the content every this many revisions, the ones between are deltas
+# so rebuilding a revision applies at most this many minus one
+revision_snapshot_interval = 20
+
+# search results shown per page
+search_page_size = 20
+
+# notes written per executemany batch when importing
+import_batch_size = 1000
+
+# users whose user page stats are kept cached
+stats_cache_size = 1000
+
+# usernames suggested when sharing, and the (user, prefix) pairs whose matches are kept
+# cached for at most username_cache_seconds, a new share target shows up after that
+username_suggestions = 10
+username_cache_size = 1000
+username_cache_seconds = 60
+
+# "cookie" keeps sessions in the signed cookie, "sqlite" keeps them in the sessions
+# table and the cookie only has the session id
+session_backend = os.environ.get("NOTEAPP_SESSIONS", "cookie")
+# seconds a server side session lives without being used
+session_lifetime = 7 * 24 * 3600
+# seconds between deleting expired sessions
+session_sweep_interval = 600
+
+# request and SQL metrics shown at /metrics, only to the listed addresses
+metrics_enabled = True
+metrics_hosts = ("127.0.0.1", "::1")
+# statements slower than this many milliseconds are logged with their query plan, None turns it off
+slow_query_ms = 200
+
+# database upkeep in a thread of each server worker, False leaves it to
+# "flask --app app maintain" from cron
+maintenance_enabled = True
+# seconds between runs of each task, and between checks for due tasks
+maintenance_intervals = {"checkpoint": 300, "vacuum": 3600, "analyze": 6 * 3600, "integrity": 24 * 3600}
+maintenance_check_interval = 60
+# seconds one task may take, seconds it waits for a lock, and seconds between its steps
+# so writers get their turn
+maintenance_budget = 2.0
+maintenance_lock_wait = 1.0
+maintenance_pause = 0.01
+# pages freed per incremental vacuum step, rows sampled per index by ANALYZE
+vacuum_step_pages = 256
+analysis_limit = 1000
+
+# rendered note list rows kept per worker, at most this many and this many characters
+fragment_cache_size = 5000
+fragment_cache_bytes = 4 * 1024 * 1024
+# characters of a streamed note list page sent at a time
+stream_buffer_size = 16 * 1024
+# folder for compiled templates shared by the workers, None compiles them in every worker
+template_cache = "template_cache"
+
+# threads running requests for asgi.py, and seconds an idle keep-alive connection is
+# kept open there and in serve.py --asyncio
+asgi_threads = 16
+keepalive_timeout = 75
+# bytes of a request body serve.py --asyncio takes, an API batch of full notes fits
+max_body_size = 4 * 1024 * 1024
+
+# /changes: changes returned per poll, and how long changes are kept (seconds and rows)
+changes_page_size = 100
+changes_retention = 7 * 24 * 3600
+changes_kept = 1000000
+# seconds between pruning old changes
+changes_sweep_interval = 600
+# longest ?wait= in seconds for long polls, and seconds between checks while waiting
+changes_max_wait = 30
+changes_poll_interval = 0.5
+# long polls and event streams open at once per worker, each holds a request thread
+changes_waiters = 4
+# seconds an event stream stays open before the client reconnects, and between keep-alives
+changes_stream_seconds = 300
+changes_heartbeat = 15
+
+# most notes fetched or created in one JSON API call
+api_batch_size = 100
+# most notes changed at once with the bulk actions
+bulk_size = 1000
+
+# password hashing with all parameters written out like werkzeug writes them in the hash,
+# hashes made with other parameters are redone at login
+password_hash_method = "scrypt:32768:8:1"
+# processes hashing passwords, 0 hashes in the request thread
+hash_workers = 2
+# hashes running or waiting at once, more than this wait hash_wait seconds and then fail
+hash_queue_size = 16
+hash_wait = 5
+
+# login attempts per username: a burst of login_burst, then login_rate per minute
+login_burst = 10
+login_rate = 10
+# login and registration attempts per address, higher since many users can share one
+address_burst = 50
+address_rate = 30
+# buckets kept before idle ones are dropped
+limiter_buckets = 100000
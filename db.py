@@ -1,31 +1,546 @@
 """
 This is very similar to the db.py from the example app, credit there.
+Reads use a pool of read-only connections instead of opening a new one for
+every statement. A request borrows one, keeps it in g and returns it on teardown.
+SQLite has only one writer at a time, so writes go to a queue and one writer
+thread per process runs them on its own connection. Writes that are waiting
+together are committed together (group commit), so a burst of comments costs
+one commit instead of one each, and nobody fails with "database is locked".
 """
+from collections import namedtuple
+from contextlib import contextmanager
+import os
+import queue
 import sqlite3
-from flask import g
+import threading
+import time
+from urllib.parse import quote
+from flask import g, has_app_context
 
-def get_connection():
-    """Opening sqlite3 connection."""
-    con = sqlite3.connect("database.db")
-    con.execute("PRAGMA foreign_keys = ON")
+import config
+import metrics
+
+_lock = threading.Condition()
+_idle = []
+_opened = 0
+_born = {}
+_local = threading.local()
+_writer = None
+_jobs = None
+
+stats = {"hits": 0, "misses": 0, "waits": 0, "commits": 0, "statements": 0, "writes": 0}
+
+def _connect(read_only=True):
+    """Opening a new sqlite3 connection, a read-only one for the pool or the writer's."""
+    if read_only:
+        con = sqlite3.connect("file:" + quote(os.path.abspath(config.database)) + "?mode=ro",
+                              uri=True, check_same_thread=False)
+        con.execute("PRAGMA query_only = ON")
+    else:
+        # transactions are started and committed by hand in _write_loop
+        con = sqlite3.connect(config.database, check_same_thread=False, isolation_level=None)
+        con.execute("PRAGMA foreign_keys = ON")
+        con.execute("PRAGMA synchronous = " + config.synchronous)
+    con.execute("PRAGMA busy_timeout = " + str(int(config.busy_timeout)))
     con.row_factory = sqlite3.Row
     return con
 
-def execute(sql, params=[]):
-    """Writing to db."""
-    con = get_connection()
-    result = con.execute(sql, params)
-    con.commit()
-    g.last_insert_id = result.lastrowid
+def setup_database():
+    """Settings stored in the database file itself, done once when the server starts."""
+    con = sqlite3.connect(config.database)
+    con.execute("PRAGMA journal_mode = " + config.journal_mode)
+    con.close()
+
+def _after_fork():
+    """A forked worker process must not use connections or the writer thread of its parent."""
+    global _lock, _idle, _opened, _born, _local, _writer, _jobs
+    _lock = threading.Condition()
+    _idle = []
+    _opened = 0
+    _born = {}
+    _local = threading.local()
+    _writer = None
+    _jobs = None
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def _count(name):
+    """Add one to a stats counter, they're bumped from every thread."""
+    with _lock:
+        stats[name] += 1
+
+def pool_limit():
+    """Most connections the pool opens, see pool_size in config.py."""
+    if config.pool_size is not None:
+        return config.pool_size
+    return config.asgi_threads + config.pool_spare
+
+def _acquire():
+    """Borrow a connection from the pool, opening one if there's room."""
+    global _opened
+    with _lock:
+        if not _idle and _opened >= pool_limit():
+            stats["waits"] += 1
+            if not _lock.wait_for(lambda: _idle, config.pool_timeout):
+                raise sqlite3.OperationalError("connection pool exhausted")
+        if _idle:
+            stats["hits"] += 1
+            return _idle.pop()
+        stats["misses"] += 1
+        _opened += 1
+    try:
+        con = _connect()
+        _born[con] = time.monotonic()
+        return con
+    except sqlite3.Error:
+        with _lock:
+            _opened -= 1
+            _lock.notify()
+        raise
+
+def _release(con):
+    """Give a connection back to the pool. Connections older than pool_recycle are
+    closed instead, so new planner statistics from maintenance.py get used."""
+    global _opened
+    try:
+        con.rollback()
+        if time.monotonic() - _born.get(con, 0) > config.pool_recycle:
+            raise sqlite3.OperationalError("recycled")
+    except sqlite3.Error:
+        con.close()
+        with _lock:
+            _born.pop(con, None)
+            _opened -= 1
+            _lock.notify()
+        return
+    with _lock:
+        _idle.append(con)
+        _lock.notify()
+
+def _holder():
+    """Where the current connection and transaction state are kept."""
+    return g if has_app_context() else _local
+
+def get_connection():
+    """The connection of the current request, or of the current thread outside requests."""
+    holder = _holder()
+    con = getattr(holder, "db_connection", None)
+    if con is None:
+        con = _acquire()
+        holder.db_connection = con
+    return con
+
+@contextmanager
+def borrowed_connection():
+    """A pool connection for the block only, for the odd statement outside a request's
+    connection. It isn't kept by the request or thread like get_connection()."""
+    con = _acquire()
+    try:
+        yield con
+    finally:
+        _release(con)
+
+def close_connection(exception=None):
+    """Teardown hook, returns the request's (or thread's) connection to the pool."""
+    holder = _holder()
+    con = getattr(holder, "db_connection", None)
+    if con is not None:
+        holder.db_connection = None
+        _release(con)
+
+def close_pool():
+    """Close all idle connections and stop the writer after the writes already queued,
+    for example when shutting down."""
+    global _opened, _writer, _jobs
+    with _lock:
+        while _idle:
+            con = _idle.pop()
+            _born.pop(con, None)
+            con.close()
+            _opened -= 1
+        writer, jobs = _writer, _jobs
+        _writer = _jobs = None
+    if writer is not None:
+        jobs.put(None)
+        writer.join()
+
+class _Job:
+    """A write waiting for the writer thread. A transaction() block has no sql,
+    its own thread runs the statements while the writer waits for it."""
+    __slots__ = ("sql", "params", "many", "state", "ready", "finished", "done",
+                 "rowcount", "lastrowid", "elapsed", "error", "connection")
+
+    def __init__(self, sql=None, params=None, many=False):
+        self.sql = sql
+        self.params = params
+        self.many = many
+        self.state = "queued"
+        self.ready = threading.Event()
+        self.finished = threading.Event()
+        self.done = threading.Event()
+        self.rowcount = -1
+        self.lastrowid = None
+        self.elapsed = 0.0
+        self.error = None
+        self.connection = None
+
+def queue_depth():
+    """Writes waiting for the writer thread."""
+    jobs = _jobs
+    return jobs.qsize() if jobs is not None else 0
+
+def _submit(job):
+    """Queue a write, starting the writer thread the first time."""
+    global _writer, _jobs
+    with _lock:
+        if _writer is None:
+            con = _connect(read_only=False)
+            _jobs = queue.SimpleQueue()
+            _writer = threading.Thread(target=_write_loop, args=(con, _jobs),
+                                       name="noteapp-writer", daemon=True)
+            _writer.start()
+        stats["writes"] += 1
+        _jobs.put(job)
+
+def _claim(job):
+    """The writer takes a job unless its caller already gave up waiting."""
+    with _lock:
+        if job.state != "queued":
+            return False
+        job.state = "running"
+        return True
+
+def _wait(job, event):
+    """Wait for the writer, giving up after write_timeout if the job hasn't started."""
+    if event.wait(config.write_timeout):
+        return
+    with _lock:
+        if job.state == "queued":
+            job.state = "cancelled"
+            raise sqlite3.OperationalError("write queue timed out")
+    event.wait()
+
+def _finish(job, error=None):
+    """Hand the result of a job back to its caller."""
+    if error is not None:
+        job.error = error
+    job.ready.set()
+    job.done.set()
+
+def _run_job(con, job, batch):
+    """Run one job in the writer's open batch. executemany and transaction() blocks get
+    a savepoint so a failure only undoes their own part, a single statement undoes itself."""
+    try:
+        if not con.in_transaction:
+            con.execute("BEGIN IMMEDIATE")
+    except sqlite3.Error as error:
+        _finish(job, error)
+        return
+    savepoint = job.sql is None or job.many
+    if savepoint:
+        con.execute("SAVEPOINT job")
+    if job.sql is None:
+        job.connection = con
+        job.ready.set()
+        job.finished.wait()
+        error = job.error
+    else:
+        try:
+            start = time.perf_counter()
+            if job.many:
+                cursor = con.executemany(job.sql, job.params)
+            else:
+                cursor = con.execute(job.sql, job.params)
+            job.elapsed = time.perf_counter() - start
+            job.rowcount = cursor.rowcount
+            job.lastrowid = cursor.lastrowid
+            # a cursor left to the garbage collector would keep the connection open
+            # after close() if the writer has to be replaced
+            cursor.close()
+            error = None
+        except Exception as e:
+            error = e
+    if savepoint and con.in_transaction:
+        if error is not None:
+            con.execute("ROLLBACK TO job")
+        con.execute("RELEASE job")
+    if error is None:
+        batch.append(job)
+        return
+    if not con.in_transaction:
+        # the statement rolled back the whole batch
+        for other in batch:
+            _finish(other, error)
+        batch.clear()
+    _finish(job, error)
+
+def _rollback(con):
+    """Roll back what the writer has open, False if even that fails."""
+    try:
+        if con.in_transaction:
+            con.execute("ROLLBACK")
+        return True
+    except sqlite3.Error:
+        return False
+
+def _commit_batch(con, batch):
+    """Commit the writes of a batch and tell their callers. Raises the error
+    if the commit failed and couldn't be rolled back either."""
+    error = None
+    try:
+        if con.in_transaction:
+            con.execute("COMMIT")
+            _count("commits")
+    except sqlite3.Error as e:
+        error = e
+    if config.metrics_enabled and batch:
+        metrics.record_write_batch(len(batch))
+    for job in batch:
+        _finish(job, error)
+    if error is not None and not _rollback(con):
+        raise error
+
+def _replace_writer(con, jobs):
+    """The writer's connection can't be used anymore. Close it and let the next write
+    start a new writer, the writes still queued for this one are handed to it."""
+    global _writer, _jobs
+    try:
+        con.close()
+    except sqlite3.Error:
+        pass
+    with _lock:
+        if _jobs is jobs:
+            _writer = _jobs = None
+    while True:
+        try:
+            job = jobs.get_nowait()
+        except queue.Empty:
+            return
+        if job is None:
+            # close_pool() is stopping this writer anyway
+            continue
+        try:
+            _submit(job)
+        except sqlite3.Error as error:
+            if _claim(job):
+                _finish(job, error)
+
+def _write_loop(con, jobs):
+    """The writer thread. It takes the first waiting job, then the ones queued behind it
+    (up to write_batch_size, waiting group_commit_ms for more) and commits them at once.
+    If the writer's own statements fail (a savepoint, the commit, disk I/O) the batch's
+    jobs fail with the error and the thread goes on, it's the only one that writes."""
+    stopping = False
+    while not stopping:
+        job = jobs.get()
+        batch = []
+        claimed = []
+        ran = 0
+        deadline = time.monotonic() + config.group_commit_ms / 1000
+        try:
+            while True:
+                if job is None:
+                    stopping = True
+                    break
+                if _claim(job):
+                    claimed.append(job)
+                    _run_job(con, job, batch)
+                    ran += 1
+                if ran >= config.write_batch_size:
+                    break
+                try:
+                    timeout = deadline - time.monotonic()
+                    job = jobs.get(timeout=timeout) if timeout > 0 else jobs.get_nowait()
+                except queue.Empty:
+                    break
+            _commit_batch(con, batch)
+        except Exception as error:
+            for other in claimed:
+                if not other.done.is_set():
+                    _finish(other, error)
+            if not _rollback(con):
+                _replace_writer(con, jobs)
+                return
     con.close()
 
+def _write(sql, params, many):
+    """Run a write through the writer, or directly when a transaction() block has it."""
+    holder = _holder()
+    _count("statements")
+    con = getattr(holder, "db_writer", None)
+    if con is not None:
+        start = time.perf_counter()
+        cursor = con.executemany(sql, params) if many else con.execute(sql, params)
+        elapsed = time.perf_counter() - start
+        rowcount, lastrowid = cursor.rowcount, cursor.lastrowid
+    else:
+        job = _Job(sql, params, many)
+        _submit(job)
+        _wait(job, job.done)
+        if job.error is not None:
+            raise job.error
+        con = None
+        elapsed, rowcount, lastrowid = job.elapsed, job.rowcount, job.lastrowid
+    if config.metrics_enabled:
+        # a queued write has no connection here, one is borrowed only to explain a slow one
+        metrics.record_sql(con, sql, None if many else params, elapsed, rowcount)
+    holder.last_insert_id = lastrowid
+    return rowcount
+
+@contextmanager
+def transaction(immediate=False):
+    """Run several writes as one commit, everything is rolled back on error.
+    Nested blocks just join the outer one. The block gets the writer connection
+    for itself, so reads in it see its own writes and nobody writes in between.
+    immediate is kept for old callers, blocks always hold the write lock now."""
+    holder = _holder()
+    if getattr(holder, "db_transaction", False):
+        yield
+        return
+    job = _Job()
+    _submit(job)
+    _wait(job, job.ready)
+    if job.done.is_set():
+        raise job.error
+    holder.db_transaction = True
+    holder.db_writer = job.connection
+    try:
+        yield
+    except BaseException as error:
+        job.error = error
+        raise
+    finally:
+        holder.db_transaction = False
+        holder.db_writer = None
+        job.finished.set()
+    _wait(job, job.done)
+    if job.error is not None:
+        raise job.error
+
+def execute(sql, params=[]):
+    """Writing to db, returns the number of changed rows."""
+    return _write(sql, params, False)
+
+def executemany(sql, params_list):
+    """Writing many rows with the same statement."""
+    return _write(sql, params_list, True)
+
+def _read_connection():
+    """The writer inside a transaction() block so its own writes are seen, otherwise
+    a read-only connection from the pool."""
+    return getattr(_holder(), "db_writer", None) or get_connection()
+
 def last_insert_id():
     """Last inserted row id."""
-    return g.last_insert_id
+    return _holder().last_insert_id
 
-def query(sql, params=[]):
-    """Reading db."""
-    con = get_connection()
-    result = con.execute(sql, params).fetchall()
-    con.close()
-    return result
+def record(name, fields):
+    """A compact row type for a query that's run a lot. It's a namedtuple that can
+    also be read like sqlite3.Row, row["title"], row.title and dict(row) all work.
+    The fields must be the query's columns in order, query() checks that."""
+    base = namedtuple(name, fields)
+    index = {field: i for i, field in enumerate(base._fields)}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = index[key]
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return self._fields
+
+    return type(name, (base,), {"__slots__": (), "__getitem__": __getitem__, "keys": keys})
+
+def _cursor(con, sql, params, row):
+    """Cursor for sql, giving plain tuples when the rows are made into records."""
+    if row is None:
+        return con.execute(sql, params)
+    cursor = con.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql, params)
+    columns = tuple(column[0] for column in cursor.description)
+    if columns != row._fields:
+        raise ValueError(row.__name__ + " has fields " + ", ".join(row._fields) +
+                         " but the query has " + ", ".join(columns))
+    return cursor
+
+def _fetch(cursor, row):
+    """All rows of a cursor, as records if there's a row type."""
+    if row is None:
+        return cursor.fetchall()
+    return list(map(row._make, cursor))
+
+def query(sql, params=[], row=None):
+    """Reading db. row is a record() type for the results instead of sqlite3.Row."""
+    con = _read_connection()
+    _count("statements")
+    if config.metrics_enabled:
+        start = time.perf_counter()
+        result = _fetch(_cursor(con, sql, params, row), row)
+        metrics.record_sql(con, sql, params, time.perf_counter() - start, len(result))
+        return result
+    return _fetch(_cursor(con, sql, params, row), row)
+
+def iter_query(sql, params=[], row=None):
+    """Reading db a row at a time, for results too big to load at once."""
+    con = _read_connection()
+    _count("statements")
+    make = row._make if row is not None else None
+    if not config.metrics_enabled:
+        cursor = _cursor(con, sql, params, row)
+        yield from map(make, cursor) if make else cursor
+        return
+    # only time spent in sqlite counts, not what the caller does between rows
+    start = time.perf_counter()
+    cursor = _cursor(con, sql, params, row)
+    elapsed = time.perf_counter() - start
+    rows = 0
+    while True:
+        start = time.perf_counter()
+        result = cursor.fetchone()
+        elapsed += time.perf_counter() - start
+        if result is None:
+            break
+        rows += 1
+        yield make(result) if make else result
+    metrics.record_sql(con, sql, params, elapsed, rows)
+
+def parse_cursor(cursor):
+    """A listing cursor is "updated_at_id" of a row, None if it's missing or broken."""
+    if not cursor:
+        return None
+    updated_at, _, row_id = cursor.rpartition("_")
+    if not updated_at or not row_id.isdigit():
+        return None
+    return (updated_at, int(row_id))
+
+def make_cursor(row):
+    """Cursor pointing at a listing row."""
+    return row["updated_at"] + "_" + str(row["id"])
+
+def query_page(sql, params, limit, before=None, after=None, row=None):
+    """Keyset pagination for listings ordered newest first by (n.updated_at, n.id).
+    The sql has a {keyset} condition in its WHERE and {order} as the sort direction.
+    before gives the page after the cursor row, after the page preceding it.
+    Returns the rows with next and prev cursors, None when there's no such page.
+    row is a record() type for the rows."""
+    before = parse_cursor(before)
+    after = None if before else parse_cursor(after)
+    if before:
+        keyset, order, cursor = "(n.updated_at, n.id) < (?, ?)", "DESC", list(before)
+    elif after:
+        keyset, order, cursor = "(n.updated_at, n.id) > (?, ?)", "ASC", list(after)
+    else:
+        keyset, order, cursor = "1", "DESC", []
+    rows = query(sql.format(keyset=keyset, order=order), params + cursor + [limit + 1], row)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if after:
+        rows.reverse()
+    page = {"rows": rows, "next": None, "prev": None}
+    if rows:
+        if more or after:
+            page["next"] = make_cursor(rows[-1])
+        if before or (after and more):
+            page["prev"] = make_cursor(rows[0])
+    return page
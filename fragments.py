@@ -0,0 +1,49 @@
+"""
+Cache of rendered rows for the note lists. A row is keyed by its template,
+the note's id, updated_at and version, so a changed note gets a new key and
+its old rows fall out of the cache in time. Least recently used rows are
+dropped when there are more than fragment_cache_size rows or their HTML
+takes more than fragment_cache_bytes. Each worker process has its own cache.
+"""
+from collections import OrderedDict
+import threading
+
+import config
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_size = 0
+stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def get(key):
+    """Cached HTML for key, or None."""
+    with _lock:
+        html = _cache.get(key)
+        if html is None:
+            stats["misses"] += 1
+            return None
+        _cache.move_to_end(key)
+        stats["hits"] += 1
+        return html
+
+def put(key, html):
+    """Cache HTML for key, dropping old rows to stay within the limits."""
+    global _size
+    if len(html) > config.fragment_cache_bytes:
+        return
+    with _lock:
+        if key in _cache:
+            _size -= len(_cache.pop(key))
+        _cache[key] = html
+        _size += len(html)
+        while len(_cache) > config.fragment_cache_size or _size > config.fragment_cache_bytes:
+            _, old = _cache.popitem(last=False)
+            _size -= len(old)
+            stats["evictions"] += 1
+
+def clear():
+    """Empty the cache."""
+    global _size
+    with _lock:
+        _cache.clear()
+        _size = 0
@@ -0,0 +1,75 @@
+"""
+Password hashing in a small pool of worker processes so a burst of logins
+doesn't take the CPU from the request threads. At most hash_queue_size
+hashes wait or run at a time, more than that are turned away with Busy.
+hash_workers = 0 in config.py hashes in the request thread like before.
+The workers are started with spawn, so scripts that hash passwords need
+the usual if __name__ == "__main__" guard.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import threading
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+import config
+
+class Busy(Exception):
+    """Too many passwords are being hashed already."""
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = None
+
+def _after_fork():
+    """Worker processes of serve.py start their own pool."""
+    global _pool, _pool_lock, _slots
+    _pool = None
+    _pool_lock = threading.Lock()
+    _slots = None
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def _get_pool():
+    """The process pool, started on first use."""
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            # spawn, forking a process that has threads running isn't safe
+            _pool = ProcessPoolExecutor(max_workers=config.hash_workers,
+                                        mp_context=multiprocessing.get_context("spawn"))
+            _slots = threading.BoundedSemaphore(config.hash_queue_size)
+        return _pool
+
+def _run(function, *args):
+    """Run a hashing function in the pool and wait for the result."""
+    if not config.hash_workers:
+        return function(*args)
+    pool = _get_pool()
+    if not _slots.acquire(timeout=config.hash_wait):
+        raise Busy()
+    try:
+        return pool.submit(function, *args).result()
+    finally:
+        _slots.release()
+
+def hash_password(password):
+    """Hash with the configured method."""
+    return _run(generate_password_hash, password, config.password_hash_method)
+
+def check_password(password_hash, password):
+    """Whether the password matches the hash."""
+    return _run(check_password_hash, password_hash, password)
+
+def needs_rehash(password_hash):
+    """Whether the hash was made with other parameters than the configured ones."""
+    return password_hash.split("$", 1)[0] != config.password_hash_method
+
+def shutdown():
+    """Stop the worker processes."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
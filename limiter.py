@@ -0,0 +1,36 @@
+"""
+Token buckets for limiting how often something can be tried, used for
+logins so a flood of attempts is turned away before any password hashing.
+A bucket holds up to burst tokens and gets rate new ones per minute.
+Every worker process has its own buckets.
+"""
+import threading
+import time
+
+import config
+
+_buckets = {}
+_lock = threading.Lock()
+
+def allow(key, burst, rate):
+    """Take a token from the bucket of key, False if it's empty."""
+    now = time.monotonic()
+    with _lock:
+        if key not in _buckets and len(_buckets) >= config.limiter_buckets:
+            _forget(now)
+        tokens, updated = _buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate / 60)
+        if tokens < 1:
+            _buckets[key] = (tokens, now)
+            return False
+        _buckets[key] = (tokens - 1, now)
+        return True
+
+def _forget(now):
+    """Drop buckets idle long enough to be full again, or the oldest half
+    if that isn't enough."""
+    idle = [key for key, (_, updated) in _buckets.items() if now - updated > 3600]
+    if len(idle) < len(_buckets) // 10:
+        idle = sorted(_buckets, key=lambda key: _buckets[key][1])[:len(_buckets) // 2]
+    for key in idle:
+        del _buckets[key]
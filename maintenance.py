@@ -0,0 +1,211 @@
+"""
+Upkeep the database needs now and then: WAL checkpoints, incremental vacuum
+after notes and comments are removed, fresh statistics for the query planner
+and integrity checks. A background thread in each server worker runs the
+tasks that are due, and the maintenance table makes sure only one worker
+runs a task per interval. `flask --app app maintain` runs them from cron
+instead. Every task has a time budget and works in short steps, so writers
+never wait on it for long. Each run returns a report of what it did.
+"""
+from contextlib import contextmanager
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import config
+
+logger = logging.getLogger("noteapp.maintenance")
+
+# vacuum first, in WAL mode the file only shrinks at the checkpoint after it
+TASKS = ("vacuum", "checkpoint", "analyze", "integrity")
+
+stats = {"runs": 0, "unfinished": 0, "reclaimed_bytes": 0, "checkpointed_bytes": 0,
+         "analyzed_tables": 0, "integrity_errors": 0}
+
+_lock = threading.Lock()
+_thread = None
+
+def _after_fork():
+    """The maintenance thread isn't copied to a forked worker, it starts its own."""
+    global _lock, _thread
+    _lock = threading.Lock()
+    _thread = None
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def connect():
+    """A connection of its own, waiting at most maintenance_lock_wait for locks."""
+    con = sqlite3.connect(config.database, isolation_level=None, check_same_thread=False)
+    con.execute("PRAGMA busy_timeout = " + str(int(config.maintenance_lock_wait * 1000)))
+    con.row_factory = sqlite3.Row
+    return con
+
+@contextmanager
+def time_limit(con, deadline):
+    """Interrupt the statement running on con when deadline passes."""
+    con.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+    try:
+        yield
+    finally:
+        con.set_progress_handler(None, 0)
+
+def file_size(path):
+    """Size of a file in bytes, 0 if it doesn't exist."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def checkpoint(con, deadline):
+    """Copy the WAL into the database file and truncate it. Busy when readers or
+    writers kept it from finishing, it's tried again next time."""
+    wal = config.database + "-wal"
+    before = file_size(wal)
+    size = file_size(config.database)
+    busy = con.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0]
+    after = file_size(wal)
+    stats["checkpointed_bytes"] += before - after
+    return {"finished": not busy, "wal_bytes_before": before, "wal_bytes_after": after,
+            "file_bytes_before": size, "file_bytes_after": file_size(config.database)}
+
+def vacuum(con, deadline):
+    """Give free pages back to the file system vacuum_step_pages at a time,
+    each step its own short write transaction. With WAL the file shrinks at the next checkpoint."""
+    free = con.execute("PRAGMA freelist_count").fetchone()[0]
+    if con.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return {"finished": True, "free_pages": free,
+                "skipped": "auto_vacuum isn't incremental, see flask maintain --enable-vacuum"}
+    page_size = con.execute("PRAGMA page_size").fetchone()[0]
+    before = free
+    while free and time.monotonic() < deadline:
+        # a plain execute stops after the first page, executescript runs it to the end
+        con.executescript("PRAGMA incremental_vacuum(" + str(int(config.vacuum_step_pages)) + ")")
+        free = con.execute("PRAGMA freelist_count").fetchone()[0]
+        time.sleep(config.maintenance_pause)
+    reclaimed = (before - free) * page_size
+    stats["reclaimed_bytes"] += reclaimed
+    return {"finished": not free, "reclaimed_bytes": reclaimed, "free_pages": free}
+
+def analyze(con, deadline):
+    """Planner statistics table by table, sampling at most analysis_limit rows per index.
+    Open connections keep the old ones, db.py replaces its connections every pool_recycle seconds."""
+    con.execute("PRAGMA analysis_limit = " + str(int(config.analysis_limit)))
+    sql = """SELECT name FROM sqlite_schema
+             WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND sql NOT LIKE 'CREATE VIRTUAL%'
+             ORDER BY name"""
+    tables = [row["name"] for row in con.execute(sql)]
+    analyzed = []
+    try:
+        with time_limit(con, deadline):
+            for table in tables:
+                con.execute('ANALYZE "' + table.replace('"', '""') + '"')
+                analyzed.append(table)
+                time.sleep(config.maintenance_pause)
+    except sqlite3.OperationalError as error:
+        if "interrupted" not in str(error):
+            raise
+    stats["analyzed_tables"] += len(analyzed)
+    return {"finished": len(analyzed) == len(tables), "analyzed_tables": len(analyzed),
+            "tables": len(tables)}
+
+def integrity(con, deadline, full=False):
+    """quick_check, or the slower integrity_check with full, and the foreign keys.
+    Only reads, so nobody waits for it."""
+    try:
+        with time_limit(con, deadline):
+            check = "PRAGMA integrity_check" if full else "PRAGMA quick_check"
+            errors = [row[0] for row in con.execute(check) if row[0] != "ok"]
+            foreign_keys = len(con.execute("PRAGMA foreign_key_check").fetchall())
+    except sqlite3.OperationalError as error:
+        if "interrupted" not in str(error):
+            raise
+        return {"finished": False}
+    stats["integrity_errors"] += len(errors) + foreign_keys
+    return {"finished": True, "ok": not errors and not foreign_keys,
+            "errors": errors[:20], "foreign_key_errors": foreign_keys}
+
+def run_task(con, task, full=False):
+    """Run one task within maintenance_budget seconds, returns its report."""
+    start = time.monotonic()
+    deadline = start + config.maintenance_budget
+    if task == "integrity":
+        report = integrity(con, deadline, full)
+    else:
+        report = globals()[task](con, deadline)
+    report = dict(task=task, seconds=round(time.monotonic() - start, 3), **report)
+    stats["runs"] += 1
+    if not report["finished"]:
+        stats["unfinished"] += 1
+    if report.get("ok") is False:
+        logger.error("maintenance %s: %s", task, json.dumps(report))
+    else:
+        logger.info("maintenance %s: %s", task, json.dumps(report))
+    return report
+
+def claim(con, task, now):
+    """Mark the task as run if it's due, False when another worker already ran it."""
+    sql = "UPDATE maintenance SET last_run = ? WHERE task = ? AND last_run <= ?"
+    result = con.execute(sql, [now, task, now - config.maintenance_intervals[task]])
+    return result.rowcount == 1
+
+def run_due(tasks=TASKS, force=False, full=False):
+    """Run the tasks whose interval has passed, or all of them with force. Returns the reports."""
+    reports = []
+    con = connect()
+    try:
+        for task in tasks:
+            now = int(time.time())
+            if force:
+                con.execute("UPDATE maintenance SET last_run = ? WHERE task = ?", [now, task])
+            elif not claim(con, task, now):
+                continue
+            report = run_task(con, task, full)
+            con.execute("UPDATE maintenance SET report = ? WHERE task = ?", [json.dumps(report), task])
+            reports.append(report)
+    finally:
+        con.close()
+    return reports
+
+def last_reports():
+    """The latest report of each task with when it ran, by any worker or cron."""
+    con = connect()
+    try:
+        rows = con.execute("SELECT task, last_run, report FROM maintenance ORDER BY task").fetchall()
+    finally:
+        con.close()
+    return {row["task"]: dict(json.loads(row["report"] or "{}"), last_run=row["last_run"])
+            for row in rows}
+
+def enable_vacuum():
+    """Switch an existing database to incremental vacuum. That needs a full VACUUM which
+    rewrites the whole file and keeps everyone waiting, so it's left to the command line."""
+    con = connect()
+    try:
+        before = file_size(config.database)
+        con.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        con.execute("VACUUM")
+        return {"file_bytes_before": before, "file_bytes_after": file_size(config.database)}
+    finally:
+        con.close()
+
+def _loop():
+    """The maintenance thread, checks for due tasks every maintenance_check_interval."""
+    while True:
+        time.sleep(config.maintenance_check_interval)
+        try:
+            run_due()
+        except Exception:
+            logger.exception("maintenance failed")
+
+def start():
+    """before_request hook, starts the maintenance thread of this worker the first time."""
+    global _thread
+    if _thread is not None or not config.maintenance_enabled:
+        return
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_loop, name="noteapp-maintenance", daemon=True)
+            _thread.start()
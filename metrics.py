@@ -0,0 +1,175 @@
+"""
+Request and SQL metrics for the /metrics page in Prometheus text format.
+db.py reports every statement here and app.py times every request.
+Everything is off with metrics_enabled = False in config.py, then db.py
+only checks that one setting. Each worker process has its own numbers.
+"""
+import logging
+import re
+import threading
+import time
+
+from flask import g, has_app_context, request
+
+import config
+
+logger = logging.getLogger("noteapp.sql")
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# writes committed together by the db.py writer
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+# distinct normalized statements kept, the rest are counted as "other"
+MAX_STATEMENTS = 500
+
+_lock = threading.Lock()
+_routes = {}
+_statements = {}
+_batches = {"buckets": [0] * len(BATCH_BUCKETS), "count": 0, "sum": 0}
+
+def normalize(sql):
+    """Statement without literals and extra whitespace so equal queries are counted together."""
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+\b", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", sql)
+    return " ".join(sql.split())
+
+def record_sql(con, sql, params, elapsed, rows):
+    """Called by db.py after each statement when metrics are enabled.
+    con is None for writes that went through the writer queue."""
+    statement = normalize(sql)
+    with _lock:
+        if statement not in _statements and len(_statements) >= MAX_STATEMENTS:
+            statement = "other"
+        totals = _statements.setdefault(statement, [0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += elapsed
+        totals[2] += rows
+    if has_app_context():
+        sql_totals = g.setdefault("sql_totals", [0, 0.0, 0])
+        sql_totals[0] += 1
+        sql_totals[1] += elapsed
+        sql_totals[2] += rows
+    if config.slow_query_ms is not None and elapsed * 1000 >= config.slow_query_ms:
+        log_slow_query(con, sql, params, elapsed)
+
+def record_write_batch(size):
+    """Called by the db.py writer thread after each commit with the number of writes in it."""
+    with _lock:
+        for i, bound in enumerate(BATCH_BUCKETS):
+            if size <= bound:
+                _batches["buckets"][i] += 1
+        _batches["count"] += 1
+        _batches["sum"] += size
+
+def log_slow_query(con, sql, params, elapsed):
+    """Log a slow statement with its query plan. Batches from executemany have no params.
+    Without con, a pool connection is borrowed for the plan and given back right away."""
+    if params is None:
+        logger.warning("slow batch %.1f ms: %s", elapsed * 1000, " ".join(sql.split()))
+        return
+    try:
+        if con is None:
+            # db.py imports this module
+            import db
+            with db.borrowed_connection() as borrowed:
+                plan = borrowed.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        else:
+            plan = con.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        plan = "\n".join("    " + row[3] for row in plan)
+    except Exception as error:
+        plan = "    (no plan: " + str(error) + ")"
+    logger.warning("slow query %.1f ms: %s\n%s", elapsed * 1000, " ".join(sql.split()), plan)
+
+def start_request():
+    """before_request hook."""
+    if config.metrics_enabled:
+        g.request_start = time.perf_counter()
+
+def finish_request(response):
+    """after_request hook, records the latency and SQL totals of the route."""
+    if not config.metrics_enabled or "request_start" not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    key = (route, request.method, str(response.status_code))
+    sql_totals = g.get("sql_totals", [0, 0.0, 0])
+    with _lock:
+        totals = _routes.get(key)
+        if totals is None:
+            totals = _routes[key] = {"count": 0, "seconds": 0.0, "buckets": [0] * len(BUCKETS),
+                                     "statements": 0, "sql_seconds": 0.0, "rows": 0}
+        totals["count"] += 1
+        totals["seconds"] += elapsed
+        for i, bound in enumerate(BUCKETS):
+            if elapsed <= bound:
+                totals["buckets"][i] += 1
+        totals["statements"] += sql_totals[0]
+        totals["sql_seconds"] += sql_totals[1]
+        totals["rows"] += sql_totals[2]
+    return response
+
+def labels(**values):
+    """Prometheus label set."""
+    parts = []
+    for name, value in values.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(name + '="' + value + '"')
+    return "{" + ",".join(parts) + "}"
+
+def render(counters={}, gauges={}):
+    """All metrics in Prometheus text format. counters are extra dicts of named counts,
+    like db.stats, exported under the given metric names. gauges are single current
+    values like the write queue depth."""
+    lines = []
+    def metric(name, kind, help_text):
+        lines.append("# HELP " + name + " " + help_text)
+        lines.append("# TYPE " + name + " " + kind)
+
+    with _lock:
+        routes = {key: dict(totals, buckets=list(totals["buckets"])) for key, totals in _routes.items()}
+        statements = {key: list(totals) for key, totals in _statements.items()}
+        batches = dict(_batches, buckets=list(_batches["buckets"]))
+
+    metric("noteapp_request_seconds", "histogram", "Request latency by route.")
+    for (route, method, status), totals in sorted(routes.items()):
+        for bound, count in zip(BUCKETS, totals["buckets"]):
+            lines.append("noteapp_request_seconds_bucket" +
+                         labels(route=route, method=method, status=status, le=bound) + " " + str(count))
+        lines.append("noteapp_request_seconds_bucket" +
+                     labels(route=route, method=method, status=status, le="+Inf") + " " + str(totals["count"]))
+        lines.append("noteapp_request_seconds_sum" +
+                     labels(route=route, method=method, status=status) + " " + repr(totals["seconds"]))
+        lines.append("noteapp_request_seconds_count" +
+                     labels(route=route, method=method, status=status) + " " + str(totals["count"]))
+
+    for name, field, help_text in (
+            ("noteapp_request_sql_statements_total", "statements", "SQL statements run by requests to the route."),
+            ("noteapp_request_sql_seconds_total", "sql_seconds", "Time spent in SQL by requests to the route."),
+            ("noteapp_request_sql_rows_total", "rows", "Rows returned or changed by requests to the route.")):
+        metric(name, "counter", help_text)
+        for (route, method, status), totals in sorted(routes.items()):
+            lines.append(name + labels(route=route, method=method, status=status) + " " + str(totals[field]))
+
+    for name, index, help_text in (
+            ("noteapp_sql_calls_total", 0, "Calls of each normalized SQL statement."),
+            ("noteapp_sql_seconds_total", 1, "Time spent in each normalized SQL statement."),
+            ("noteapp_sql_rows_total", 2, "Rows returned or changed by each normalized SQL statement.")):
+        metric(name, "counter", help_text)
+        for statement, totals in sorted(statements.items()):
+            lines.append(name + labels(statement=statement) + " " + str(totals[index]))
+
+    metric("noteapp_write_batch_size", "histogram", "Writes committed in one transaction by the writer.")
+    for bound, count in zip(BATCH_BUCKETS, batches["buckets"]):
+        lines.append("noteapp_write_batch_size_bucket" + labels(le=bound) + " " + str(count))
+    lines.append("noteapp_write_batch_size_bucket" + labels(le="+Inf") + " " + str(batches["count"]))
+    lines.append("noteapp_write_batch_size_sum " + str(batches["sum"]))
+    lines.append("noteapp_write_batch_size_count " + str(batches["count"]))
+
+    for name, values in counters.items():
+        metric(name, "counter", name.replace("_", " ") + ".")
+        for key, value in values.items():
+            lines.append(name + labels(kind=key) + " " + str(value))
+    for name, value in gauges.items():
+        metric(name, "gauge", name.replace("_", " ") + ".")
+        lines.append(name + " " + str(value))
+    return "\n".join(lines) + "\n"
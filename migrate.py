@@ -0,0 +1,71 @@
+"""
+Schema migrations. schema.sql is the starting point and the files in
+migrations/ are run in order on top of it. The schema_version table
+remembers which of them the database already has.
+"""
+import os
+import sqlite3
+
+import config
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+def get_migrations():
+    """All migration files as (version, filename) in order."""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        if filename.endswith(".sql"):
+            version = int(filename.split("_", 1)[0])
+            migrations.append((version, filename))
+    return sorted(migrations)
+
+def get_version(con):
+    """Schema version of the database, 0 is plain schema.sql."""
+    con.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER)")
+    result = con.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return result[0] or 0
+
+def migrate(target=None):
+    """Upgrade the database in place, returns the migrations that were run.
+    Each migration is its own transaction so a failing one leaves the earlier ones done."""
+    con = sqlite3.connect(config.database, isolation_level=None)
+    # table rebuilds need foreign keys off, they're checked before each commit instead
+    con.execute("PRAGMA foreign_keys = OFF")
+    done = []
+    try:
+        version = get_version(con)
+        for number, filename in get_migrations():
+            if number <= version or (target is not None and number > target):
+                continue
+            with open(os.path.join(MIGRATIONS_DIR, filename)) as f:
+                script = f.read()
+            con.execute("BEGIN")
+            try:
+                for statement in split_statements(script):
+                    con.execute(statement)
+                if con.execute("PRAGMA foreign_key_check").fetchall():
+                    raise sqlite3.IntegrityError(filename + " broke foreign keys")
+                con.execute("INSERT INTO schema_version (version) VALUES (?)", [number])
+                con.execute("COMMIT")
+            except sqlite3.Error:
+                con.execute("ROLLBACK")
+                raise
+            done.append(filename)
+    finally:
+        con.close()
+    return done
+
+def split_statements(script):
+    """Split an sql script into statements, triggers can have ; inside them."""
+    statements = []
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        if not statement and line.strip().startswith("--"):
+            continue
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement.strip())
+            statement = ""
+    if statement.strip():
+        statements.append(statement.strip())
+    return statements
@@ -0,0 +1,4 @@
+-- Indexes for the listing, search and stats queries, they used to scan whole tables.
+CREATE INDEX notes_user_updated ON notes (user_id, updated_at);
+CREATE INDEX shares_user ON shares (user_id, note_id);
+CREATE INDEX comments_note ON comments (note_id);
@@ -0,0 +1,9 @@
+-- A note is shared with a user only once and has one value per class.
+-- Older databases could have duplicates, the oldest row is kept.
+DELETE FROM shares
+ WHERE id NOT IN (SELECT MIN(id) FROM shares GROUP BY note_id, user_id);
+CREATE UNIQUE INDEX shares_note_user ON shares (note_id, user_id);
+
+DELETE FROM note_classes
+ WHERE id NOT IN (SELECT MIN(id) FROM note_classes GROUP BY note_id, title);
+CREATE UNIQUE INDEX note_classes_note_title ON note_classes (note_id, title);
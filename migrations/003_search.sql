@@ -0,0 +1,44 @@
+-- Full-text search over note titles, contents and comments.
+-- The rowid of notes_search is the note id, triggers keep it in sync.
+CREATE VIRTUAL TABLE notes_search USING fts5(
+    title, content, comments,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+INSERT INTO notes_search (rowid, title, content, comments)
+SELECT n.id, n.title, n.content,
+       (SELECT group_concat(c.content, char(10)) FROM comments c WHERE c.note_id = n.id)
+FROM notes n;
+
+CREATE TRIGGER notes_search_insert AFTER INSERT ON notes BEGIN
+    INSERT INTO notes_search (rowid, title, content, comments)
+    VALUES (NEW.id, NEW.title, NEW.content, NULL);
+END;
+
+CREATE TRIGGER notes_search_update AFTER UPDATE OF title, content ON notes BEGIN
+    UPDATE notes_search SET title = NEW.title, content = NEW.content
+     WHERE rowid = NEW.id;
+END;
+
+CREATE TRIGGER notes_search_delete AFTER DELETE ON notes BEGIN
+    DELETE FROM notes_search WHERE rowid = OLD.id;
+END;
+
+CREATE TRIGGER comments_search_insert AFTER INSERT ON comments BEGIN
+    UPDATE notes_search
+       SET comments = (SELECT group_concat(content, char(10)) FROM comments WHERE note_id = NEW.note_id)
+     WHERE rowid = NEW.note_id;
+END;
+
+CREATE TRIGGER comments_search_update AFTER UPDATE OF content ON comments BEGIN
+    UPDATE notes_search
+       SET comments = (SELECT group_concat(content, char(10)) FROM comments WHERE note_id = NEW.note_id)
+     WHERE rowid = NEW.note_id;
+END;
+
+CREATE TRIGGER comments_search_delete AFTER DELETE ON comments BEGIN
+    UPDATE notes_search
+       SET comments = (SELECT group_concat(content, char(10)) FROM comments WHERE note_id = OLD.note_id)
+     WHERE rowid = OLD.note_id;
+END;
@@ -0,0 +1,10 @@
+-- Copies of the Status, Priority and Context classes on the note row so listings
+-- don't need a subquery per class. note_classes stays the source of truth.
+ALTER TABLE notes ADD COLUMN status TEXT;
+ALTER TABLE notes ADD COLUMN priority TEXT;
+ALTER TABLE notes ADD COLUMN context TEXT;
+
+UPDATE notes SET
+    status = (SELECT value FROM note_classes WHERE note_id = notes.id AND title = 'Status'),
+    priority = (SELECT value FROM note_classes WHERE note_id = notes.id AND title = 'Priority'),
+    context = (SELECT value FROM note_classes WHERE note_id = notes.id AND title = 'Context');
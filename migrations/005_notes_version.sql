@@ -0,0 +1,14 @@
+-- Counter bumped on every write to a user's notes, caches compare against it.
+ALTER TABLE users ADD COLUMN notes_version INTEGER NOT NULL DEFAULT 0;
+
+CREATE TRIGGER notes_version_insert AFTER INSERT ON notes BEGIN
+    UPDATE users SET notes_version = notes_version + 1 WHERE id = NEW.user_id;
+END;
+
+CREATE TRIGGER notes_version_update AFTER UPDATE ON notes BEGIN
+    UPDATE users SET notes_version = notes_version + 1 WHERE id = NEW.user_id;
+END;
+
+CREATE TRIGGER notes_version_delete AFTER DELETE ON notes BEGIN
+    UPDATE users SET notes_version = notes_version + 1 WHERE id = OLD.user_id;
+END;
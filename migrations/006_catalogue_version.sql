@@ -0,0 +1,19 @@
+-- Version stamp of the classes table, bumped by any change to it,
+-- so every process knows when its cached copy is stale.
+CREATE TABLE catalogue_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+INSERT INTO catalogue_version (id, version) VALUES (1, 0);
+
+CREATE TRIGGER classes_version_insert AFTER INSERT ON classes BEGIN
+    UPDATE catalogue_version SET version = version + 1;
+END;
+
+CREATE TRIGGER classes_version_update AFTER UPDATE ON classes BEGIN
+    UPDATE catalogue_version SET version = version + 1;
+END;
+
+CREATE TRIGGER classes_version_delete AFTER DELETE ON classes BEGIN
+    UPDATE catalogue_version SET version = version + 1;
+END;
@@ -0,0 +1,8 @@
+-- Server side sessions, the cookie only carries the id.
+CREATE TABLE sessions (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires_at INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX sessions_expires ON sessions (expires_at);
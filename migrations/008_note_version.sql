@@ -0,0 +1,42 @@
+-- Counter bumped whenever anything shown on a note's page changes, used for ETags.
+-- users.notes_version now also changes for the users a note is shared with,
+-- so it covers everything on their note lists.
+ALTER TABLE notes ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+
+DROP TRIGGER notes_version_update;
+CREATE TRIGGER notes_version_update
+AFTER UPDATE OF title, content, updated_at, status, priority, context ON notes BEGIN
+    UPDATE notes SET version = version + 1 WHERE id = NEW.id;
+    UPDATE users SET notes_version = notes_version + 1
+     WHERE id = NEW.user_id OR id IN (SELECT user_id FROM shares WHERE note_id = NEW.id);
+END;
+
+DROP TRIGGER notes_version_delete;
+CREATE TRIGGER notes_version_delete AFTER DELETE ON notes BEGIN
+    UPDATE users SET notes_version = notes_version + 1
+     WHERE id = OLD.user_id OR id IN (SELECT user_id FROM shares WHERE note_id = OLD.id);
+END;
+
+CREATE TRIGGER shares_version_insert AFTER INSERT ON shares BEGIN
+    UPDATE notes SET version = version + 1 WHERE id = NEW.note_id;
+    UPDATE users SET notes_version = notes_version + 1
+     WHERE id = NEW.user_id OR id = (SELECT user_id FROM notes WHERE id = NEW.note_id);
+END;
+
+CREATE TRIGGER shares_version_delete AFTER DELETE ON shares BEGIN
+    UPDATE notes SET version = version + 1 WHERE id = OLD.note_id;
+    UPDATE users SET notes_version = notes_version + 1
+     WHERE id = OLD.user_id OR id = (SELECT user_id FROM notes WHERE id = OLD.note_id);
+END;
+
+CREATE TRIGGER comments_version_insert AFTER INSERT ON comments BEGIN
+    UPDATE notes SET version = version + 1 WHERE id = NEW.note_id;
+END;
+
+CREATE TRIGGER comments_version_update AFTER UPDATE OF content ON comments BEGIN
+    UPDATE notes SET version = version + 1 WHERE id = NEW.note_id;
+END;
+
+CREATE TRIGGER comments_version_delete AFTER DELETE ON comments BEGIN
+    UPDATE notes SET version = version + 1 WHERE id = OLD.note_id;
+END;
@@ -0,0 +1,13 @@
+-- Note and comment text stored also as escaped HTML with newlines as <br />,
+-- rendered when the text is written so pages can show it as is.
+-- The escaping here matches markupsafe's, & first so the others aren't escaped twice.
+ALTER TABLE notes ADD COLUMN content_html TEXT;
+ALTER TABLE comments ADD COLUMN content_html TEXT;
+
+UPDATE notes SET content_html =
+    replace(replace(replace(replace(replace(replace(content,
+        '&', '&amp;'), '<', '&lt;'), '>', '&gt;'), '"', '&#34;'), '''', '&#39;'), char(10), '<br />');
+
+UPDATE comments SET content_html =
+    replace(replace(replace(replace(replace(replace(content,
+        '&', '&amp;'), '<', '&lt;'), '>', '&gt;'), '"', '&#34;'), '''', '&#39;'), char(10), '<br />');
@@ -0,0 +1,9 @@
+-- Tokens for the JSON API. Only a sha256 of the token is stored,
+-- the token itself is shown once when it's created.
+CREATE TABLE api_tokens (
+    token_hash TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users,
+    created_at TEXT
+) WITHOUT ROWID;
+
+CREATE INDEX api_tokens_user ON api_tokens (user_id);
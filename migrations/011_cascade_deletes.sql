@@ -0,0 +1,98 @@
+-- Classes, shares and comments go away with their note, so removing notes is one DELETE.
+-- SQLite can't change a foreign key in place, the tables are rebuilt with the same
+-- columns, indexes and triggers. The notes triggers that read shares are dropped
+-- first, the rename checks every trigger and shares is gone for a moment.
+DROP TRIGGER notes_version_update;
+DROP TRIGGER notes_version_delete;
+
+CREATE TABLE note_classes_new (
+    id INTEGER PRIMARY KEY,
+    note_id INTEGER REFERENCES notes ON DELETE CASCADE,
+    title TEXT,
+    value TEXT
+);
+INSERT INTO note_classes_new (id, note_id, title, value)
+SELECT id, note_id, title, value FROM note_classes;
+DROP TABLE note_classes;
+ALTER TABLE note_classes_new RENAME TO note_classes;
+CREATE UNIQUE INDEX note_classes_note_title ON note_classes (note_id, title);
+
+CREATE TABLE shares_new (
+    id INTEGER PRIMARY KEY,
+    note_id INTEGER REFERENCES notes ON DELETE CASCADE,
+    user_id INTEGER REFERENCES users
+);
+INSERT INTO shares_new (id, note_id, user_id)
+SELECT id, note_id, user_id FROM shares;
+DROP TABLE shares;
+ALTER TABLE shares_new RENAME TO shares;
+CREATE INDEX shares_user ON shares (user_id, note_id);
+CREATE UNIQUE INDEX shares_note_user ON shares (note_id, user_id);
+
+CREATE TRIGGER shares_version_insert AFTER INSERT ON shares BEGIN
+    UPDATE notes SET version = version + 1 WHERE id = NEW.note_id;
+    UPDATE users SET notes_version = notes_version + 1
+     WHERE id = NEW.user_id OR id = (SELECT user_id FROM notes WHERE id = NEW.note_id);
+END;
+
+CREATE TRIGGER shares_version_delete AFTER DELETE ON shares BEGIN
+    UPDATE notes SET version = version + 1 WHERE id = OLD.note_id;
+    UPDATE users SET notes_version = notes_version + 1
+     WHERE id = OLD.user_id OR id = (SELECT user_id FROM notes WHERE id = OLD.note_id);
+END;
+
+CREATE TABLE comments_new (
+    id INTEGER PRIMARY KEY,
+    note_id INTEGER REFERENCES notes ON DELETE CASCADE,
+    user_id INTEGER REFERENCES users,
+    content TEXT,
+    created_at TEXT,
+    content_html TEXT
+);
+INSERT INTO comments_new (id, note_id, user_id, content, created_at, content_html)
+SELECT id, note_id, user_id, content, created_at, content_html FROM comments;
+DROP TABLE comments;
+ALTER TABLE comments_new RENAME TO comments;
+CREATE INDEX comments_note ON comments (note_id);
+
+CREATE TRIGGER comments_search_insert AFTER INSERT ON comments BEGIN
+    UPDATE notes_search
+       SET comments = (SELECT group_concat(content, char(10)) FROM comments WHERE note_id = NEW.note_id)
+     WHERE rowid = NEW.note_id;
+END;
+
+CREATE TRIGGER comments_search_update AFTER UPDATE OF content ON comments BEGIN
+    UPDATE notes_search
+       SET comments = (SELECT group_concat(content, char(10)) FROM comments WHERE note_id = NEW.note_id)
+     WHERE rowid = NEW.note_id;
+END;
+
+CREATE TRIGGER comments_search_delete AFTER DELETE ON comments BEGIN
+    UPDATE notes_search
+       SET comments = (SELECT group_concat(content, char(10)) FROM comments WHERE note_id = OLD.note_id)
+     WHERE rowid = OLD.note_id;
+END;
+
+CREATE TRIGGER comments_version_insert AFTER INSERT ON comments BEGIN
+    UPDATE notes SET version = version + 1 WHERE id = NEW.note_id;
+END;
+
+CREATE TRIGGER comments_version_update AFTER UPDATE OF content ON comments BEGIN
+    UPDATE notes SET version = version + 1 WHERE id = NEW.note_id;
+END;
+
+CREATE TRIGGER comments_version_delete AFTER DELETE ON comments BEGIN
+    UPDATE notes SET version = version + 1 WHERE id = OLD.note_id;
+END;
+
+CREATE TRIGGER notes_version_update
+AFTER UPDATE OF title, content, updated_at, status, priority, context ON notes BEGIN
+    UPDATE notes SET version = version + 1 WHERE id = NEW.id;
+    UPDATE users SET notes_version = notes_version + 1
+     WHERE id = NEW.user_id OR id IN (SELECT user_id FROM shares WHERE note_id = NEW.id);
+END;
+
+CREATE TRIGGER notes_version_delete AFTER DELETE ON notes BEGIN
+    UPDATE users SET notes_version = notes_version + 1
+     WHERE id = OLD.user_id OR id IN (SELECT user_id FROM shares WHERE note_id = OLD.id);
+END;
@@ -0,0 +1,90 @@
+-- Change feed for /changes. When a note, its comments or its shares change,
+-- every user who can see the note gets a row, so a poll only reads that
+-- user's newest rows. AUTOINCREMENT keeps ids growing after pruning since
+-- the ids are the clients' cursors.
+CREATE TABLE changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    note_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    item_id INTEGER,
+    created_at INTEGER NOT NULL
+);
+
+CREATE INDEX changes_user ON changes (user_id, id);
+
+-- Highest pruned id, a client whose cursor is older may have missed changes.
+CREATE TABLE changes_pruned (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    up_to INTEGER NOT NULL
+);
+INSERT INTO changes_pruned (id, up_to) VALUES (1, 0);
+
+CREATE TRIGGER notes_changes_update
+AFTER UPDATE OF title, content, status, priority, context ON notes BEGIN
+    INSERT INTO changes (user_id, note_id, kind, item_id, created_at)
+    SELECT NEW.user_id, NEW.id, 'note', NULL, CAST(strftime('%s', 'now') AS INTEGER)
+    UNION ALL
+    SELECT user_id, NEW.id, 'note', NULL, CAST(strftime('%s', 'now') AS INTEGER)
+      FROM shares WHERE note_id = NEW.id;
+END;
+
+-- before the delete, the shares are already gone after it
+CREATE TRIGGER notes_changes_delete BEFORE DELETE ON notes BEGIN
+    INSERT INTO changes (user_id, note_id, kind, item_id, created_at)
+    SELECT OLD.user_id, OLD.id, 'note_removed', NULL, CAST(strftime('%s', 'now') AS INTEGER)
+    UNION ALL
+    SELECT user_id, OLD.id, 'note_removed', NULL, CAST(strftime('%s', 'now') AS INTEGER)
+      FROM shares WHERE note_id = OLD.id;
+END;
+
+CREATE TRIGGER comments_changes_insert AFTER INSERT ON comments BEGIN
+    INSERT INTO changes (user_id, note_id, kind, item_id, created_at)
+    SELECT user_id, NEW.note_id, 'comment', NEW.id, CAST(strftime('%s', 'now') AS INTEGER)
+      FROM notes WHERE id = NEW.note_id
+    UNION ALL
+    SELECT user_id, NEW.note_id, 'comment', NEW.id, CAST(strftime('%s', 'now') AS INTEGER)
+      FROM shares WHERE note_id = NEW.note_id;
+END;
+
+CREATE TRIGGER comments_changes_update AFTER UPDATE OF content ON comments BEGIN
+    INSERT INTO changes (user_id, note_id, kind, item_id, created_at)
+    SELECT user_id, NEW.note_id, 'comment', NEW.id, CAST(strftime('%s', 'now') AS INTEGER)
+      FROM notes WHERE id = NEW.note_id
+    UNION ALL
+    SELECT user_id, NEW.note_id, 'comment', NEW.id, CAST(strftime('%s', 'now') AS INTEGER)
+      FROM shares WHERE note_id = NEW.note_id;
+END;
+
+-- comments and shares removed along with their note are covered by note_removed
+CREATE TRIGGER comments_changes_delete AFTER DELETE ON comments
+WHEN EXISTS (SELECT 1 FROM notes WHERE id = OLD.note_id) BEGIN
+    INSERT INTO changes (user_id, note_id, kind, item_id, created_at)
+    SELECT user_id, OLD.note_id, 'comment_removed', OLD.id, CAST(strftime('%s', 'now') AS INTEGER)
+      FROM notes WHERE id = OLD.note_id
+    UNION ALL
+    SELECT user_id, OLD.note_id, 'comment_removed', OLD.id, CAST(strftime('%s', 'now') AS INTEGER)
+      FROM shares WHERE note_id = OLD.note_id;
+END;
+
+CREATE TRIGGER shares_changes_insert AFTER INSERT ON shares BEGIN
+    INSERT INTO changes (user_id, note_id, kind, item_id, created_at)
+    SELECT user_id, NEW.note_id, 'shared', NEW.user_id, CAST(strftime('%s', 'now') AS INTEGER)
+      FROM notes WHERE id = NEW.note_id
+    UNION ALL
+    SELECT user_id, NEW.note_id, 'shared', NEW.user_id, CAST(strftime('%s', 'now') AS INTEGER)
+      FROM shares WHERE note_id = NEW.note_id;
+END;
+
+-- the user it was shared with is told too, the share is already gone here
+CREATE TRIGGER shares_changes_delete AFTER DELETE ON shares
+WHEN EXISTS (SELECT 1 FROM notes WHERE id = OLD.note_id) BEGIN
+    INSERT INTO changes (user_id, note_id, kind, item_id, created_at)
+    SELECT user_id, OLD.note_id, 'unshared', OLD.user_id, CAST(strftime('%s', 'now') AS INTEGER)
+      FROM notes WHERE id = OLD.note_id
+    UNION ALL
+    SELECT user_id, OLD.note_id, 'unshared', OLD.user_id, CAST(strftime('%s', 'now') AS INTEGER)
+      FROM shares WHERE note_id = OLD.note_id
+    UNION ALL
+    SELECT OLD.user_id, OLD.note_id, 'unshared', OLD.user_id, CAST(strftime('%s', 'now') AS INTEGER);
+END;
@@ -0,0 +1,10 @@
+-- When each maintenance task last ran and its report, shared by all workers
+-- and cron so a task runs once per interval.
+CREATE TABLE maintenance (
+    task TEXT PRIMARY KEY,
+    last_run INTEGER NOT NULL,
+    report TEXT
+) WITHOUT ROWID;
+
+INSERT INTO maintenance (task, last_run)
+VALUES ('vacuum', 0), ('checkpoint', 0), ('analyze', 0), ('integrity', 0);
@@ -0,0 +1,15 @@
+-- Earlier versions of notes, see revisions.py. data is zlib compressed: the
+-- whole content when depth is 0, otherwise a delta against the revision
+-- before it, depth deltas after the last full one. Title and classes are
+-- small and kept as they are.
+CREATE TABLE note_revisions (
+    note_id INTEGER NOT NULL REFERENCES notes ON DELETE CASCADE,
+    number INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    classes TEXT NOT NULL,
+    data BLOB NOT NULL,
+    created_at TEXT NOT NULL,
+    restored_from INTEGER,
+    PRIMARY KEY (note_id, number)
+);
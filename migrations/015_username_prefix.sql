@@ -0,0 +1,23 @@
+-- Username prefix lookups for the share form's autocomplete, queried with
+-- username COLLATE NOCASE ranges so the index is used.
+CREATE INDEX users_username_nocase ON users (username COLLATE NOCASE);
+
+-- Users each user has shared notes with and how many times. Kept after
+-- unsharing, the autocomplete offers them first.
+CREATE TABLE share_targets (
+    owner_id INTEGER NOT NULL REFERENCES users ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES users ON DELETE CASCADE,
+    shares INTEGER NOT NULL,
+    PRIMARY KEY (owner_id, user_id)
+) WITHOUT ROWID;
+
+INSERT INTO share_targets (owner_id, user_id, shares)
+SELECT n.user_id, s.user_id, COUNT(*)
+FROM shares s JOIN notes n ON n.id = s.note_id
+GROUP BY n.user_id, s.user_id;
+
+CREATE TRIGGER shares_targets_insert AFTER INSERT ON shares BEGIN
+    INSERT INTO share_targets (owner_id, user_id, shares)
+    SELECT user_id, NEW.user_id, 1 FROM notes WHERE id = NEW.note_id
+    ON CONFLICT (owner_id, user_id) DO UPDATE SET shares = shares + 1;
+END;
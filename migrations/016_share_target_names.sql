@@ -0,0 +1,24 @@
+-- Suggestions only come from a user's own share_targets, so the username is
+-- copied there and a prefix is a range of the owner's rows in
+-- share_targets_username, however many users there are or the owner has
+-- shared with. The prefix index on all usernames isn't used anymore.
+ALTER TABLE share_targets ADD COLUMN username TEXT COLLATE NOCASE NOT NULL DEFAULT '';
+UPDATE share_targets SET username = (SELECT username FROM users WHERE id = share_targets.user_id);
+CREATE INDEX share_targets_username ON share_targets (owner_id, username);
+-- an empty prefix suggests the most shared with
+CREATE INDEX share_targets_shares ON share_targets (owner_id, shares DESC, username);
+
+DROP INDEX users_username_nocase;
+
+DROP TRIGGER shares_targets_insert;
+CREATE TRIGGER shares_targets_insert AFTER INSERT ON shares BEGIN
+    INSERT INTO share_targets (owner_id, user_id, shares, username)
+    SELECT notes.user_id, NEW.user_id, 1, users.username
+      FROM notes, users WHERE notes.id = NEW.note_id AND users.id = NEW.user_id
+    ON CONFLICT (owner_id, user_id) DO UPDATE SET shares = shares + 1;
+END;
+
+-- usernames don't change in the app, but the copies follow if one does
+CREATE TRIGGER users_share_targets_update AFTER UPDATE OF username ON users BEGIN
+    UPDATE share_targets SET username = NEW.username WHERE user_id = NEW.id;
+END;
@@ -5,21 +5,95 @@ There's also created and updated times.
 Example app's classes were a bit complex and required additions to most functions,
 could've probably been simplified.
 Sharing added complexity with accessability.
+Search uses the notes_search full-text index that triggers keep up to date.
+Note and comment text is also stored as HTML, made when the text is written.
+Edits are kept as revisions, see revisions.py.
 """
-import db
 from datetime import datetime
+import json
 
-def get_all_classes():
-    """Get all classes from db."""
-    sql = "SELECT title, value FROM classes ORDER BY id"
-    result = db.query(sql)
+import markupsafe
+
+import config
+import db
+import revisions
+
+# classes that also have a column in notes for the listings
+CLASS_COLUMNS = {"Status": "status", "Priority": "priority", "Context": "context"}
+
+# rows of the note lists, compact since a page can have max_page_size of them
+NoteRow = db.record("NoteRow", "id title updated_at version status priority context shared")
+SharedNoteRow = db.record("SharedNoteRow",
+                          "id title updated_at version owner_username status priority context")
+
+# the listings and search, benchmark/plans.py checks that none of them scans a table
+USER_NOTES_SQL = """SELECT n.id, n.title, n.updated_at, n.version,
+                           n.status, n.priority, n.context,
+                           EXISTS(SELECT 1 FROM shares s WHERE s.note_id = n.id) AS shared
+                    FROM notes n
+                    WHERE n.user_id = ? AND {keyset}
+                    ORDER BY n.updated_at {order}, n.id {order}
+                    LIMIT ?"""
 
+SHARED_NOTES_SQL = """SELECT n.id, n.title, n.updated_at, n.version, u.username AS owner_username,
+                             n.status, n.priority, n.context
+                      FROM shares s
+                      JOIN notes n ON n.id = s.note_id
+                      JOIN users u ON n.user_id = u.id
+                      WHERE s.user_id = ? AND {keyset}
+                      ORDER BY n.updated_at {order}, n.id {order}
+                      LIMIT ?"""
+
+SEARCH_SQL = """SELECT n.id, n.title, n.updated_at, u.username AS owner_username,
+                       n.status, n.priority, n.context,
+                       EXISTS(SELECT 1 FROM shares s_me  WHERE s_me.note_id = n.id AND s_me.user_id = ?) AS shared_with_me,
+                       CASE WHEN n.user_id = ? AND EXISTS(SELECT 1 FROM shares s_any WHERE s_any.note_id = n.id)
+                            THEN 1 ELSE 0 END AS shared_by_me,
+                       highlight(notes_search, 0, char(2), char(3)) AS title_match,
+                       snippet(notes_search, -1, char(2), char(3), '...', 16) AS snippet
+                FROM notes_search
+                JOIN notes n ON n.id = notes_search.rowid
+                JOIN users u ON n.user_id = u.id
+                WHERE notes_search MATCH ?
+                  AND (n.user_id = ? OR EXISTS(SELECT 1 FROM shares s_access WHERE s_access.note_id = n.id AND s_access.user_id = ?))
+                ORDER BY bm25(notes_search, 10.0, 1.0, 0.5), n.id DESC
+                LIMIT ? OFFSET ?"""
+
+_catalogue = None
+
+def get_catalogue():
+    """The classes catalogue, cached in the process until catalogue_version changes.
+    Has the classes dict for forms and a frozenset of "title:value" entries for validation."""
+    global _catalogue
+    version = db.query("SELECT version FROM catalogue_version")[0]["version"]
+    catalogue = _catalogue
+    if catalogue and catalogue["version"] == version:
+        return catalogue
+
+    sql = "SELECT title, value FROM classes ORDER BY id"
     classes = {}
-    for title, value in result:
-        classes[title] = []
-    for title, value in result:
-        classes[title].append(value)
+    for title, value in db.query(sql):
+        classes.setdefault(title, []).append(value)
+    entries = frozenset(title + ":" + value
+                        for title, values in classes.items() for value in values)
+    catalogue = {"version": version, "classes": classes, "entries": entries}
+    _catalogue = catalogue
+    return catalogue
+
+def get_all_classes():
+    """Get all classes as a dict of title to its values."""
+    return get_catalogue()["classes"]
 
+def parse_classes(entries):
+    """Form "title:value" entries as (title, value) pairs, None if one isn't in the catalogue."""
+    valid = get_catalogue()["entries"]
+    classes = []
+    for entry in entries:
+        if entry:
+            if entry not in valid:
+                return None
+            class_title, class_value = entry.split(":", 1)
+            classes.append((class_title, class_value))
     return classes
 
 def get_classes(note_id):
@@ -27,21 +101,56 @@ def get_classes(note_id):
     sql = "SELECT title, value FROM note_classes WHERE note_id = ?"
     return db.query(sql, [note_id])
 
+def class_columns(classes):
+    """Values for the notes.status, priority and context copies of a note's classes."""
+    values = dict.fromkeys(CLASS_COLUMNS.values())
+    for class_title, class_value in classes:
+        if class_title in CLASS_COLUMNS:
+            values[CLASS_COLUMNS[class_title]] = class_value
+    return values
+
+def render_content(content):
+    """Note or comment text as HTML for the content_html columns, escaped and newlines to br."""
+    return str(markupsafe.escape(content)).replace("\n", "<br />")
+
 def add_note(title, content, user_id, classes):
     """Add a note to db."""
-    sql = """INSERT INTO notes (title, content, user_id, created_at, updated_at)
-             VALUES (?, ?, ?, ?, ?)"""
+    sql = """INSERT INTO notes (title, content, content_html, user_id, created_at, updated_at,
+                                status, priority, context)
+             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"""
     now = datetime.now().isoformat()
-    db.execute(sql, [title, content, user_id, now, now])
-
-    note_id = db.last_insert_id()
+    columns = class_columns(classes)
+    with db.transaction():
+        db.execute(sql, [title, content, render_content(content), user_id, now, now,
+                         columns["status"], columns["priority"], columns["context"]])
+        note_id = db.last_insert_id()
 
-    sql = "INSERT INTO note_classes (note_id, title, value) VALUES (?, ?, ?)"
-    for class_title, class_value in classes:
-        db.execute(sql, [note_id, class_title, class_value])
+        sql = "INSERT INTO note_classes (note_id, title, value) VALUES (?, ?, ?)"
+        db.executemany(sql, [(note_id, class_title, class_value)
+                             for class_title, class_value in classes])
 
     return note_id
 
+def check_class_columns():
+    """Ids of notes whose class columns don't match note_classes."""
+    sql = """SELECT n.id FROM notes n
+             WHERE n.status IS NOT (SELECT value FROM note_classes WHERE note_id = n.id AND title = 'Status')
+                OR n.priority IS NOT (SELECT value FROM note_classes WHERE note_id = n.id AND title = 'Priority')
+                OR n.context IS NOT (SELECT value FROM note_classes WHERE note_id = n.id AND title = 'Context')"""
+    return [row["id"] for row in db.query(sql)]
+
+def sync_class_columns():
+    """Backfill the class columns of mismatching notes from note_classes, returns their ids."""
+    note_ids = check_class_columns()
+    sql = """UPDATE notes SET
+                 status = (SELECT value FROM note_classes WHERE note_id = notes.id AND title = 'Status'),
+                 priority = (SELECT value FROM note_classes WHERE note_id = notes.id AND title = 'Priority'),
+                 context = (SELECT value FROM note_classes WHERE note_id = notes.id AND title = 'Context')
+             WHERE id = ?"""
+    with db.transaction():
+        db.executemany(sql, [[note_id] for note_id in note_ids])
+    return note_ids
+
 def get_note(note_id):
     """Get a note from db."""
     sql = """SELECT notes.id, notes.title, notes.content,
@@ -52,80 +161,238 @@ def get_note(note_id):
     result = db.query(sql, [note_id])
     return result[0] if result else None
 
-def update_note(note_id, title, content, classes):
-    """Edits or updates a note in db."""
-    sql = """UPDATE notes SET title = ?, content = ?, updated_at = ?
+def get_access(note_id, user_id):
+    """Whether the user owns the note or has it shared with them, None if there's no such note.
+    Also has the note's version that changes with anything shown on its page."""
+    sql = """SELECT n.user_id = ? AS owner,
+                    EXISTS(SELECT 1 FROM shares s WHERE s.note_id = n.id AND s.user_id = ?) AS shared,
+                    n.version
+             FROM notes n
+             WHERE n.id = ?"""
+    result = db.query(sql, [user_id, user_id, note_id])
+    if not result:
+        return None
+    return {"owner": bool(result[0]["owner"]), "shared": bool(result[0]["shared"]),
+            "version": result[0]["version"]}
+
+def get_note_view(note_id, user_id, comments_before=None):
+    """Everything the note page shows in two queries: the note with the user's access,
+    its classes and shares, then a page of comments older than comments_before.
+    Shares are only loaded for the owner and comments only if the user has access."""
+    sql = """SELECT n.id, n.title, n.content_html, n.created_at, n.updated_at,
+                    n.user_id, u.username,
+                    n.user_id = ? AS owner,
+                    EXISTS(SELECT 1 FROM shares s WHERE s.note_id = n.id AND s.user_id = ?) AS shared,
+                    (SELECT json_group_array(json_object('title', title, 'value', value))
+                     FROM (SELECT title, value FROM note_classes
+                           WHERE note_id = n.id ORDER BY id)) AS classes,
+                    CASE WHEN n.user_id = ? THEN
+                        (SELECT json_group_array(json_object('id', id, 'username', username))
+                         FROM (SELECT users.id, users.username
+                               FROM shares, users
+                               WHERE shares.note_id = n.id AND shares.user_id = users.id
+                               ORDER BY users.username))
+                    END AS shared_users
+             FROM notes n, users u
+             WHERE n.user_id = u.id AND n.id = ?"""
+    result = db.query(sql, [user_id, user_id, user_id, note_id])
+    if not result:
+        return None
+    note = result[0]
+    view = {
+        "note": note,
+        "owner": bool(note["owner"]),
+        "shared": bool(note["shared"]),
+        "classes": json.loads(note["classes"]),
+        "shared_users": json.loads(note["shared_users"] or "[]"),
+        "comments": [],
+        "comments_next": None,
+    }
+    if view["owner"] or view["shared"]:
+        limit = config.comments_page_size
+        comments = get_comments(note_id, comments_before, limit + 1)
+        if len(comments) > limit:
+            comments = comments[:limit]
+            view["comments_next"] = comments[-1]["id"]
+        view["comments"] = comments
+    return view
+
+def get_notes_by_ids(note_ids, user_id):
+    """The notes with the given ids that the user owns or has shared with them, in one query.
+    The ids go in as a JSON array so any number of them fits in one statement."""
+    sql = """SELECT n.id, n.title, n.content, n.created_at, n.updated_at, n.version,
+                    n.user_id, u.username,
+                    (SELECT json_group_array(json_object('title', title, 'value', value))
+                     FROM (SELECT title, value FROM note_classes
+                           WHERE note_id = n.id ORDER BY id)) AS classes
+             FROM notes n, users u
+             WHERE n.id IN (SELECT value FROM json_each(?))
+               AND n.user_id = u.id
+               AND (n.user_id = ? OR EXISTS(SELECT 1 FROM shares s WHERE s.note_id = n.id AND s.user_id = ?))
+             ORDER BY n.id"""
+    return db.query(sql, [json.dumps(list(note_ids)), user_id, user_id])
+
+def update_note(note_id, title, content, classes, restored_from=None):
+    """Edits or updates a note in db. The new version is also added to the note's revisions,
+    restored_from is the revision it came from when restoring one."""
+    sql = """UPDATE notes SET title = ?, content = ?, content_html = ?, updated_at = ?,
+                              status = ?, priority = ?, context = ?
              WHERE id = ?"""
     now = datetime.now().isoformat()
-    db.execute(sql, [title, content, now, note_id])
+    columns = class_columns(classes)
+    with db.transaction():
+        revisions.add_revision(note_id, title, content, classes, now, restored_from)
+        db.execute(sql, [title, content, render_content(content), now,
+                         columns["status"], columns["priority"], columns["context"], note_id])
 
-    sql = "DELETE FROM note_classes WHERE note_id = ?"
-    db.execute(sql, [note_id])
+        sql = "DELETE FROM note_classes WHERE note_id = ?"
+        db.execute(sql, [note_id])
 
-    sql = "INSERT INTO note_classes (note_id, title, value) VALUES (?, ?, ?)"
-    for class_title, class_value in classes:
-        db.execute(sql, [note_id, class_title, class_value])
+        sql = "INSERT INTO note_classes (note_id, title, value) VALUES (?, ?, ?)"
+        db.executemany(sql, [(note_id, class_title, class_value)
+                             for class_title, class_value in classes])
 
 def remove_note(note_id):
-    """Remove a note and it's associating info from db."""
-    sql = "DELETE FROM note_classes WHERE note_id = ?"
-    db.execute(sql, [note_id])
-    sql = "DELETE FROM comments WHERE note_id = ?"
-    db.execute(sql, [note_id])
-    sql = "DELETE FROM shares WHERE note_id = ?"
-    db.execute(sql, [note_id])
+    """Remove a note from db, its classes, shares and comments go with it (ON DELETE CASCADE)."""
     sql = "DELETE FROM notes WHERE id = ?"
     db.execute(sql, [note_id])
 
-def get_user_notes(user_id):
-    """Get all of a user's notes. Correlated subquery made it a bit simpler."""
-    sql = """SELECT n.id, n.title, n.content, n.created_at, n.updated_at,
-                    (SELECT value FROM note_classes WHERE note_id = n.id AND title = 'Status'  LIMIT 1) AS status,
-                    (SELECT value FROM note_classes WHERE note_id = n.id AND title = 'Priority' LIMIT 1) AS priority,
-                    (SELECT value FROM note_classes WHERE note_id = n.id AND title = 'Context'  LIMIT 1) AS context,
-                    EXISTS(SELECT 1 FROM shares s WHERE s.note_id = n.id) AS shared
-             FROM notes n
-             WHERE n.user_id = ?
-             ORDER BY n.updated_at DESC, n.id DESC"""
-    return db.query(sql, [user_id])
-
-def get_shared_with_user(user_id):
-    sql = """SELECT n.id, n.title, n.updated_at, u.username AS owner_username,
-                    (SELECT value FROM note_classes WHERE note_id = n.id AND title = 'Status'  LIMIT 1) AS status,
-                    (SELECT value FROM note_classes WHERE note_id = n.id AND title = 'Priority' LIMIT 1) AS priority,
-                    (SELECT value FROM note_classes WHERE note_id = n.id AND title = 'Context'  LIMIT 1) AS context
-             FROM notes n
-             JOIN users u ON n.user_id = u.id
-             WHERE EXISTS(SELECT 1 FROM shares s WHERE s.user_id = ? AND s.note_id = n.id)
-             ORDER BY n.updated_at DESC, n.id DESC"""
-    return db.query(sql, [user_id])
-
-def search_notes(user_id, query):
-    """Search notes that a user can access, meaning own notes and shared notes."""
-    like = "%" + query + "%"
-    sql = """SELECT n.id, n.title, n.updated_at, u.username AS owner_username,
-                    (SELECT value FROM note_classes WHERE note_id = n.id AND title = 'Status'  LIMIT 1) AS status,
-                    (SELECT value FROM note_classes WHERE note_id = n.id AND title = 'Priority' LIMIT 1) AS priority,
-                    (SELECT value FROM note_classes WHERE note_id = n.id AND title = 'Context'  LIMIT 1) AS context,
-                    EXISTS(SELECT 1 FROM shares s_me  WHERE s_me.note_id = n.id AND s_me.user_id = ?) AS shared_with_me,
-                    CASE WHEN n.user_id = ? AND EXISTS(SELECT 1 FROM shares s_any WHERE s_any.note_id = n.id)
-                         THEN 1 ELSE 0 END AS shared_by_me
-             FROM notes n
-             JOIN users u ON n.user_id = u.id
-             WHERE (n.user_id = ? OR EXISTS(SELECT 1 FROM shares s_access WHERE s_access.note_id = n.id AND s_access.user_id = ?))
-               AND (n.title LIKE ? OR n.content LIKE ?)
-             ORDER BY n.updated_at DESC, n.id DESC"""
-    return db.query(sql, [user_id, user_id, user_id, user_id, like, like])
+def owns_notes(note_ids, user_id):
+    """Whether the user owns every one of the notes, checked in one query."""
+    note_ids = set(note_ids)
+    sql = """SELECT COUNT(*) AS count FROM notes
+             WHERE id IN (SELECT value FROM json_each(?)) AND user_id = ?"""
+    return db.query(sql, [json.dumps(list(note_ids)), user_id])[0]["count"] == len(note_ids)
+
+def parse_class_changes(entries):
+    """Bulk reclassify entries: "title:value" sets a class and "title:" removes it.
+    Returns the (title, value) pairs to set and the titles to remove,
+    None if an entry isn't in the catalogue."""
+    catalogue = get_catalogue()
+    classes, cleared = [], []
+    for entry in entries:
+        if not entry:
+            continue
+        class_title, _, class_value = entry.partition(":")
+        if not class_value and class_title in catalogue["classes"]:
+            cleared.append(class_title)
+        elif entry in catalogue["entries"]:
+            classes.append((class_title, class_value))
+        else:
+            return None
+    return classes, cleared
+
+def remove_notes(note_ids):
+    """Remove many notes in one statement, returns how many were removed."""
+    sql = "DELETE FROM notes WHERE id IN (SELECT value FROM json_each(?))"
+    return db.execute(sql, [json.dumps(list(note_ids))])
+
+def reclassify_notes(note_ids, classes, cleared):
+    """Set the given classes and remove the cleared ones on many notes in one transaction.
+    Other classes of the notes stay as they are. Notes whose classes change get a
+    revision like an edit would."""
+    ids = json.dumps(list(note_ids))
+    now = datetime.now().isoformat()
+    with db.transaction():
+        sql = """SELECT n.id, n.title, n.content,
+                        (SELECT json_group_array(json_array(title, value))
+                         FROM (SELECT title, value FROM note_classes
+                               WHERE note_id = n.id ORDER BY id)) AS classes
+                 FROM notes n
+                 WHERE n.id IN (SELECT value FROM json_each(?))"""
+        for note in db.query(sql, [ids]):
+            old = [tuple(entry) for entry in json.loads(note["classes"])]
+            # the order the rows will have: updated ones stay, new ones go last
+            new = dict(old)
+            new.update(classes)
+            new = [(class_title, class_value) for class_title, class_value in new.items()
+                   if class_title not in cleared]
+            if new != old:
+                revisions.add_revision(note["id"], note["title"], note["content"], new, now)
+
+        # WHERE true tells the parser that ON CONFLICT isn't part of a join
+        sql = """INSERT INTO note_classes (note_id, title, value)
+                 SELECT value, ?, ? FROM json_each(?) WHERE true
+                 ON CONFLICT (note_id, title) DO UPDATE SET value = excluded.value"""
+        db.executemany(sql, [(class_title, class_value, ids) for class_title, class_value in classes])
+
+        sql = """DELETE FROM note_classes
+                 WHERE note_id IN (SELECT value FROM json_each(?))
+                   AND title IN (SELECT value FROM json_each(?))"""
+        db.execute(sql, [ids, json.dumps(cleared)])
+
+        sql = """UPDATE notes SET updated_at = ?,
+                     status = (SELECT value FROM note_classes WHERE note_id = notes.id AND title = 'Status'),
+                     priority = (SELECT value FROM note_classes WHERE note_id = notes.id AND title = 'Priority'),
+                     context = (SELECT value FROM note_classes WHERE note_id = notes.id AND title = 'Context')
+                 WHERE id IN (SELECT value FROM json_each(?))"""
+        return db.execute(sql, [now, ids])
+
+def share_notes(note_ids, user_id):
+    """Share many notes with a user, returns how many weren't shared with them before."""
+    sql = """INSERT OR IGNORE INTO shares (note_id, user_id)
+             SELECT value, ? FROM json_each(?)"""
+    return db.execute(sql, [user_id, json.dumps(list(note_ids))])
+
+def unshare_notes(note_ids, user_id):
+    """Stop sharing many notes with a user, returns how many were shared."""
+    sql = """DELETE FROM shares
+             WHERE user_id = ? AND note_id IN (SELECT value FROM json_each(?))"""
+    return db.execute(sql, [user_id, json.dumps(list(note_ids))])
+
+def get_user_notes(user_id, before=None, after=None, limit=None):
+    """Get a page of a user's notes."""
+    return db.query_page(USER_NOTES_SQL, [user_id], limit or config.page_size, before, after, NoteRow)
+
+def get_shared_with_user(user_id, before=None, after=None, limit=None):
+    """Get a page of notes shared with a user."""
+    return db.query_page(SHARED_NOTES_SQL, [user_id], limit or config.page_size, before, after, SharedNoteRow)
 
-def is_shared_with(note_id, user_id):
-    """Check whether the note is stared with the user."""
-    sql = "SELECT id FROM shares WHERE note_id = ? AND user_id = ?"
-    return bool(db.query(sql, [note_id, user_id]))
+def search_expression(query):
+    """Turn the search box text into an FTS5 query. Words are matched as is,
+    "quoted words" as a phrase and word* as a prefix. Everything is quoted
+    so user input can't break the query syntax."""
+    terms = []
+    parts = query.split('"')
+    for i, part in enumerate(parts):
+        if i % 2 == 1:
+            if part.strip():
+                terms.append('"' + part.strip() + '"')
+            continue
+        for word in part.split():
+            prefix = word.endswith("*")
+            word = word.rstrip("*").replace('"', "")
+            if word:
+                terms.append('"' + word + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+def search_notes(user_id, query, page=1):
+    """Search notes that a user can access, meaning own notes and shared notes.
+    Best matches come first, one page of config.search_page_size results at a time
+    with an extra row to tell if there's a next page."""
+    expression = search_expression(query)
+    if not expression:
+        return []
+    limit = config.search_page_size
+    return db.query(SEARCH_SQL, [user_id, user_id, expression, user_id, user_id,
+                                 limit + 1, (page - 1) * limit])
+
+def rebuild_search():
+    """Refill the search index from notes and comments, for databases where it got out of sync."""
+    with db.transaction():
+        db.execute("DELETE FROM notes_search")
+        db.execute("""INSERT INTO notes_search (rowid, title, content, comments)
+                      SELECT n.id, n.title, n.content,
+                             (SELECT group_concat(c.content, char(10))
+                              FROM comments c WHERE c.note_id = n.id)
+                      FROM notes n""")
+        db.execute("INSERT INTO notes_search (notes_search) VALUES ('optimize')")
 
 def add_share(note_id, user_id):
-    """Add a share to a note with a user."""
-    sql = "INSERT INTO shares (note_id, user_id) VALUES (?, ?)"
-    db.execute(sql, [note_id, user_id])
+    """Add a share to a note with a user, False if it was shared with them already.
+    No check first, so two submits at once can't both try to insert."""
+    sql = "INSERT OR IGNORE INTO shares (note_id, user_id) VALUES (?, ?)"
+    return db.execute(sql, [note_id, user_id]) == 1
 
 def remove_share(note_id, user_id):
     """Remove a note's share from a user."""
@@ -141,23 +408,27 @@ def get_shares(note_id):
     return db.query(sql, [note_id])
 
 def add_comment(note_id, user_id, content):
-    """Shared notes can have comments. Add a comment to a note."""
-    sql = """INSERT INTO comments (note_id, user_id, content, created_at)
-             VALUES (?, ?, ?, ?)"""
+    """Shared notes can have comments. Add a comment to a note, returns its id."""
+    sql = """INSERT INTO comments (note_id, user_id, content, content_html, created_at)
+             VALUES (?, ?, ?, ?, ?)"""
     now = datetime.now().isoformat()
-    db.execute(sql, [note_id, user_id, content, now])
+    db.execute(sql, [note_id, user_id, content, render_content(content), now])
+    return db.last_insert_id()
 
-def get_comments(note_id):
-    """Get a note's comments."""
+def get_comments(note_id, before=None, limit=-1):
+    """Get a note's comments, newest first. before and limit give a page of them."""
     sql = """SELECT comments.id,
                     comments.content,
+                    comments.content_html,
                     comments.created_at,
                     users.id AS user_id,
                     users.username
              FROM comments, users
              WHERE comments.note_id = ? AND comments.user_id = users.id
-             ORDER BY comments.id DESC"""
-    return db.query(sql, [note_id])
+               AND (? IS NULL OR comments.id < ?)
+             ORDER BY comments.id DESC
+             LIMIT ?"""
+    return db.query(sql, [note_id, before, before, limit])
 
 def get_comment(comment_id):
     """Get a specific comment."""
@@ -173,10 +444,155 @@ def get_comment(comment_id):
 
 def update_comment(comment_id, content):
     """Edit or update a comment in db."""
-    sql = """UPDATE comments SET content = ? WHERE id = ?"""
-    db.execute(sql, [content, comment_id])
+    sql = """UPDATE comments SET content = ?, content_html = ? WHERE id = ?"""
+    db.execute(sql, [content, render_content(content), comment_id])
 
 def remove_comment(comment_id):
     """Remove a comment from db."""
     sql = """DELETE FROM comments WHERE id = ?"""
     db.execute(sql, [comment_id])
+
+def export_notes(user_id):
+    """A user's notes with their classes, shares and comments, one dict per note.
+    Rows are streamed from the database so any number of notes fits in memory."""
+    sql = """SELECT n.title, n.content, n.created_at, n.updated_at,
+                    (SELECT json_group_array(json_array(title, value))
+                     FROM (SELECT title, value FROM note_classes
+                           WHERE note_id = n.id ORDER BY id)) AS classes,
+                    (SELECT json_group_array(username)
+                     FROM (SELECT users.username FROM shares, users
+                           WHERE shares.note_id = n.id AND shares.user_id = users.id
+                           ORDER BY users.username)) AS shares,
+                    (SELECT json_group_array(json_object('username', username,
+                                                         'content', content,
+                                                         'created_at', created_at))
+                     FROM (SELECT users.username, comments.content, comments.created_at
+                           FROM comments, users
+                           WHERE comments.note_id = n.id AND comments.user_id = users.id
+                           ORDER BY comments.id)) AS comments
+             FROM notes n
+             WHERE n.user_id = ?
+             ORDER BY n.updated_at, n.id"""
+    for row in db.iter_query(sql, [user_id]):
+        yield {
+            "title": row["title"],
+            "content": row["content"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "classes": json.loads(row["classes"]),
+            "shares": json.loads(row["shares"]),
+            "comments": json.loads(row["comments"]),
+        }
+
+def parse_timestamp(value, default):
+    """An exported created_at or updated_at as the app writes them, default if it's missing.
+    Raises ValueError if it isn't an ISO 8601 string, listings sort and page by them as text."""
+    if value is None:
+        return default
+    if not isinstance(value, str):
+        raise ValueError("timestamps must be ISO 8601 strings")
+    return datetime.fromisoformat(value).isoformat()
+
+def parse_import_line(line, number, valid_classes):
+    """One exported note as a dict, raises ValueError if it isn't valid."""
+    now = datetime.now().isoformat()
+    try:
+        note = json.loads(line)
+        title, content = note["title"], note["content"]
+        classes = [(class_title, class_value) for class_title, class_value in note.get("classes", [])]
+        shares = [str(username) for username in note.get("shares", [])]
+        comments = [(str(comment["username"]), comment["content"],
+                     parse_timestamp(comment.get("created_at"), now))
+                    for comment in note.get("comments", [])]
+        created_at = parse_timestamp(note.get("created_at"), now)
+        updated_at = parse_timestamp(note.get("updated_at"), now)
+    except (ValueError, KeyError, TypeError) as error:
+        raise ValueError("line " + str(number) + ": " + str(error))
+    if not isinstance(title, str) or not title or len(title) > 100:
+        raise ValueError("line " + str(number) + ": title must be 1-100 characters")
+    if not isinstance(content, str) or not content or len(content) > 5000:
+        raise ValueError("line " + str(number) + ": content must be 1-5000 characters")
+    for class_title, class_value in classes:
+        if str(class_title) + ":" + str(class_value) not in valid_classes:
+            raise ValueError("line " + str(number) + ": unknown class " +
+                             str(class_title) + ":" + str(class_value))
+    # a note has one value per class, note_classes is unique on (note_id, title)
+    if len({class_title for class_title, _ in classes}) != len(classes):
+        raise ValueError("line " + str(number) + ": a class can only be given once")
+    for _, comment, _ in comments:
+        if not isinstance(comment, str) or not comment or len(comment) > 2000:
+            raise ValueError("line " + str(number) + ": comments must be 1-2000 characters")
+    return {
+        "title": title,
+        "content": content,
+        "created_at": created_at,
+        "updated_at": updated_at,
+        "classes": classes,
+        "shares": shares,
+        "comments": comments,
+    }
+
+def import_notes(user_id, lines):
+    """Add exported notes to a user, all in one transaction so a bad line adds nothing.
+    Rows are inserted with executemany in batches of config.import_batch_size notes.
+    Shares and comments of usernames that don't exist here are skipped.
+    Returns counts of what was imported and skipped."""
+    valid_classes = get_catalogue()["entries"]
+    user_ids = {}
+    counts = {"notes": 0, "shares": 0, "comments": 0, "skipped_shares": 0, "skipped_comments": 0}
+
+    def find_user(username):
+        if username not in user_ids:
+            result = db.query("SELECT id FROM users WHERE username = ?", [username])
+            user_ids[username] = result[0]["id"] if result else None
+        return user_ids[username]
+
+    batch = []
+    def flush():
+        note_rows, class_rows, share_rows, comment_rows = [], [], [], []
+        for note_id, note in batch:
+            columns = class_columns(note["classes"])
+            note_rows.append((note_id, note["title"], note["content"], render_content(note["content"]),
+                              user_id,
+                              note["created_at"], note["updated_at"],
+                              columns["status"], columns["priority"], columns["context"]))
+            class_rows += [(note_id, class_title, class_value)
+                           for class_title, class_value in note["classes"]]
+            for username in note["shares"]:
+                share_user = find_user(username)
+                if share_user and share_user != user_id:
+                    share_rows.append((note_id, share_user))
+                else:
+                    counts["skipped_shares"] += 1
+            for username, content, created_at in note["comments"]:
+                comment_user = find_user(username)
+                if comment_user:
+                    comment_rows.append((note_id, comment_user, content, render_content(content),
+                                         created_at))
+                else:
+                    counts["skipped_comments"] += 1
+        db.executemany("""INSERT INTO notes (id, title, content, content_html, user_id,
+                                             created_at, updated_at, status, priority, context)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", note_rows)
+        db.executemany("INSERT INTO note_classes (note_id, title, value) VALUES (?, ?, ?)", class_rows)
+        db.executemany("INSERT OR IGNORE INTO shares (note_id, user_id) VALUES (?, ?)", share_rows)
+        db.executemany("""INSERT INTO comments (note_id, user_id, content, content_html, created_at)
+                          VALUES (?, ?, ?, ?, ?)""", comment_rows)
+        counts["notes"] += len(note_rows)
+        counts["shares"] += len(share_rows)
+        counts["comments"] += len(comment_rows)
+        batch.clear()
+
+    with db.transaction(immediate=True):
+        # ids are given here so the batch rows can refer to their notes
+        next_id = db.query("SELECT COALESCE(MAX(id), 0) + 1 AS id FROM notes")[0]["id"]
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            batch.append((next_id, parse_import_line(line, number, valid_classes)))
+            next_id += 1
+            if len(batch) >= config.import_batch_size:
+                flush()
+        if batch:
+            flush()
+    return counts
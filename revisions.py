@@ -0,0 +1,131 @@
+"""
+Revision history of notes. update_note adds a revision for every edit, so
+old versions can be looked at and restored. A note's content is up to 5000
+characters and an edit usually changes a few words, so instead of a copy a
+revision stores what changed since the revision before it: runs of words
+copied from it and the new text in between, zlib compressed. Every
+revision_snapshot_interval revisions there's a full copy, so rebuilding any
+revision applies at most that many deltas. A note that's never been edited
+has no revisions, its first edit stores the original as revision 1.
+"""
+from difflib import SequenceMatcher
+import json
+import re
+import zlib
+
+import config
+import db
+
+# words with the whitespace after them, joined back together they're the text again
+WORDS = re.compile(r"\S+\s*|\s+")
+
+def split_words(text):
+    """Text as words for diffing, "".join() of them gives the text back."""
+    return WORDS.findall(text)
+
+def compress(text):
+    """Full copy of a content."""
+    return zlib.compress(text.encode(), 9)
+
+def decompress(data):
+    """Content of a full copy."""
+    return zlib.decompress(data).decode()
+
+def make_delta(old, new):
+    """new as a JSON list of [start, end] word ranges copied from old and strings of
+    new text, compressed."""
+    old_words = split_words(old)
+    new_words = split_words(new)
+    delta = []
+    matcher = SequenceMatcher(None, old_words, new_words)
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == "equal":
+            delta.append([old_start, old_end])
+        elif new_start < new_end:
+            delta.append("".join(new_words[new_start:new_end]))
+    return zlib.compress(json.dumps(delta, separators=(",", ":")).encode(), 9)
+
+def apply_delta(old_words, data):
+    """Words of the new text make_delta(old, new) was made from, given the words of old.
+    Words in, words out, so a chain of deltas only splits the text once."""
+    words = []
+    for part in json.loads(zlib.decompress(data)):
+        if isinstance(part, str):
+            words.extend(split_words(part))
+        else:
+            words.extend(old_words[part[0]:part[1]])
+    return words
+
+def insert_revision(note_id, number, depth, title, classes, data, created_at, restored_from=None):
+    """Add one row to note_revisions."""
+    sql = """INSERT INTO note_revisions (note_id, number, depth, title, classes, data,
+                                         created_at, restored_from)
+             VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+    db.execute(sql, [note_id, number, depth, title, json.dumps(classes), data,
+                     created_at, restored_from])
+
+def add_revision(note_id, title, content, classes, now, restored_from=None):
+    """Store the version update_note is about to write. Has to run in its transaction before
+    the note is changed, the delta is made against the content still in notes. That's the
+    latest revision's content as long as only update_note changes it.
+    Returns the new revision's number."""
+    sql = """SELECT n.title, n.content, n.updated_at,
+                    (SELECT json_group_array(json_array(title, value))
+                     FROM (SELECT title, value FROM note_classes
+                           WHERE note_id = n.id ORDER BY id)) AS classes,
+                    r.number, r.depth
+             FROM notes n
+             LEFT JOIN (SELECT number, depth FROM note_revisions
+                        WHERE note_id = ? ORDER BY number DESC LIMIT 1) r
+             WHERE n.id = ?"""
+    old = db.query(sql, [note_id, note_id])[0]
+    number, depth = old["number"], old["depth"]
+    if number is None:
+        # edited the first time, the original goes first
+        number, depth = 1, 0
+        insert_revision(note_id, number, depth, old["title"], json.loads(old["classes"]),
+                        compress(old["content"]), old["updated_at"])
+
+    data, depth = compress(content), depth + 1
+    if depth >= config.revision_snapshot_interval:
+        depth = 0
+    else:
+        delta = make_delta(old["content"], content)
+        if len(delta) < len(data):
+            data = delta
+        else:
+            depth = 0
+    insert_revision(note_id, number + 1, depth, title, [list(entry) for entry in classes],
+                    data, now, restored_from)
+    return number + 1
+
+def get_revisions(note_id, before=None, limit=-1):
+    """A note's revisions newest first without their content. before and limit give a page of them."""
+    sql = """SELECT number, depth, title, length(data) AS size, created_at, restored_from
+             FROM note_revisions
+             WHERE note_id = ? AND (? IS NULL OR number < ?)
+             ORDER BY number DESC
+             LIMIT ?"""
+    return db.query(sql, [note_id, before, before, limit])
+
+def get_revision(note_id, number):
+    """Revision number of a note with its content rebuilt from the full copy before it
+    and the deltas after that, None if there's no such revision."""
+    sql = """SELECT r.number, r.depth, r.title, r.classes, r.data, r.created_at, r.restored_from
+             FROM note_revisions t, note_revisions r
+             WHERE t.note_id = ? AND t.number = ?
+               AND r.note_id = t.note_id AND r.number BETWEEN t.number - t.depth AND t.number
+             ORDER BY r.number"""
+    rows = db.query(sql, [note_id, number])
+    if not rows:
+        return None
+    content = decompress(rows[0]["data"])
+    if len(rows) > 1:
+        words = split_words(content)
+        for row in rows[1:]:
+            words = apply_delta(words, row["data"])
+        content = "".join(words)
+    revision = rows[-1]
+    return {"number": revision["number"], "title": revision["title"], "content": content,
+            "classes": [tuple(entry) for entry in json.loads(revision["classes"])],
+            "created_at": revision["created_at"], "restored_from": revision["restored_from"]}
@@ -1,3 +1,6 @@
+-- free pages can be given back with maintenance.py, only settable before the tables
+PRAGMA auto_vacuum = INCREMENTAL;
+
 CREATE TABLE users (
     id INTEGER PRIMARY KEY,
     username TEXT UNIQUE,
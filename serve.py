@@ -0,0 +1,267 @@
+"""
+Production server using only the standard library, so it works offline.
+The listening socket is opened once and shared by several forked worker
+processes, each answering requests from a bounded pool of threads.
+Forking needs Linux or Mac.
+With --asyncio the workers run an asyncio HTTP/1.1 server instead, with
+asgi.py running the requests in the thread pool, so idle keep-alive
+connections don't each hold a thread.
+
+python3 serve.py --port 8000 --workers 4 --threads 8
+python3 serve.py --asyncio --threads 16
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+import os
+import signal
+import socket
+from socketserver import TCPServer
+import sys
+import threading
+from urllib.parse import unquote
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from app import create_app
+from asgi import ThreadPoolASGIApp
+import config
+import db
+import hashing
+
+class QuietHandler(WSGIRequestHandler):
+    """Request handler that doesn't print a line per request."""
+    def log_message(self, format, *args):
+        pass
+
+class PooledWSGIServer(WSGIServer):
+    """wsgiref server that serves requests from a fixed size thread pool
+    on a socket that was already opened by the parent process. Once all threads
+    are busy one more connection waits for a thread and the rest stay in the listen
+    backlog, where another worker can take them, instead of piling up in the pool's queue."""
+
+    def __init__(self, sock, threads, handler):
+        TCPServer.__init__(self, sock.getsockname(), handler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        host, port = sock.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+        self.setup_environ()
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        self.free_threads = threading.Semaphore(threads)
+
+    def process_request(self, request, client_address):
+        self.free_threads.acquire()
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.free_threads.release()
+
+def run_worker(sock, threads, application, access_log):
+    """Serve forever in a worker process."""
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    handler = WSGIRequestHandler if access_log else QuietHandler
+    server = PooledWSGIServer(sock, threads, handler)
+    server.set_app(application)
+    try:
+        server.serve_forever()
+    finally:
+        # the hashing processes would outlive the worker otherwise
+        hashing.shutdown()
+        db.close_pool()
+
+async def serve_connection(reader, writer, asgi_app, server, access_log):
+    """Answer the requests of one HTTP/1.1 connection until it's closed or idle too long.
+    Request bodies need a Content-Length of at most max_body_size, responses without
+    one are sent chunked."""
+    client = writer.get_extra_info("peername")[:2]
+    # asyncio leaves Nagle on for sockets it didn't create, which delays the body
+    # after the headers by the client's delayed ACK
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), config.keepalive_timeout)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, version = lines[0].split(" ")
+                headers = []
+                for line in lines[1:]:
+                    if line:
+                        name, value = line.split(":", 1)
+                        headers.append((name.strip().lower().encode("latin-1"),
+                                        value.strip().encode("latin-1")))
+                fields = dict(headers)
+                length = int(fields.get(b"content-length", 0))
+                if length < 0:
+                    raise ValueError(length)
+            except ValueError:
+                writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+            if b"transfer-encoding" in fields:
+                writer.write(b"HTTP/1.1 411 Length Required\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+            if length > config.max_body_size:
+                writer.write(b"HTTP/1.1 413 Request Entity Too Large\r\nContent-Length: 0\r\n"
+                             b"Connection: close\r\n\r\n")
+                return
+            # a client sending its body slowly gets as long as an idle one
+            try:
+                body = await asyncio.wait_for(reader.readexactly(length), config.keepalive_timeout)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                return
+            connection = fields.get(b"connection", b"").lower()
+            keep_alive = connection != b"close" if version == "HTTP/1.1" else connection == b"keep-alive"
+
+            path, _, query = target.partition("?")
+            scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": version[5:],
+                     "method": method, "scheme": "http", "root_path": "",
+                     "path": unquote(path), "raw_path": path.encode("latin-1"),
+                     "query_string": query.encode("latin-1"), "headers": headers,
+                     "client": client, "server": server}
+            received = False
+            response = {"chunked": False, "status": None}
+
+            async def receive():
+                nonlocal received
+                if received:
+                    # nothing more comes, only a disconnect would
+                    await asyncio.Future()
+                received = True
+                return {"type": "http.request", "body": body, "more_body": False}
+
+            async def send(message):
+                nonlocal keep_alive
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    response["status"] = status
+                    names = {name.lower() for name, _ in message["headers"]}
+                    has_body = method != "HEAD" and status >= 200 and status not in (204, 304)
+                    if has_body and b"content-length" not in names:
+                        if version == "HTTP/1.1":
+                            response["chunked"] = True
+                        else:
+                            keep_alive = False
+                    out = ["HTTP/1.1 " + str(status) + " " + HTTPStatus(status).phrase + "\r\n"]
+                    for name, value in message["headers"]:
+                        out.append(name.decode("latin-1") + ": " + value.decode("latin-1") + "\r\n")
+                    if response["chunked"]:
+                        out.append("Transfer-Encoding: chunked\r\n")
+                    out.append("Connection: " + ("keep-alive" if keep_alive else "close") + "\r\n\r\n")
+                    writer.write("".join(out).encode("latin-1"))
+                else:
+                    data = message.get("body", b"")
+                    if method == "HEAD":
+                        data = b""
+                    if response["chunked"]:
+                        if data:
+                            writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                        if not message.get("more_body", False):
+                            writer.write(b"0\r\n\r\n")
+                    elif data:
+                        writer.write(data)
+                    await writer.drain()
+
+            await asgi_app(scope, receive, send)
+            if access_log:
+                print(client[0], method, target, response["status"], flush=True)
+            if not keep_alive:
+                return
+    except (ConnectionError, asyncio.CancelledError):
+        # the client went away or the worker is stopping
+        pass
+    finally:
+        writer.close()
+
+def run_async_worker(sock, threads, application, access_log):
+    """Serve with asyncio in a worker process until SIGTERM."""
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    asgi_app = ThreadPoolASGIApp(application, threads)
+    server = sock.getsockname()[:2]
+
+    async def serve():
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        listener = await asyncio.start_server(
+            lambda reader, writer: serve_connection(reader, writer, asgi_app, server, access_log),
+            sock=sock)
+        async with listener:
+            await stop.wait()
+        # asyncio.run cancels the open connections after this
+
+    try:
+        asyncio.run(serve())
+    finally:
+        hashing.shutdown()
+        db.close_pool()
+
+def start_worker(sock, threads, application, access_log, use_asyncio=False):
+    """Fork a worker, returns its pid in the parent."""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            if use_asyncio:
+                run_async_worker(sock, threads, application, access_log)
+            else:
+                run_worker(sock, threads, application, access_log)
+        finally:
+            os._exit(0)
+    return pid
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the note app with several worker processes.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--access-log", action="store_true")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="asyncio server for many idle keep-alive clients")
+    args = parser.parse_args()
+
+    if config.pool_size is None:
+        config.pool_size = args.threads + config.pool_spare
+    application = create_app()
+    sock = socket.create_server((args.host, args.port), backlog=1024)
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} "
+          f"{'asyncio ' if args.asyncio else ''}workers of {args.threads} threads", flush=True)
+
+    workers = set()
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(args.workers):
+        workers.add(start_worker(sock, args.threads, application, args.access_log, args.asyncio))
+
+    # restart workers that die unexpectedly until we're told to stop
+    while workers:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            workers.add(start_worker(sock, args.threads, application, args.access_log, args.asyncio))
+
+if __name__ == "__main__":
+    main()
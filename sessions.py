@@ -0,0 +1,101 @@
+"""
+Server side sessions in the sessions table, turned on with
+session_backend = "sqlite" in config.py. The cookie only has a signed session id
+so it stays small and every worker process sees the same session.
+"""
+import secrets
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+import config
+import db
+
+serializer = TaggedJSONSerializer()
+_last_sweep = 0
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its id and whether it changed."""
+
+    def __init__(self, initial=None, session_id=None, expires_at=0):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.session_id = session_id
+        self.expires_at = expires_at
+        self.modified = False
+
+    def regenerate(self):
+        """Drop the stored session and give this one a new id when it's saved, done on
+        login so an id someone got the user to use before doesn't get logged in."""
+        if self.session_id:
+            db.execute("DELETE FROM sessions WHERE id = ?", [self.session_id])
+        self.session_id = None
+        self.modified = True
+
+class SqliteSessionInterface(SessionInterface):
+    """Flask session interface storing the session data in sqlite."""
+
+    def get_signer(self, app):
+        return Signer(app.secret_key, salt="noteapp-session")
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                session_id = self.get_signer(app).unsign(cookie).decode()
+            except BadSignature:
+                session_id = None
+            if session_id:
+                sql = "SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?"
+                result = db.query(sql, [session_id, int(time.time())])
+                if result:
+                    data = serializer.loads(result[0]["data"])
+                    return ServerSession(data, session_id, result[0]["expires_at"])
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add("Cookie")
+        if not session:
+            if session.modified and session.session_id:
+                db.execute("DELETE FROM sessions WHERE id = ?", [session.session_id])
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = int(time.time())
+        # touching the row on every request would be a write per page view,
+        # so unchanged sessions are only extended when half their lifetime is used
+        stale = session.expires_at - now < config.session_lifetime // 2
+        if not session.modified and not stale:
+            return
+
+        if not session.session_id:
+            session.session_id = secrets.token_urlsafe(32)
+        expires_at = now + config.session_lifetime
+        sql = """INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?)
+                 ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at"""
+        db.execute(sql, [session.session_id, serializer.dumps(dict(session)), expires_at])
+        sweep_sessions(now)
+
+        cookie = self.get_signer(app).sign(session.session_id).decode()
+        response.set_cookie(name, cookie,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+def sweep_sessions(now):
+    """Delete expired sessions, at most once per session_sweep_interval in each process."""
+    global _last_sweep
+    if now - _last_sweep < config.session_sweep_interval:
+        return
+    _last_sweep = now
+    db.execute("DELETE FROM sessions WHERE expires_at <= ?", [now])
@@ -0,0 +1,38 @@
+// Username suggestions for the share forms from /complete_username,
+// users shared with before. The browser shows them as a datalist.
+(function () {
+    var input = document.getElementById("username");
+    var list = document.getElementById("username-suggestions");
+    if (!input || !list) {
+        return;
+    }
+    var timer = null;
+    var asked = null;
+
+    function suggest() {
+        var prefix = input.value.trim();
+        if (prefix === asked) {
+            return;
+        }
+        asked = prefix;
+        fetch("/complete_username?prefix=" + encodeURIComponent(prefix))
+            .then(function (response) { return response.ok ? response.json() : {users: []}; })
+            .then(function (data) {
+                if (prefix !== asked) {
+                    return;
+                }
+                list.textContent = "";
+                data.users.forEach(function (user) {
+                    var option = document.createElement("option");
+                    option.value = user.username;
+                    list.appendChild(option);
+                });
+            });
+    }
+
+    input.addEventListener("focus", suggest);
+    input.addEventListener("input", function () {
+        clearTimeout(timer);
+        timer = setTimeout(suggest, 150);
+    });
+})();
@@ -1,9 +1,39 @@
 """
 Similar to the example app users.py except without items, credit there.
-User page notes and stats took some work although stats has some repetition. 
+User page notes and stats took some work.
+Stats are computed in one query and cached per user.
+API tokens are stored as sha256 hashes, they're long and random so a slow hash isn't needed.
+The share form suggests users shared with before by prefix, hot prefixes are cached per process.
 """
-from werkzeug.security import check_password_hash, generate_password_hash
+from collections import OrderedDict
+from datetime import datetime
+import hashlib
+import secrets
+import string
+import threading
+import time
+
+import config
 import db
+import hashing
+import notes
+
+_stats_cache = OrderedDict()
+_stats_lock = threading.Lock()
+stats_cache_stats = {"hits": 0, "misses": 0}
+
+_prefix_cache = OrderedDict()
+_prefix_lock = threading.Lock()
+prefix_cache_stats = {"hits": 0, "misses": 0}
+
+# NOCASE only folds ASCII letters, prefixes are cached folded the same way
+_FOLD = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# the user page stats, benchmark/plans.py checks its plan
+NOTE_STATS_SQL = """SELECT status, priority, context, COUNT(*) AS count
+                    FROM notes
+                    WHERE user_id = ?
+                    GROUP BY status, priority, context"""
 
 def get_user(user_id):
     """Get user by id."""
@@ -19,12 +49,52 @@ def get_user_by_username(username):
 
 def create_user(username, password):
     """Create user with username and hashed password."""
-    password_hash = generate_password_hash(password)
+    password_hash = hashing.hash_password(password)
     sql = "INSERT INTO users (username, password_hash) VALUES (?, ?)"
     db.execute(sql, [username, password_hash])
 
+def prefix_range(prefix):
+    """Bounds for username >= ? AND username < ? on the NOCASE share_targets.username,
+    a range of the share_targets_username index. Unlike LIKE, _ and % need no escaping."""
+    return [prefix, prefix + chr(0x10FFFF)]
+
+def complete_username(user_id, prefix):
+    """Suggestions for sharing a note: users user_id has shared notes with before whose
+    name starts with prefix in any case, most shared with first. Nobody else, so it can't
+    be used to list everyone's usernames. A user's hot prefixes are kept in an LRU for
+    username_cache_seconds, someone shared with for the first time shows up after that."""
+    key = (user_id, prefix.translate(_FOLD))
+    now = time.monotonic()
+    with _prefix_lock:
+        cached = _prefix_cache.get(key)
+        if cached and now - cached[0] < config.username_cache_seconds:
+            _prefix_cache.move_to_end(key)
+            prefix_cache_stats["hits"] += 1
+            return [{"id": found_id, "username": username} for found_id, username in cached[1]]
+        prefix_cache_stats["misses"] += 1
+
+    # An empty or one letter prefix matches many of someone's share targets, walking
+    # them most shared first finds enough soon. Longer ones match few, their username
+    # range is shorter. The planner can't tell which from the bounds, so it's told.
+    index = "share_targets_shares" if len(prefix) < 2 else "share_targets_username"
+    sql = f"""SELECT user_id AS id, username
+              FROM share_targets INDEXED BY {index}
+              WHERE owner_id = ? AND username >= ? AND username < ?
+              ORDER BY shares DESC, username
+              LIMIT ?"""
+    rows = db.query(sql, [user_id] + prefix_range(prefix) + [config.username_suggestions])
+    found = tuple((row["id"], row["username"]) for row in rows)
+    with _prefix_lock:
+        _prefix_cache[key] = (now, found)
+        _prefix_cache.move_to_end(key)
+        while len(_prefix_cache) > config.username_cache_size:
+            _prefix_cache.popitem(last=False)
+    return [{"id": found_id, "username": username} for found_id, username in found]
+
 def check_login(username, password):
-    """Checking username and password correctness."""
+    """Checking username and password correctness.
+    Hashes made with old parameters are replaced on a successful login,
+    when the hashing workers are busy the old one is kept until a later one."""
     sql = "SELECT id, password_hash FROM users WHERE username = ?"
     result = db.query(sql, [username])
     if not result:
@@ -32,70 +102,83 @@ def check_login(username, password):
 
     user_id = result[0]["id"]
     password_hash = result[0]["password_hash"]
-    if check_password_hash(password_hash, password):
+    if hashing.check_password(password_hash, password):
+        if hashing.needs_rehash(password_hash):
+            try:
+                new_hash = hashing.hash_password(password)
+            except hashing.Busy:
+                return user_id
+            sql = "UPDATE users SET password_hash = ? WHERE id = ?"
+            db.execute(sql, [new_hash, user_id])
         return user_id
     else:
         return None
 
-def get_notes(user_id):
-    """Get all of a user's notes."""
-    sql = """SELECT n.id, n.title, n.updated_at,
-                    (SELECT value FROM note_classes WHERE note_id = n.id AND title = 'Status'  LIMIT 1) AS status,
-                    (SELECT value FROM note_classes WHERE note_id = n.id AND title = 'Priority' LIMIT 1) AS priority,
-                    (SELECT value FROM note_classes WHERE note_id = n.id AND title = 'Context'  LIMIT 1) AS context,
-                    EXISTS(SELECT 1 FROM shares s WHERE s.note_id = n.id) AS shared
-             FROM notes n
-             WHERE n.user_id = ?
-             ORDER BY n.updated_at DESC, n.id DESC"""
-    return db.query(sql, [user_id])
+def get_notes(user_id, before=None, after=None, limit=None):
+    """Get a page of a user's notes."""
+    return db.query_page(notes.USER_NOTES_SQL, [user_id], limit or config.page_size, before, after, notes.NoteRow)
+
+def get_notes_version(user_id):
+    """Counter that changes whenever the user's notes or notes shared with them change."""
+    result = db.query("SELECT notes_version FROM users WHERE id = ?", [user_id])
+    return result[0]["notes_version"] if result else 0
 
 def get_note_stats(user_id):
-    """Get stats about a user's notes for the userpage stats display."""
-    sql = "SELECT COUNT(*) AS total FROM notes WHERE user_id = ?"
-    total = db.query(sql, [user_id])[0]["total"]
-
-    sql = """SELECT COALESCE(
-                     (SELECT value
-                        FROM note_classes
-                       WHERE note_id = n.id AND title = 'Status'
-                       LIMIT 1),
-                     'Unassigned') AS value,
-                    COUNT(*) AS count
-             FROM notes n
-             WHERE n.user_id = ?
-             GROUP BY value
-             ORDER BY (value='Unassigned'), value"""
-    by_status = db.query(sql, [user_id])
-
-    sql = """SELECT COALESCE(
-                     (SELECT value
-                        FROM note_classes
-                       WHERE note_id = n.id AND title = 'Priority'
-                       LIMIT 1),
-                     'Unassigned') AS value,
-                    COUNT(*) AS count
-             FROM notes n
-             WHERE n.user_id = ?
-             GROUP BY value
-             ORDER BY (value='Unassigned'), value"""
-    by_priority = db.query(sql, [user_id])
-
-    sql = """SELECT COALESCE(
-                     (SELECT value
-                        FROM note_classes
-                       WHERE note_id = n.id AND title = 'Context'
-                       LIMIT 1),
-                     'Unassigned') AS value,
-                    COUNT(*) AS count
-             FROM notes n
-             WHERE n.user_id = ?
-             GROUP BY value
-             ORDER BY (value='Unassigned'), value"""
-    by_context = db.query(sql, [user_id])
+    """Get stats about a user's notes for the userpage stats display.
+    Cached until the user's notes_version changes, so any process writing a note
+    invalidates it."""
+    version = get_notes_version(user_id)
+    with _stats_lock:
+        cached = _stats_cache.get(user_id)
+        if cached and cached[0] == version:
+            _stats_cache.move_to_end(user_id)
+            stats_cache_stats["hits"] += 1
+            return cached[1]
+        stats_cache_stats["misses"] += 1
+
+    stats = compute_note_stats(user_id)
+    with _stats_lock:
+        _stats_cache[user_id] = (version, stats)
+        _stats_cache.move_to_end(user_id)
+        while len(_stats_cache) > config.stats_cache_size:
+            _stats_cache.popitem(last=False)
+    return stats
+
+def compute_note_stats(user_id):
+    """All the stats in one pass over the user's notes, grouped by every class combination."""
+    total = 0
+    counts = {"status": {}, "priority": {}, "context": {}}
+    for row in db.iter_query(NOTE_STATS_SQL, [user_id]):
+        total += row["count"]
+        for column in counts:
+            value = row[column] or "Unassigned"
+            counts[column][value] = counts[column].get(value, 0) + row["count"]
+
+    def breakdown(column):
+        values = sorted(counts[column], key=lambda value: (value == "Unassigned", value))
+        return [{"value": value, "count": counts[column][value]} for value in values]
 
     return {
         "total": total,
-        "by_status": by_status,
-        "by_priority": by_priority,
-        "by_context": by_context,
+        "by_status": breakdown("status"),
+        "by_priority": breakdown("priority"),
+        "by_context": breakdown("context"),
     }
+
+def create_token(user_id):
+    """New API token for the user. Only its hash is saved so it can't be shown again."""
+    token = secrets.token_urlsafe(32)
+    sql = "INSERT INTO api_tokens (token_hash, user_id, created_at) VALUES (?, ?, ?)"
+    db.execute(sql, [hashlib.sha256(token.encode()).hexdigest(), user_id, datetime.now().isoformat()])
+    return token
+
+def get_token_user(token):
+    """Id of the user the API token belongs to, None if there's no such token."""
+    sql = "SELECT user_id FROM api_tokens WHERE token_hash = ?"
+    result = db.query(sql, [hashlib.sha256(token.encode()).hexdigest()])
+    return result[0]["user_id"] if result else None
+
+def remove_token(token):
+    """Revoke an API token."""
+    sql = "DELETE FROM api_tokens WHERE token_hash = ?"
+    db.execute(sql, [hashlib.sha256(token.encode()).hexdigest()])
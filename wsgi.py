@@ -0,0 +1,8 @@
+"""
+WSGI entry point for production servers, for example:
+gunicorn --workers 4 --threads 8 wsgi:application
+serve.py does the same with only the standard library.
+"""
+from app import create_app
+
+application = create_app()